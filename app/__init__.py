@@ -1,9 +1,38 @@
+import click
 from flask import Flask
 from app.config import load_configurations, configure_logging
 from .views import webhook_blueprint
+from .decorators.status_updates import StatusCounter, register_status_hook
+from .utils.bulk_import import import_vocab_command
+from .utils.dedup import init_deduplicator
+from .utils.job_queue import init_job_queue
+from .utils.metrics import init_metrics, traced
+from .utils.outbox import init_outbox
+from .utils.profiler import profiled
+from .utils.tenants import (
+    add_tenant_command, init_tenant_registry, message_sender, remove_tenant_command, tenant_scoped,
+)
+from .utils.vocab_store import init_vocab_store
+from .utils.wiktionary_index import build_wiktionary_index_command
+from .utils.whatsapp_utils import process_whatsapp_message
 
 
-def create_app():
+def loaded_by_cli_command():
+    """
+    Whether the app is being loaded for a `flask` command other than `flask run`.
+    """
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.info_name != "run"
+
+
+def create_app(start_workers=None):
+    """
+    Build the app. The background services (job workers, outbox, sheet sync,
+    message ID purge) are started unless `start_workers` is false, which by
+    default it is for command line tools: they only need the stores.
+    """
+    if start_workers is None:
+        start_workers = not loaded_by_cli_command()
     app = Flask(__name__)
 
     # Load configurations and logging settings
@@ -13,4 +42,40 @@ def create_app():
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Command line tools, e.g. `flask --app run import-vocab words.csv`
+    app.cli.add_command(import_vocab_command)
+    app.cli.add_command(add_tenant_command)
+    app.cli.add_command(remove_tenant_command)
+    app.cli.add_command(build_wiktionary_index_command)
+
+    # Counters and histograms for /metrics, gauges read from the components below
+    init_metrics(app)
+
+    # Learners served, each with their own vocabulary and sheet
+    init_tenant_registry(app)
+
+    # Open the local vocabulary store and sync it to the sheets
+    init_vocab_store(app, start=start_workers)
+
+    # Count delivery receipts if asked to
+    if app.config["STATUS_METRICS_ENABLED"]:
+        status_counter = StatusCounter()
+        app.extensions["status_counter"] = status_counter
+        register_status_hook(app, status_counter)
+
+    # Remember which webhook deliveries were already accepted
+    init_deduplicator(app, start=start_workers)
+
+    # Send replies in the background, within Meta's rate limits
+    init_outbox(app, start=start_workers)
+
+    # Start the workers that process messages after the webhook has answered,
+    # each sender's messages one at a time and in order
+    init_job_queue(
+        app,
+        traced(profiled(tenant_scoped(process_whatsapp_message))),
+        partition_key=message_sender,
+        start=start_workers,
+    )
+
     return app
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+from app import create_app
+from .decorators.security import validate_signature
+from .decorators.status_updates import answer_status_update, is_status_only
+from .utils.lifecycle import shutdown_app, warm_up
+from .views import accept_webhook, check_verification, render_metrics
+
+
+def _in_app_context(flask_app, f, *args):
+    with flask_app.app_context():
+        return f(*args)
+
+
+async def webhook_get(request):
+    flask_app = request.app["flask_app"]
+    response, status = _in_app_context(
+        flask_app,
+        check_verification,
+        request.query.get("hub.mode"),
+        request.query.get("hub.verify_token"),
+        request.query.get("hub.challenge"),
+    )
+    if isinstance(response, dict):
+        return web.json_response(response, status=status)
+    return web.Response(text=response, status=status)
+
+
+async def webhook_post(request):
+    """
+    Same contract as the Flask webhook: status-only payloads are answered from
+    the raw bytes, messages are checked, deduplicated and queued. Only the
+    deduplication and queueing, which may wait on disk or Datastore, leave the
+    event loop.
+    """
+    flask_app = request.app["flask_app"]
+    payload = await request.read()
+    signature = request.headers.get("X-Hub-Signature-256", "")[7:]  # Removing 'sha256='
+
+    if is_status_only(payload):
+        response, status = _in_app_context(flask_app, answer_status_update, payload, signature)
+        return web.json_response(response, status=status)
+
+    if not _in_app_context(flask_app, validate_signature, payload, signature):
+        logging.info("Signature verification failed!")
+        return web.json_response({"status": "error", "message": "Invalid signature"}, status=403)
+
+    try:
+        body = json.loads(payload)
+    except json.JSONDecodeError:
+        logging.error("Failed to decode JSON")
+        return web.json_response({"status": "error", "message": "Invalid JSON provided"})
+
+    profile = request.headers.get("X-Profile") == "1"
+    response, status = await asyncio.to_thread(_in_app_context, flask_app, accept_webhook, body, profile)
+    return web.json_response(response, status=status)
+
+
+async def metrics(request):
+    # Collectors may read SQLite (queue depth, pending sheet operations)
+    body, status = await asyncio.to_thread(
+        _in_app_context, request.app["flask_app"], render_metrics, request.headers.get("Authorization")
+    )
+    return web.Response(body=body.encode(), status=status, headers={"Content-Type": "text/plain; version=0.0.4"})
+
+
+async def _shutdown(aio_app):
+    await asyncio.to_thread(shutdown_app, aio_app["flask_app"])
+
+
+async def create_aio_app():
+    """
+    aiohttp application serving the webhook, for `SERVER_MODE=async`.
+
+    The Flask app is still built for its config and background workers, but
+    requests are handled on the event loop, so one worker holds many slow
+    connections without a thread each.
+    """
+    flask_app = create_app()
+    await asyncio.to_thread(warm_up, flask_app)
+    aio_app = web.Application()
+    aio_app["flask_app"] = flask_app
+    aio_app.router.add_get("/webhook", webhook_get)
+    aio_app.router.add_post("/webhook", webhook_post)
+    aio_app.router.add_get("/metrics", metrics)
+    aio_app.on_shutdown.append(_shutdown)
+    return aio_app
@@ -15,6 +15,132 @@ def load_configurations(app):
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
 
+    # Google Sheets vocabulary database
+    app.config["GOOGLE_SHEETS_CREDENTIALS"] = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
+    app.config["VOCAB_SPREADSHEET_KEY"] = os.getenv(
+        "VOCAB_SPREADSHEET_KEY", "1CloiuVCnGD38rPQogj1eG_yHAcQ7uxuQ4ICD_CswHhw"
+    )
+    app.config["SHEETS_TOKEN_REFRESH_MARGIN"] = int(os.getenv("SHEETS_TOKEN_REFRESH_MARGIN", 300))
+
+    # Learners other than RECIPIENT_WAID (flask add-tenant), and what to do with messages from
+    # unregistered senders: treat them as the default learner's, as before tenants, or "ignore" them
+    app.config["TENANTS_PATH"] = os.getenv("TENANTS_PATH", "data/tenants.sqlite3")
+    app.config["TENANT_UNKNOWN_SENDERS"] = os.getenv("TENANT_UNKNOWN_SENDERS", "default")
+    app.config["TENANT_DEFAULT_LANGUAGE"] = os.getenv("TENANT_DEFAULT_LANGUAGE") or None
+    app.config["TENANT_MEMORY_ITEMS"] = int(os.getenv("TENANT_MEMORY_ITEMS", 4096))
+    app.config["TENANT_CACHE_TTL"] = float(os.getenv("TENANT_CACHE_TTL", 60))
+    # Worksheet handles kept open, one per tenant spreadsheet
+    app.config["SHEETS_CACHE_ITEMS"] = int(os.getenv("SHEETS_CACHE_ITEMS", 256))
+
+    # Local vocabulary store, replicated to the sheet in the background
+    app.config["VOCAB_STORE_PATH"] = os.getenv("VOCAB_STORE_PATH", "data/vocab.sqlite3")
+    app.config["VOCAB_SYNC_ENABLED"] = os.getenv("VOCAB_SYNC_ENABLED", "true").lower() == "true"
+    app.config["VOCAB_SYNC_INTERVAL"] = float(os.getenv("VOCAB_SYNC_INTERVAL", 2))
+    app.config["VOCAB_SYNC_BATCH_SIZE"] = int(os.getenv("VOCAB_SYNC_BATCH_SIZE", 100))
+
+    # Concurrent dictionary lookups for multi-word messages
+    app.config["VOCAB_FANOUT_WORKERS"] = int(os.getenv("VOCAB_FANOUT_WORKERS", 8))
+    app.config["MW_MAX_PARALLEL"] = int(os.getenv("MW_MAX_PARALLEL", 4))
+    app.config["WIKTIONARY_MAX_PARALLEL"] = int(os.getenv("WIKTIONARY_MAX_PARALLEL", 2))
+    # Query both Merriam-Webster dictionaries at once for new words when this share of lookups falls back
+    app.config["MW_PARALLEL_THRESHOLD"] = float(os.getenv("MW_PARALLEL_THRESHOLD", 0.25))
+    # Requests per second allowed to each upstream on a cache miss (0 = no limit)
+    app.config["MW_MAX_RATE"] = float(os.getenv("MW_MAX_RATE", 0))
+    app.config["WIKTIONARY_MAX_RATE"] = float(os.getenv("WIKTIONARY_MAX_RATE", 0))
+
+    # Bulk vocabulary import (flask import-vocab)
+    app.config["IMPORT_WORKERS"] = int(os.getenv("IMPORT_WORKERS", 16))
+    app.config["IMPORT_CHUNK_SIZE"] = int(os.getenv("IMPORT_CHUNK_SIZE", 200))
+
+    # Upstream API base URLs, overridden to point at local stand-ins for load tests
+    app.config["GRAPH_API_URL"] = os.getenv("GRAPH_API_URL", "https://graph.facebook.com")
+    app.config["MW_API_URL"] = os.getenv("MW_API_URL", "https://www.dictionaryapi.com/api/v3")
+    app.config["WIKTIONARY_EN_API_URL"] = os.getenv("WIKTIONARY_EN_API_URL", "https://en.wiktionary.org/w/api.php")
+    app.config["WIKTIONARY_FR_API_URL"] = os.getenv("WIKTIONARY_FR_API_URL", "https://fr.wiktionary.org/w/api.php")
+
+    # Offline indexes built with `flask build-wiktionary-index`, tried before the APIs above (empty: none)
+    app.config["WIKTIONARY_EN_INDEX_PATH"] = os.getenv("WIKTIONARY_EN_INDEX_PATH", "data/wiktionary_en.idx")
+    app.config["WIKTIONARY_FR_INDEX_PATH"] = os.getenv("WIKTIONARY_FR_INDEX_PATH", "data/wiktionary_fr.idx")
+    app.config["SHEETS_API_URL"] = os.getenv("SHEETS_API_URL", "")
+
+    # Outbound HTTP: per-host pools, timeouts ("host=connect/read;..."), retries and circuit breaker
+    app.config["HTTP_TIMEOUTS"] = os.getenv("HTTP_TIMEOUTS", "")
+    app.config["HTTP_CONNECT_TIMEOUT"] = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+    app.config["HTTP_READ_TIMEOUT"] = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+    app.config["HTTP_POOL_SIZE"] = int(os.getenv("HTTP_POOL_SIZE", 10))
+    app.config["HTTP_MAX_RETRIES"] = int(os.getenv("HTTP_MAX_RETRIES", 3))
+    app.config["HTTP_BACKOFF_BASE"] = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))
+    app.config["HTTP_BACKOFF_MAX"] = float(os.getenv("HTTP_BACKOFF_MAX", 8))
+    app.config["HTTP_BREAKER_THRESHOLD"] = int(os.getenv("HTTP_BREAKER_THRESHOLD", 5))
+    app.config["HTTP_BREAKER_RESET"] = float(os.getenv("HTTP_BREAKER_RESET", 30))
+
+    # Outgoing WhatsApp messages: durable outbox, per-recipient rate (messages/s, 0 = no limit)
+    # and the window within which short replies to the same recipient are merged
+    app.config["OUTBOX_PATH"] = os.getenv("OUTBOX_PATH", "data/outbox.sqlite3")
+    app.config["OUTBOX_RATE"] = float(os.getenv("OUTBOX_RATE", 1))
+    app.config["OUTBOX_BURST"] = int(os.getenv("OUTBOX_BURST", 5))
+    app.config["OUTBOX_COALESCE_WINDOW"] = float(os.getenv("OUTBOX_COALESCE_WINDOW", 0.3))
+    app.config["OUTBOX_WORKERS"] = int(os.getenv("OUTBOX_WORKERS", 4))
+    app.config["OUTBOX_MAX_ATTEMPTS"] = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+    app.config["OUTBOX_RETRY_BACKOFF"] = float(os.getenv("OUTBOX_RETRY_BACKOFF", 2))
+
+    # Voice notes for say/dis (WhatsApp media IDs expire after 30 days)
+    app.config["AUDIO_CACHE_DIR"] = os.getenv("AUDIO_CACHE_DIR", "data/audio")
+    app.config["AUDIO_CACHE_MAX_BYTES"] = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+    app.config["AUDIO_MEDIA_ID_TTL"] = int(os.getenv("AUDIO_MEDIA_ID_TTL", 29 * 86400))
+    app.config["TTS_PIPELINE"] = os.getenv("TTS_PIPELINE", "stream")
+
+    # Webhook deduplication: "datastore" (Cloud Datastore) or "sqlite" (local file), both atomic across workers
+    app.config["DEDUP_BACKEND"] = os.getenv("DEDUP_BACKEND", "datastore")
+    app.config["DEDUP_SQLITE_PATH"] = os.getenv("DEDUP_SQLITE_PATH", "data/message_ids.sqlite3")
+    app.config["DEDUP_TTL"] = int(os.getenv("DEDUP_TTL", 7 * 86400))
+    app.config["DEDUP_MEMORY_ITEMS"] = int(os.getenv("DEDUP_MEMORY_ITEMS", 10000))
+
+    # Count sent/delivered/read/failed receipts from status webhooks
+    app.config["STATUS_METRICS_ENABLED"] = os.getenv("STATUS_METRICS_ENABLED", "false").lower() == "true"
+
+    # Prometheus metrics at /metrics, behind a bearer token if METRICS_TOKEN is set
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+
+    # Sampling profiler for webhooks sent with an "X-Profile: 1" header, or a random share of them
+    app.config["PROFILE_ENABLED"] = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+    app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+    app.config["PROFILE_INTERVAL"] = float(os.getenv("PROFILE_INTERVAL", 0.005))
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR", "data/profiles")
+
+    # Production serving: per-worker warm-up and how long shutdown may spend draining work
+    app.config["WARM_UP_ENABLED"] = os.getenv("WARM_UP_ENABLED", "true").lower() == "true"
+    app.config["WARM_UP_BACKGROUND"] = os.getenv("WARM_UP_BACKGROUND", "true").lower() == "true"
+    app.config["SHUTDOWN_TIMEOUT"] = float(os.getenv("SHUTDOWN_TIMEOUT", 25))
+
+    # Background processing of incoming messages
+    app.config["JOB_QUEUE_BACKEND"] = os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+    app.config["JOB_QUEUE_PATH"] = os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+    app.config["JOB_QUEUE_WORKERS"] = int(os.getenv("JOB_QUEUE_WORKERS", 2))
+    app.config["JOB_QUEUE_MAX_RETRIES"] = int(os.getenv("JOB_QUEUE_MAX_RETRIES", 3))
+    app.config["JOB_QUEUE_RETRY_BACKOFF"] = float(os.getenv("JOB_QUEUE_RETRY_BACKOFF", 2))
+    app.config["JOB_QUEUE_VISIBILITY_TIMEOUT"] = int(os.getenv("JOB_QUEUE_VISIBILITY_TIMEOUT", 300))
+
+    # Dictionary lookup cache (TTLs in seconds)
+    app.config["DEF_CACHE_ENABLED"] = os.getenv("DEF_CACHE_ENABLED", "true").lower() == "true"
+    app.config["DEF_CACHE_PATH"] = os.getenv("DEF_CACHE_PATH", "data/definitions.sqlite3")
+    app.config["DEF_CACHE_MEMORY_ITEMS"] = int(os.getenv("DEF_CACHE_MEMORY_ITEMS", 1024))
+    app.config["DEF_CACHE_DISK_MAX_ITEMS"] = int(os.getenv("DEF_CACHE_DISK_MAX_ITEMS", 50000))
+    app.config["DEF_CACHE_TTL_MW"] = int(os.getenv("DEF_CACHE_TTL_MW", 30 * 86400))
+    app.config["DEF_CACHE_TTL_WIKTIONARY"] = int(os.getenv("DEF_CACHE_TTL_WIKTIONARY", 7 * 86400))
+    # Merriam-Webster dictionary that answered a word, outliving its cached definitions
+    app.config["DEF_CACHE_TTL_MW_ROUTE"] = int(os.getenv("DEF_CACHE_TTL_MW_ROUTE", 180 * 86400))
+    app.config["DEF_CACHE_NEGATIVE_TTL"] = int(os.getenv("DEF_CACHE_NEGATIVE_TTL", 86400))
+
+    # Known headwords, for "did you mean" suggestions when a lookup finds nothing
+    app.config["HEADWORDS_ENABLED"] = os.getenv("HEADWORDS_ENABLED", "true").lower() == "true"
+    app.config["HEADWORDS_PATH"] = os.getenv("HEADWORDS_PATH", "data/headwords.sqlite3")
+    app.config["HEADWORDS_MEMORY_ITEMS"] = int(os.getenv("HEADWORDS_MEMORY_ITEMS", 20000))
+    app.config["HEADWORDS_SUGGESTIONS"] = int(os.getenv("HEADWORDS_SUGGESTIONS", 3))
+    # How long a miss for a word already defined once is cached (seconds)
+    app.config["HEADWORDS_KNOWN_NEGATIVE_TTL"] = int(os.getenv("HEADWORDS_KNOWN_NEGATIVE_TTL", 600))
+
 
 def configure_logging():
     logging.basicConfig(
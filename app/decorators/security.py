@@ -9,10 +9,14 @@ def validate_signature(payload, signature):
     """
     Validate the incoming payload's signature against our expected signature
     """
+    # Hash the raw request bytes directly: decoding and re-encoding them is wasted work
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+
     # Use the App Secret to hash the payload
     expected_signature = hmac.new(
         bytes(current_app.config["APP_SECRET"], "latin-1"),
-        msg=payload.encode("utf-8"),
+        msg=payload,
         digestmod=hashlib.sha256,
     ).hexdigest()
 
@@ -30,7 +34,7 @@ def signature_required(f):
         signature = request.headers.get("X-Hub-Signature-256", "")[
             7:
         ]  # Removing 'sha256='
-        if not validate_signature(request.data.decode("utf-8"), signature):
+        if not validate_signature(request.get_data(), signature):
             logging.info("Signature verification failed!")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         return f(*args, **kwargs)
@@ -0,0 +1,90 @@
+from functools import wraps
+from flask import current_app, jsonify, request
+import logging
+import re
+import threading
+from collections import Counter
+
+from .security import validate_signature
+
+
+# Keys as they appear in the raw JSON. An escaped quote can't close a string
+# value early, so these can't be matched inside a user's message text.
+STATUSES_KEY = b'"statuses"'
+MESSAGES_KEY = b'"messages"'
+STATUS_VALUE_PATTERN = re.compile(rb'"status"\s*:\s*"([a-z_]+)"')
+
+
+def is_status_only(payload):
+    """
+    Tell from the raw bytes whether a webhook only carries sent/delivered/read/failed statuses.
+    """
+    return STATUSES_KEY in payload and MESSAGES_KEY not in payload
+
+
+class StatusCounter:
+    """
+    Status hook counting delivery receipts by status (sent, delivered, read, failed).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def __call__(self, statuses):
+        with self._lock:
+            self._counts.update(statuses)
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def register_status_hook(app, hook):
+    """
+    Call `hook(statuses)` with the list of status values of every status-only webhook.
+    """
+    app.extensions.setdefault("status_hooks", []).append(hook)
+
+
+def answer_status_update(payload, signature):
+    """
+    Acknowledge a status-only webhook, feeding its status values to the hooks if any.
+
+    Returns a JSON-serializable dict and an HTTP status code.
+    """
+    hooks = current_app.extensions.get("status_hooks")
+    if hooks:
+        if not validate_signature(payload, signature):
+            logging.info("Signature verification failed!")
+            return {"status": "error", "message": "Invalid signature"}, 403
+        statuses = [value.decode("ascii") for value in STATUS_VALUE_PATTERN.findall(payload)]
+        for hook in hooks:
+            try:
+                hook(statuses)
+            except Exception as e:
+                logging.warning(f"Status hook failed: {e}")
+    return {"status": "ok"}, 200
+
+
+def acknowledge_status_updates(f):
+    """
+    Decorator answering status-only webhooks before any JSON parsing or signature work.
+
+    Every message we send triggers three of these (sent, delivered, read) and
+    none of them leads to any action. They are recognised on the raw bytes and
+    acknowledged straight away. Only when status hooks are registered is the
+    signature checked and the status values pulled out with a regex, still
+    without parsing the JSON.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        payload = request.get_data()
+        if not is_status_only(payload):
+            return f(*args, **kwargs)
+        signature = request.headers.get("X-Hub-Signature-256", "")[7:]  # Removing 'sha256='
+        response, status = answer_status_update(payload, signature)
+        return jsonify(response), status
+
+    return decorated_function
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+
+from flask import current_app
+
+from .sqlite_utils import SQLiteDatabase
+
+
+class AudioCache:
+    """
+    Content-addressed cache for the voice notes sent by `say` and `dis`.
+
+    Encoded Opus files are stored on disk under the hash of (lang, normalized
+    text) and evicted least-recently-used first once the directory grows past
+    `max_bytes`. The WhatsApp media ID returned by the upload is remembered
+    next to it until shortly before Meta expires it, so a repeated phrase can
+    be sent without synthesis, transcoding or upload.
+    """
+
+    def __init__(self, directory, max_bytes, media_ttl):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.media_ttl = media_ttl
+        self._lock = threading.Lock()
+        self._size = sum(
+            entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".opus")
+        )
+        self.db = SQLiteDatabase(os.path.join(directory, "media_ids.sqlite3"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS media_ids (key TEXT PRIMARY KEY, media_id TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def key(lang, text):
+        normalized = " ".join(unicodedata.normalize("NFC", text).lower().split())
+        return hashlib.sha256(f"{lang}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.opus")
+
+    def get_audio(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        # The modification time doubles as the last-used time for eviction
+        os.utime(path)
+        return audio
+
+    def put_audio(self, key, audio):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(audio) - previous
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".opus")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
+            self.forget_media_id(entry.name[: -len(".opus")])
+            logging.info(f"Evicted cached audio {entry.name}")
+
+    def get_media_id(self, key):
+        row = self.db.execute(
+            "SELECT media_id FROM media_ids WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_media_id(self, key, media_id):
+        self.db.execute(
+            "INSERT OR REPLACE INTO media_ids (key, media_id, expires_at) VALUES (?, ?, ?)",
+            (key, media_id, time.time() + self.media_ttl),
+        )
+
+    def forget_media_id(self, key):
+        self.db.execute("DELETE FROM media_ids WHERE key = ?", (key,))
+
+
+def get_audio_cache():
+    cache = current_app.extensions.get("audio_cache")
+    if cache is None:
+        config = current_app.config
+        cache = AudioCache(
+            config["AUDIO_CACHE_DIR"],
+            max_bytes=config["AUDIO_CACHE_MAX_BYTES"],
+            media_ttl=config["AUDIO_MEDIA_ID_TTL"],
+        )
+        cache = current_app.extensions.setdefault("audio_cache", cache)
+    return cache
@@ -0,0 +1,221 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .definition_cache import get_definition_cache
+from .tenants import DEFAULT_TENANT, get_tenant_registry
+from .vocab_store import get_vocab_store
+from .whatsapp_utils import lookup_definition
+
+
+def read_import_file(path, default_language=None):
+    """
+    Read the words to import as (language, text) pairs, text being what a user
+    would send after "vocab <language>", e.g. 'berger (noun) "le berger"'.
+
+    A .csv file needs a `word` column and may have `language`, `category` and
+    `quote` columns. Any other file is a plain list with one word per line,
+    optionally followed by its category in parentheses. Repeated words are
+    only kept once.
+    """
+    rows = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.lower().endswith(".csv"):
+            for record in csv.DictReader(f):
+                record = {key.strip().lower(): (value or "").strip() for key, value in record.items() if key}
+                text = record.get("word", "")
+                if record.get("category"):
+                    text += f" ({record['category']})"
+                if record.get("quote"):
+                    text += f' "{record["quote"]}"'
+                rows.append((record.get("language") or default_language, text))
+        else:
+            rows = [(default_language, line.strip()) for line in f]
+
+    unique_rows, seen = [], set()
+    for language, text in rows:
+        if not text or text.startswith("#"):
+            continue
+        if not language:
+            raise click.UsageError(f"No language given for {text!r}: add a language column or pass --language")
+        key = (language.lower(), text.lower())
+        if key not in seen:
+            seen.add(key)
+            unique_rows.append((language.lower(), text))
+    return unique_rows
+
+
+def rows_digest(rows):
+    """
+    SHA-256 of the rows to import, in order, to tie a checkpoint to them.
+    """
+    digest = hashlib.sha256()
+    for language, text in rows:
+        digest.update(f"{language}\t{text}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class BulkImporter:
+    """
+    Seeds the vocabulary store from a word list.
+
+    Words are looked up concurrently, through the same dictionary lookups,
+    caches and per-upstream limits as WhatsApp messages. Each chunk of results
+    is saved with one `add_entries` call, which the sheet sync then appends in
+    batches. A checkpoint file records how far the import got, so that an
+    interrupted import picks up where it stopped.
+    """
+
+    def __init__(
+        self, app, rows, checkpoint_path, rejected_path, workers=16, chunk_size=200, skip_existing=True,
+        tenant=DEFAULT_TENANT,
+    ):
+        self.app = app
+        self.tenant = tenant
+        self.rows = rows
+        self.checkpoint_path = checkpoint_path
+        self.rejected_path = rejected_path
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.skip_existing = skip_existing
+        self.progress = {
+            "total": len(rows), "done": 0, "saved": 0, "skipped": 0, "rejected": 0, "rows_sha256": rows_digest(rows),
+        }
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        # Progress is an offset into the rows, only meaningful for the exact same rows
+        if checkpoint.get("rows_sha256") != self.progress["rows_sha256"]:
+            raise click.ClickException(
+                f"{self.checkpoint_path} was written for a different word list, delete it or pass --restart"
+            )
+        self.progress = checkpoint
+
+    def save_checkpoint(self):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _lookup(self, row):
+        language, text = row
+        with self.app.app_context():
+            try:
+                return lookup_definition(language, text)
+            except Exception as e:
+                logging.warning(f"Lookup of {text!r} failed: {e}")
+                return text, None, None, None, f"Lookup failed: {type(e).__name__}: {e}"
+
+    def _already_saved(self, store, language, word, cat):
+        entry = store.find_latest_by_word(word, language, self.tenant)
+        return entry is not None and entry["category"] == cat
+
+    def _save_chunk(self, chunk, results):
+        store = get_vocab_store()
+        entries, rejected = [], []
+        for (language, text), (word, cat, word_definition, quote, error_message) in zip(chunk, results):
+            if error_message is not None or cat is None or word_definition is None:
+                rejected.append((language, text, error_message or "Retrieval failed."))
+            elif self.skip_existing and self._already_saved(store, language, word, cat):
+                self.progress["skipped"] += 1
+            else:
+                entries.append((language, word, cat, word_definition, quote))
+        if entries:
+            store.add_entries(entries, self.tenant)
+        if rejected:
+            with open(self.rejected_path, "a", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rejected)
+        self.progress["saved"] += len(entries)
+        self.progress["rejected"] += len(rejected)
+        self.progress["done"] += len(chunk)
+        self.save_checkpoint()
+
+    def run(self, report=click.echo):
+        start_done = self.progress["done"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for offset in range(start_done, len(self.rows), self.chunk_size):
+                chunk = self.rows[offset:offset + self.chunk_size]
+                results = list(executor.map(self._lookup, chunk))
+                self._save_chunk(chunk, results)
+
+                elapsed = time.perf_counter() - start
+                rate = (self.progress["done"] - start_done) / elapsed if elapsed else 0.0
+                remaining = self.progress["total"] - self.progress["done"]
+                eta = f"{remaining / rate:.0f}s" if rate else "?"
+                report(
+                    f"{self.progress['done']}/{self.progress['total']} words, {rate:.1f} words/s, ETA {eta} "
+                    f"({self.progress['saved']} saved, {self.progress['skipped']} already there, "
+                    f"{self.progress['rejected']} rejected)"
+                )
+        return self.progress, time.perf_counter() - start
+
+
+@click.command("import-vocab")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--language", help="Language of the words without a language column: en, fr or fren.")
+@click.option("--workers", type=int, help="Concurrent lookups (IMPORT_WORKERS).")
+@click.option("--chunk-size", type=int, help="Words saved per batch (IMPORT_CHUNK_SIZE).")
+@click.option("--include-existing", is_flag=True, help="Also add words already saved with the same category.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint of a previous run.")
+@click.option("--tenant", help="WhatsApp ID of the learner to import for (default: RECIPIENT_WAID).")
+@with_appcontext
+def import_vocab_command(path, language, workers, chunk_size, include_existing, restart, tenant):
+    """Look up and save every word of a CSV file or word list."""
+    app = current_app._get_current_object()
+    tenant_id = DEFAULT_TENANT
+    if tenant:
+        resolved = get_tenant_registry().lookup(tenant)
+        if resolved is None:
+            raise click.UsageError(f"No tenant {tenant}, register it with flask add-tenant first")
+        tenant_id = resolved["id"]
+    rows = read_import_file(path, language)
+    checkpoint_path = f"{path}.checkpoint.json"
+    rejected_path = f"{path}.rejected.csv"
+    if restart:
+        for stale in (checkpoint_path, rejected_path):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    importer = BulkImporter(
+        app,
+        rows,
+        checkpoint_path,
+        rejected_path,
+        workers=workers or app.config["IMPORT_WORKERS"],
+        chunk_size=chunk_size or app.config["IMPORT_CHUNK_SIZE"],
+        skip_existing=not include_existing,
+        tenant=tenant_id,
+    )
+    importer.load_checkpoint()
+    if importer.progress["done"]:
+        click.echo(f"Resuming after {importer.progress['done']} of {len(rows)} words")
+
+    progress, seconds = importer.run()
+    cache_stats = get_definition_cache().stats()
+    click.echo(
+        f"Imported {progress['saved']} words in {seconds:.1f}s "
+        f"(definition cache hit ratio {cache_stats.get('hit_ratio', 0):.0%})"
+    )
+    if progress["rejected"]:
+        click.echo(f"{progress['rejected']} words were rejected, see {rejected_path}")
+
+    # Command line tools run no sheet sync thread: push the new rows now, unless the server is syncing
+    sync = app.extensions.get("sheet_sync")
+    if sync is not None:
+        click.echo("Syncing to the sheet...")
+        sync.sync_once()
+    pending = get_vocab_store().pending_count()
+    if pending:
+        click.echo(f"{pending} rows are still waiting for the sheet sync of the running server")
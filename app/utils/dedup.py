@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from .sqlite_utils import SQLiteDatabase
+
+
+class SQLiteDedupBackend:
+    """
+    Message IDs in a local SQLite file. Claims are atomic across threads and
+    across processes sharing the file.
+    """
+
+    def __init__(self, path):
+        self.db = SQLiteDatabase(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS message_ids (id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS message_ids_seen_at ON message_ids (seen_at)")
+
+    def claim_many(self, message_ids):
+        claimed = []
+        now = time.time()
+        with self.db.transaction() as conn:
+            for message_id in message_ids:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO message_ids (id, seen_at) VALUES (?, ?)", (message_id, now)
+                )
+                if cursor.rowcount == 1:
+                    claimed.append(message_id)
+        return claimed
+
+    def release(self, message_id):
+        self.db.execute("DELETE FROM message_ids WHERE id = ?", (message_id,))
+
+    def purge(self, older_than):
+        self.db.execute("DELETE FROM message_ids WHERE seen_at < ?", (older_than,))
+
+
+class DatastoreDedupBackend:
+    """
+    Message IDs in Cloud Datastore (kind "MessageID").
+
+    A batch is claimed in one transaction that reads the IDs and writes those
+    absent. Datastore transactions are optimistic: when two processes claim
+    the same ID at once, one commit is aborted and its retry finds the ID
+    taken, so exactly one of them gets it. Each entity carries an `expire_at`
+    timestamp for a Datastore TTL policy to clean up.
+    """
+
+    # A transaction touches at most 500 entities
+    MAX_BATCH = 500
+
+    def __init__(self, ttl, attempts=5):
+        self.ttl = ttl
+        self.attempts = attempts
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from google.cloud import datastore
+
+                self._client = datastore.Client()
+            return self._client
+
+    def claim_many(self, message_ids):
+        claimed = []
+        for i in range(0, len(message_ids), self.MAX_BATCH):
+            claimed += self._claim_batch(message_ids[i:i + self.MAX_BATCH])
+        return claimed
+
+    def _claim_batch(self, message_ids):
+        from google.api_core.exceptions import Aborted, Conflict
+        from google.cloud import datastore
+
+        client = self.client()
+        keys = [client.key("MessageID", message_id) for message_id in message_ids]
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with client.transaction():
+                    # Inside the `with`, reads and writes go through the transaction
+                    seen = {entity.key.name for entity in client.get_multi(keys)}
+                    claimed = [message_id for message_id in message_ids if message_id not in seen]
+                    expire_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+                    entities = []
+                    for message_id in claimed:
+                        entity = datastore.Entity(client.key("MessageID", message_id))
+                        entity.update({"processed": True, "expire_at": expire_at})
+                        entities.append(entity)
+                    client.put_multi(entities)
+                return claimed
+            except (Aborted, Conflict):
+                if attempt == self.attempts:
+                    raise
+                # Another process committed some of these IDs first: the retry reads them as taken
+                time.sleep(0.05 * attempt)
+
+    def release(self, message_id):
+        client = self.client()
+        client.delete(client.key("MessageID", message_id))
+
+
+class MessageDeduplicator:
+    """
+    Decides, once per message ID, whether a webhook delivery is new.
+
+    An in-memory LRU of recently seen IDs answers retries without any I/O.
+    Other IDs are claimed in the backend, which is atomic across processes,
+    without holding the process lock: they are marked as seen first, so a
+    concurrent delivery of the same message in this process is turned away
+    while the backend answers, and unmarked if the backend fails. IDs are
+    forgotten after `ttl` seconds.
+    """
+
+    def __init__(self, backend, ttl, memory_items=10000, purge_interval=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.purge_interval = purge_interval
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _remember(self, message_id, now):
+        self._recent[message_id] = now
+        self._recent.move_to_end(message_id)
+        while len(self._recent) > self.memory_items:
+            self._recent.popitem(last=False)
+
+    def claim(self, message_id):
+        return message_id in self.claim_many([message_id])
+
+    def claim_many(self, message_ids):
+        """
+        Claim a batch of message IDs and return those seen for the first time.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for message_id in dict.fromkeys(message_ids):
+                seen_at = self._recent.get(message_id)
+                if seen_at is None or seen_at < now - self.ttl:
+                    candidates.append(message_id)
+                    self._remember(message_id, now)
+        if not candidates:
+            return []
+        try:
+            return self.backend.claim_many(candidates)
+        except Exception:
+            with self._lock:
+                for message_id in candidates:
+                    self._recent.pop(message_id, None)
+            raise
+
+    def release(self, message_id):
+        """
+        Forget a claim, e.g. when the message could not be queued, so that Meta's retry is accepted.
+        """
+        with self._lock:
+            self._recent.pop(message_id, None)
+        self.backend.release(message_id)
+
+    def start(self):
+        if hasattr(self.backend, "purge"):
+            self._thread = threading.Thread(target=self._run, name="dedup-purge", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # Datastore expires IDs itself, with a TTL policy on `expire_at`
+        while not self._stopping.wait(self.purge_interval):
+            try:
+                self.backend.purge(time.time() - self.ttl)
+            except Exception as e:
+                logging.error(f"Failed to purge old message IDs: {e}")
+
+
+def init_deduplicator(app, start=True):
+    config = app.config
+    if config["DEDUP_BACKEND"] == "sqlite":
+        backend = SQLiteDedupBackend(config["DEDUP_SQLITE_PATH"])
+    else:
+        backend = DatastoreDedupBackend(config["DEDUP_TTL"])
+    deduplicator = MessageDeduplicator(
+        backend,
+        ttl=config["DEDUP_TTL"],
+        memory_items=config["DEDUP_MEMORY_ITEMS"],
+    )
+    app.extensions["deduplicator"] = deduplicator
+    if start:
+        deduplicator.start()
+    return deduplicator
+
+
+def get_deduplicator():
+    return current_app.extensions["deduplicator"]
@@ -0,0 +1,178 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .sqlite_utils import SQLiteDatabase
+
+
+# Which TTL setting applies to each cache source
+SOURCE_TTL_SETTINGS = {
+    "mw_learners": "DEF_CACHE_TTL_MW",
+    "mw_collegiate": "DEF_CACHE_TTL_MW",
+    "en": "DEF_CACHE_TTL_MW",
+    "mw_route": "DEF_CACHE_TTL_MW_ROUTE",
+    "wiktionary_en": "DEF_CACHE_TTL_WIKTIONARY",
+    "wiktionary_fr": "DEF_CACHE_TTL_WIKTIONARY",
+    "fren": "DEF_CACHE_TTL_WIKTIONARY",
+    "fr": "DEF_CACHE_TTL_WIKTIONARY",
+}
+
+
+class DefinitionCache:
+    """
+    Two-tier cache for dictionary lookups: an in-memory LRU in front of a
+    SQLite file that survives restarts.
+
+    Entries come in two kinds: "raw" holds the JSON payload returned by an
+    upstream API, "parsed" holds the final lookup result. Both are keyed on
+    (source, word, category, advanced). Negative results (unknown words,
+    missing categories) are cached too, with their own shorter TTL.
+
+    The memory tier hands every caller the same object: values must be
+    treated as read-only.
+    """
+
+    def __init__(self, path, ttls, negative_ttl, memory_items=1024, disk_max_items=50000, default_ttl=86400):
+        self.db = SQLiteDatabase(path)
+        self.ttls = ttls
+        self.negative_ttl = negative_ttl
+        self.default_ttl = default_ttl
+        self.memory_items = memory_items
+        self.disk_max_items = disk_max_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS definitions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                negative INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS definitions_stored_at ON definitions (stored_at)")
+
+    @staticmethod
+    def make_key(kind, source, word, category="", advanced=False):
+        return json.dumps([kind, source, word.strip(), (category or "").strip().lower(), bool(advanced)])
+
+    def get(self, kind, source, word, category="", advanced=False):
+        """
+        Return (hit, value). A cached negative result is a hit.
+        """
+        key = self.make_key(kind, source, word, category, advanced)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return True, value
+                del self._memory[key]
+
+        row = self.db.execute(
+            "SELECT value, expires_at FROM definitions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and row[1] > now:
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            with self._lock:
+                self._stats["disk_hits"] += 1
+            return True, value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return False, None
+
+    def set(self, kind, source, word, value, category="", advanced=False, negative=False, ttl=None):
+        key = self.make_key(kind, source, word, category, advanced)
+        now = time.time()
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttls.get(source, self.default_ttl)
+        expires_at = now + ttl
+        self._remember(key, value, expires_at)
+        self.db.execute(
+            "INSERT OR REPLACE INTO definitions (key, value, negative, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(value), int(negative), now, expires_at),
+        )
+        with self._lock:
+            self._stats["stores"] += 1
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= 100
+            if prune:
+                self._writes_since_prune = 0
+        if prune:
+            self.prune()
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def prune(self):
+        """
+        Drop expired rows, then the oldest rows beyond the disk size limit.
+        """
+        self.db.execute("DELETE FROM definitions WHERE expires_at <= ?", (time.time(),))
+        self.db.execute(
+            """
+            DELETE FROM definitions WHERE key IN (
+                SELECT key FROM definitions ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.disk_max_items,),
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+class _DisabledCache:
+    # Stand-in used when DEF_CACHE_ENABLED is off, so callers need no special case
+    def get(self, *args, **kwargs):
+        return False, None
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def stats(self):
+        return {"enabled": False}
+
+
+def get_definition_cache():
+    cache = current_app.extensions.get("definition_cache")
+    if cache is None:
+        config = current_app.config
+        if not config["DEF_CACHE_ENABLED"]:
+            cache = _DisabledCache()
+        else:
+            cache = DefinitionCache(
+                config["DEF_CACHE_PATH"],
+                ttls={source: config[setting] for source, setting in SOURCE_TTL_SETTINGS.items()},
+                negative_ttl=config["DEF_CACHE_NEGATIVE_TTL"],
+                memory_items=config["DEF_CACHE_MEMORY_ITEMS"],
+                disk_max_items=config["DEF_CACHE_DISK_MAX_ITEMS"],
+            )
+            logging.info(f"Definition cache opened at {config['DEF_CACHE_PATH']}")
+        # setdefault keeps a single instance if two workers race here
+        cache = current_app.extensions.setdefault("definition_cache", cache)
+    return cache
@@ -0,0 +1,283 @@
+import logging
+import threading
+import time
+import unicodedata
+
+from flask import current_app
+
+from .sqlite_utils import SQLiteDatabase
+
+
+# Headword language of each lookup (both Wiktionary lookups define French words)
+SOURCE_LANGUAGES = {"en": "en", "fr": "fr", "fren": "fr"}
+
+HEADWORD_LANGUAGES = ("en", "fr")
+
+# Letters NFKD leaves alone, and typographic apostrophes
+FOLDED_LETTERS = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss", "’": "'", "ʼ": "'", "‘": "'"})
+
+
+def fold(word):
+    """
+    Lowercase `word` and strip its accents, so "Élève", "eleve" and "élevé" compare equal.
+    """
+    decomposed = unicodedata.normalize("NFKD", word.strip().lower().translate(FOLDED_LETTERS))
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def distance_to(pattern):
+    """
+    Return a function giving the Levenshtein distance from `pattern` to a string:
+    the insertions, deletions and substitutions turning one into the other.
+
+    Myers' bit-parallel algorithm: a column of the edit matrix is held as two
+    bit vectors (the +1 and -1 steps down it), so each letter of the string
+    costs a few integer operations instead of a pass over `pattern`, whose
+    letter positions are computed once for all the strings it is compared to.
+    """
+    if not pattern:
+        return len
+    positions = {}
+    for i, char in enumerate(pattern):
+        positions[char] = positions.get(char, 0) | (1 << i)
+    full = (1 << len(pattern)) - 1
+    last = 1 << (len(pattern) - 1)
+    length = len(pattern)
+
+    def distance(text):
+        plus, minus, score = full, 0, length
+        for char in text:
+            equal = positions.get(char, 0)
+            vertical = equal | minus
+            horizontal = (((equal & plus) + plus) ^ plus) | equal
+            horizontal_plus = minus | ~(horizontal | plus)
+            horizontal_minus = plus & horizontal
+            if horizontal_plus & last:
+                score += 1
+            elif horizontal_minus & last:
+                score -= 1
+            horizontal_plus = (horizontal_plus << 1) | 1
+            horizontal_minus <<= 1
+            plus = (horizontal_minus | ~(vertical | horizontal_plus)) & full
+            minus = horizontal_plus & vertical & full
+        return score
+
+    return distance
+
+
+def edit_distance(a, b):
+    return distance_to(a)(b)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over strings, finding every key within an edit
+    distance of a query without comparing it to all of them: the children of
+    a node are keyed by their distance to it, and by the triangle inequality
+    only those within `max_distance` of the query's own distance can match.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, key):
+        if self._root is None:
+            self._root = (key, {})
+            self.size = 1
+            return True
+        distance_from_key = distance_to(key)
+        node = self._root
+        while True:
+            distance = distance_from_key(node[0])
+            if distance == 0:
+                return False
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (key, {})
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, key, max_distance):
+        """
+        Return (distance, key) for every key within `max_distance` of `key`.
+        """
+        matches = []
+        distance_from_key = distance_to(key)
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_key, children = stack.pop()
+            distance = distance_from_key(node_key)
+            if distance <= max_distance:
+                matches.append((distance, node_key))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+class HeadwordIndex:
+    """
+    Words known to be headwords of one dictionary language, to suggest
+    spellings when a lookup finds nothing.
+
+    Words come from successful lookups (counted, so frequent words rank
+    first) and from the spelling suggestions Merriam-Webster sends for
+    unknown words: only what a dictionary confirmed, never what a learner
+    typed or saved, as the index is shared by all of them. They are kept in a
+    SQLite table shared by the workers and, up to `memory_items` of the most
+    looked up ones, in a BK-tree of their accent- and case-folded forms, so a
+    suggestion costs no network call. Words learned by another worker reach
+    this one's tree when it restarts.
+    """
+
+    def __init__(self, db, language, memory_items=20000):
+        self.db = db
+        self.language = language
+        self.memory_items = memory_items
+        self._tree = BKTree()
+        # Folded form -> {headword: times looked up}
+        self._forms = {}
+        self._lock = threading.Lock()
+        self._stats = {"suggested": 0, "no_suggestion": 0}
+
+        rows = db.execute(
+            "SELECT word, hits FROM headwords WHERE language = ? ORDER BY hits DESC, updated_at DESC LIMIT ?",
+            (language, memory_items),
+        ).fetchall()
+        with self._lock:
+            for word, hits in rows:
+                self._remember(word, hits)
+
+    def _remember(self, word, hits):
+        # Called with the lock held
+        key = fold(word)
+        forms = self._forms.get(key)
+        if forms is None:
+            if len(self._forms) >= self.memory_items:
+                return
+            forms = self._forms[key] = {}
+            self._tree.add(key)
+        forms[word] = forms.get(word, 0) + hits
+
+    def learn(self, words, looked_up=True):
+        """
+        Record headwords: found by a lookup, or only suggested by a dictionary (`looked_up=False`).
+        """
+        words = [word.strip() for word in words if word and word.strip()]
+        if not words:
+            return
+        hits = 1 if looked_up else 0
+        now = time.time()
+        with self.db.transaction() as conn:
+            for word in words:
+                conn.execute(
+                    "INSERT OR IGNORE INTO headwords (language, word, hits, updated_at) VALUES (?, ?, 0, ?)",
+                    (self.language, word, now),
+                )
+                conn.execute(
+                    "UPDATE headwords SET hits = hits + ?, updated_at = ? WHERE language = ? AND word = ?",
+                    (hits, now, self.language, word),
+                )
+        with self._lock:
+            for word in words:
+                self._remember(word, hits)
+
+    def knows(self, word):
+        """
+        Whether `word` (in any case) is a known headword.
+        """
+        word = word.strip().lower()
+        with self._lock:
+            forms = self._forms.get(fold(word), {})
+            return any(form.lower() == word for form in forms)
+
+    def suggest(self, word, limit=3):
+        """
+        Known headwords `word` may be a misspelling of, closest first: by
+        distance once accents and case are ignored, then with them, then the
+        most looked up.
+
+        Most misspellings are one edit away, and a search within one edit
+        visits a fraction of the tree, so two edits are only searched (for
+        words over four letters) when nothing is closer.
+        """
+        key = fold(word)
+        if not key:
+            return []
+        lowered = word.strip().lower()
+        with self._lock:
+            for max_distance in (1, 2) if len(key) > 4 else (1,):
+                candidates = [
+                    (distance, edit_distance(lowered, form.lower()), -hits, form)
+                    for distance, match in self._tree.search(key, max_distance)
+                    for form, hits in self._forms[match].items()
+                    if form.lower() != lowered
+                ]
+                if candidates:
+                    break
+        candidates.sort()
+        return [form for *_, form in candidates[:limit]]
+
+    def record_suggestion(self, offered):
+        with self._lock:
+            self._stats["suggested" if offered else "no_suggestion"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, headwords=self._tree.size)
+
+
+def get_headword_index(language):
+    """
+    The headword index of a dictionary language ("en" or "fr"), or None when HEADWORDS_ENABLED is off.
+    """
+    config = current_app.config
+    if not config["HEADWORDS_ENABLED"]:
+        return None
+    indexes = current_app.extensions.setdefault("headword_indexes", {})
+    if language not in indexes:
+        db = current_app.extensions.get("headwords_db")
+        if db is None:
+            db = SQLiteDatabase(config["HEADWORDS_PATH"])
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS headwords (
+                    language TEXT NOT NULL,
+                    word TEXT NOT NULL,
+                    hits INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (language, word)
+                )
+                """
+            )
+            db = current_app.extensions.setdefault("headwords_db", db)
+        start = time.perf_counter()
+        index = HeadwordIndex(db, language, memory_items=config["HEADWORDS_MEMORY_ITEMS"])
+        logging.info(
+            f"Headword index for {language} loaded, {index.stats()['headwords']} spellings "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+        indexes.setdefault(language, index)
+    return indexes[language]
+
+
+def did_you_mean(language, word, suggestions=()):
+    """
+    The line to add to a "not found" reply: `suggestions` from the dictionary
+    first, then known headwords close to `word`. Empty if there are none.
+    """
+    index = get_headword_index(language)
+    if index is None and not suggestions:
+        return ""
+    limit = current_app.config["HEADWORDS_SUGGESTIONS"]
+    ranked = list(dict.fromkeys(suggestions))[:limit]
+    if index is not None and len(ranked) < limit:
+        ranked += [form for form in index.suggest(word, limit) if form not in ranked][:limit - len(ranked)]
+        index.record_suggestion(bool(ranked))
+    if not ranked:
+        return ""
+    names = [f"*{form}*" for form in ranked]
+    listed = names[0] if len(names) == 1 else f"{', '.join(names[:-1])} or {names[-1]}"
+    return f"\nDid you mean {listed}?"
@@ -0,0 +1,233 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from .metrics import get_metrics
+
+
+# (connect, read) timeouts in seconds per upstream host
+DEFAULT_HOST_TIMEOUTS = {
+    "graph.facebook.com": (3.05, 30),
+    "www.dictionaryapi.com": (3.05, 10),
+    "en.wiktionary.org": (3.05, 10),
+    "fr.wiktionary.org": (3.05, 10),
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised without touching the network while a host's circuit breaker is open.
+    """
+
+
+class HostClient:
+    """
+    Keep-alive connection pool, retries and circuit breaker for one upstream host.
+
+    Responses with status 429 or 5xx, timeouts and connection errors are
+    retried with exponential backoff and full jitter (honouring Retry-After).
+    Non-idempotent requests are only retried when the server cannot have
+    acted on them: 429 responses and failures to connect. After
+    `breaker_threshold` consecutive failures the breaker opens and requests
+    fail fast for `breaker_reset` seconds, then a single trial request is let
+    through. Every attempt is timed into `metrics` if given.
+    """
+
+    def __init__(self, host, timeout, pool_size=10, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 breaker_threshold=5, breaker_reset=30.0, metrics=None):
+        self.host = host
+        self.metrics = metrics
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "breaker_opens": 0,
+            "short_circuited": 0,
+            "in_flight": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+        }
+
+    def _before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.breaker_reset or self._trial_in_flight:
+                self._stats["short_circuited"] += 1
+                raise CircuitOpenError(f"Circuit breaker open for {self.host}")
+            # Half-open: let one request through to probe the host
+            self._trial_in_flight = True
+
+    def _record(self, success):
+        with self._lock:
+            self._trial_in_flight = False
+            if success:
+                self._consecutive_failures = 0
+                self._opened_at = None
+                return
+            self._stats["failures"] += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.breaker_threshold:
+                if self._opened_at is None:
+                    logging.warning(f"Opening circuit breaker for {self.host}")
+                    self._stats["breaker_opens"] += 1
+                self._opened_at = time.monotonic()
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), 60.0))
+        return delay
+
+    def request(self, method, url, retries=None, **kwargs):
+        """
+        Send a request, retrying up to `retries` times (the client's max_retries by default).
+        """
+        max_retries = self.max_retries if retries is None else retries
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault("timeout", self.timeout)
+        files = kwargs.get("files") or {}
+
+        for attempt in range(max_retries + 1):
+            self._before_request()
+            # Uploads are re-sent from the start of the file on retries
+            for value in files.values():
+                file_obj = value[1] if isinstance(value, tuple) else value
+                if hasattr(file_obj, "seek"):
+                    file_obj.seek(0)
+
+            start = time.perf_counter()
+            with self._lock:
+                self._stats["requests"] += 1
+                self._stats["in_flight"] += 1
+            error, response = None, None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._stats["in_flight"] -= 1
+                    self._stats["total_seconds"] += elapsed
+                    self._stats["max_seconds"] = max(self._stats["max_seconds"], elapsed)
+                if self.metrics is not None:
+                    if response is not None:
+                        outcome = str(response.status_code)
+                    else:
+                        outcome = type(error).__name__ if error is not None else "exception"
+                    self.metrics.observe("upstream_request_seconds", elapsed, host=self.host, method=method, outcome=outcome)
+                if response is None and error is None:
+                    # Any other exception is on its way out: count it, and end a half-open trial
+                    self._record(False)
+
+            if error is not None:
+                self._record(False)
+                connect_failed = isinstance(error, requests.ConnectTimeout) or not isinstance(error, requests.Timeout)
+                if attempt < max_retries and (idempotent or connect_failed):
+                    self._retry_wait(attempt, type(error).__name__)
+                    continue
+                raise error
+
+            retryable = response.status_code == 429 or (idempotent and response.status_code >= 500)
+            self._record(response.status_code < 500 and response.status_code != 429)
+            if retryable and attempt < max_retries:
+                self._retry_wait(attempt, f"status {response.status_code}", response)
+                continue
+            return response
+
+    def _retry_wait(self, attempt, reason, response=None):
+        delay = self._backoff(attempt, response)
+        with self._lock:
+            self._stats["retries"] += 1
+        logging.info(f"Retrying request to {self.host} in {delay:.2f}s after {reason}")
+        time.sleep(delay)
+
+    def _connections_opened(self):
+        pools = self.adapter.poolmanager.pools
+        opened = 0
+        for key in pools.keys():
+            try:
+                opened += pools[key].num_connections
+            except KeyError:
+                # Evicted since the keys were listed
+                pass
+        return opened
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["breaker_open"] = self._opened_at is not None
+        stats["connections_opened"] = self._connections_opened()
+        completed = stats["requests"] - stats["in_flight"]
+        stats["avg_seconds"] = stats["total_seconds"] / completed if completed else 0.0
+        return stats
+
+
+def parse_host_timeouts(value):
+    """
+    Parse "host=connect/read;host=connect/read" into a timeout dict.
+    """
+    timeouts = {}
+    for item in filter(None, (value or "").split(";")):
+        host, _, pair = item.partition("=")
+        connect, _, read = pair.partition("/")
+        timeouts[host.strip()] = (float(connect), float(read))
+    return timeouts
+
+
+def get_host_client(url):
+    parsed = urlparse(url)
+    # Keyed on host and port, so local stand-ins on different ports get their own pools and breakers
+    host = parsed.netloc
+    clients = current_app.extensions.setdefault("http_clients", {})
+    client = clients.get(host)
+    if client is None:
+        config = current_app.config
+        timeouts = dict(DEFAULT_HOST_TIMEOUTS)
+        timeouts.update(parse_host_timeouts(config["HTTP_TIMEOUTS"]))
+        client = HostClient(
+            host,
+            timeouts.get(parsed.hostname, (config["HTTP_CONNECT_TIMEOUT"], config["HTTP_READ_TIMEOUT"])),
+            pool_size=config["HTTP_POOL_SIZE"],
+            max_retries=config["HTTP_MAX_RETRIES"],
+            backoff_base=config["HTTP_BACKOFF_BASE"],
+            backoff_max=config["HTTP_BACKOFF_MAX"],
+            breaker_threshold=config["HTTP_BREAKER_THRESHOLD"],
+            breaker_reset=config["HTTP_BREAKER_RESET"],
+            metrics=get_metrics(),
+        )
+        client = clients.setdefault(host, client)
+    return client
+
+
+def http_get(url, **kwargs):
+    return get_host_client(url).request("GET", url, **kwargs)
+
+
+def http_post(url, **kwargs):
+    return get_host_client(url).request("POST", url, **kwargs)
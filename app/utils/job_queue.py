@@ -0,0 +1,371 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from .sqlite_utils import SQLiteDatabase
+
+
+class SQLiteJobBackend:
+    """
+    Durable job storage in a local SQLite file.
+
+    Jobs are claimed with a single UPDATE inside an IMMEDIATE transaction, so
+    several worker threads (or several server processes sharing the file) never
+    pick up the same job twice. A job with a partition key is only claimed
+    once every earlier job with the same key is done.
+    """
+
+    durable = True
+
+    def __init__(self, path, visibility_timeout=300):
+        self.db = SQLiteDatabase(path)
+        self.visibility_timeout = visibility_timeout
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT,
+                partition_key TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "partition_key" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN partition_key TEXT")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status_available ON jobs (status, available_at)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_partition ON jobs (partition_key, status)"
+        )
+
+    def put(self, payload, partition=None):
+        return self.put_many([payload], [partition])[0]
+
+    def put_many(self, payloads, partitions=None):
+        now = time.time()
+        partitions = partitions or [None] * len(payloads)
+        with self.db.transaction() as conn:
+            return [
+                conn.execute(
+                    "INSERT INTO jobs (payload, available_at, partition_key) VALUES (?, ?, ?)",
+                    (json.dumps(payload), now, partition),
+                ).lastrowid
+                for payload, partition in zip(payloads, partitions)
+            ]
+
+    def claim(self):
+        now = time.time()
+        with self.db.transaction() as conn:
+            # Jobs left 'running' by a crashed process become visible again
+            conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND claimed_at < ?",
+                (now - self.visibility_timeout,),
+            )
+            # A job waits for the earlier jobs of its partition, including one waiting to be retried
+            row = conn.execute(
+                """
+                SELECT id, payload, attempts FROM jobs AS job
+                WHERE status = 'queued' AND available_at <= ?
+                AND (partition_key IS NULL OR NOT EXISTS (
+                    SELECT 1 FROM jobs AS earlier
+                    WHERE earlier.partition_key = job.partition_key
+                    AND earlier.status IN ('queued', 'running') AND earlier.id < job.id
+                ))
+                ORDER BY id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (now, row[0]),
+            )
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def complete(self, job_id):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def retry(self, job_id, delay, error):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay, error, job_id),
+            )
+
+    def dead_letter(self, job_id, error):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', last_error = ? WHERE id = ?",
+                (error, job_id),
+            )
+
+    def dead_letters(self, limit=50):
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, payload, attempts, last_error FROM jobs WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"id": row[0], "payload": json.loads(row[1]), "attempts": row[2], "error": row[3]}
+            for row in rows
+        ]
+
+    def depth(self):
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()
+        return row[0]
+
+
+class MemoryJobBackend:
+    """
+    In-process job storage. Jobs are lost on restart, but nothing touches disk.
+
+    The jobs of each partition are kept in arrival order; only the first one
+    can be claimed, and not while it is running.
+    """
+
+    durable = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._jobs = {}
+        self._ready = deque()
+        self._partitions = {}
+        self._running = set()
+        self._dead = []
+
+    def put(self, payload, partition=None):
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+            self._jobs[job_id] = {"payload": payload, "attempts": 0, "available_at": 0.0, "partition": partition}
+            self._ready.append(job_id)
+            if partition is not None:
+                self._partitions.setdefault(partition, deque()).append(job_id)
+            return job_id
+
+    def put_many(self, payloads, partitions=None):
+        partitions = partitions or [None] * len(payloads)
+        return [self.put(payload, partition) for payload, partition in zip(payloads, partitions)]
+
+    def _blocked(self, job_id, partition):
+        return partition is not None and (partition in self._running or self._partitions[partition][0] != job_id)
+
+    def _finish(self, job):
+        partition = job["partition"]
+        if partition is not None:
+            self._running.discard(partition)
+            queue = self._partitions[partition]
+            queue.popleft()
+            if not queue:
+                del self._partitions[partition]
+
+    def claim(self):
+        now = time.time()
+        with self._lock:
+            for _ in range(len(self._ready)):
+                job_id = self._ready.popleft()
+                job = self._jobs[job_id]
+                if job["available_at"] <= now and not self._blocked(job_id, job["partition"]):
+                    job["attempts"] += 1
+                    if job["partition"] is not None:
+                        self._running.add(job["partition"])
+                    return job_id, job["payload"], job["attempts"]
+                self._ready.append(job_id)
+        return None
+
+    def complete(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is not None:
+                self._finish(job)
+
+    def retry(self, job_id, delay, error):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["available_at"] = time.time() + delay
+            job["last_error"] = error
+            # Still first of its partition, so the jobs behind it wait for the retry
+            self._running.discard(job["partition"])
+            self._ready.append(job_id)
+
+    def dead_letter(self, job_id, error):
+        with self._lock:
+            job = self._jobs.pop(job_id)
+            self._finish(job)
+            self._dead.append({"id": job_id, "payload": job["payload"], "attempts": job["attempts"], "error": error})
+
+    def dead_letters(self, limit=50):
+        with self._lock:
+            return list(reversed(self._dead))[:limit]
+
+    def depth(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+class JobQueue:
+    """
+    Bounded pool of worker threads draining a job backend.
+
+    Each job is handed to `handler` inside the Flask app context. A job that
+    raises is retried with exponential backoff, and moved to the dead-letter
+    list once it has failed `max_retries` times.
+
+    Jobs are partitioned by `partition_key(payload)`, the sender of a
+    message: the jobs of one partition run one at a time and in the order
+    they were queued, retries included, while different partitions run in
+    parallel on every worker of every process sharing the backend.
+
+    On `stop`, the jobs already running are always finished. With `drain`,
+    which defaults to True for backends that would lose them, the jobs still
+    queued are worked off too before the threads exit.
+    """
+
+    def __init__(
+        self, app, backend, handler, workers=2, max_retries=3, retry_backoff=2.0, poll_interval=0.5,
+        partition_key=None,
+    ):
+        self.app = app
+        self.backend = backend
+        self.handler = handler
+        self.partition_key = partition_key
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._draining = False
+        self._threads = []
+
+    def _partition(self, payload):
+        return self.partition_key(payload) if self.partition_key is not None else None
+
+    def enqueue(self, payload):
+        job_id = self.backend.put(payload, self._partition(payload))
+        with self._wakeup:
+            self._wakeup.notify()
+        logging.info(f"Enqueued job {job_id}")
+        return job_id
+
+    def enqueue_many(self, payloads):
+        """
+        Queue several jobs in one write, e.g. the messages of a batched webhook.
+        """
+        job_ids = self.backend.put_many(payloads, [self._partition(payload) for payload in payloads])
+        with self._wakeup:
+            self._wakeup.notify(len(job_ids))
+        logging.info(f"Enqueued jobs {', '.join(map(str, job_ids))}")
+        return job_ids
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=30, drain=None):
+        if drain is None:
+            drain = not self.backend.durable
+        self._draining = drain
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+        if any(thread.is_alive() for thread in self._threads):
+            logging.warning(f"Job workers still busy after {timeout}s, leaving them behind")
+        self._threads = []
+        remaining = self.backend.depth()
+        if remaining and not self.backend.durable:
+            logging.warning(f"Stopping with {remaining} jobs left in memory, they will be lost")
+
+    def _worker_loop(self):
+        while not (self._stopping.is_set() and not self._draining):
+            try:
+                job = self.backend.claim()
+            except Exception as e:
+                logging.error(f"Claiming a job failed, will retry: {type(e).__name__}: {e}")
+                job = None
+            if job is None:
+                if self._stopping.is_set():
+                    return
+                # Poll as well as wait, so jobs enqueued by other processes are picked up
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self._run(*job)
+
+    def _run(self, job_id, payload, attempts):
+        try:
+            with self.app.app_context():
+                self.handler(payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempts >= self.max_retries:
+                logging.error(f"Job {job_id} failed {attempts} times, moving to dead letters: {error}")
+                self._record(self.backend.dead_letter, job_id, error)
+            else:
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                logging.warning(f"Job {job_id} failed (attempt {attempts}), retrying in {delay}s: {error}")
+                self._record(self.backend.retry, job_id, delay, error)
+        else:
+            self._record(self.backend.complete, job_id)
+        # The next job of the same partition can go now
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _record(self, outcome, job_id, *args):
+        """
+        Write a job's outcome to the backend without letting a failure (e.g. a
+        locked database) kill the worker. A durable backend hands the job,
+        still marked running, to a worker again after its visibility timeout.
+        """
+        try:
+            outcome(job_id, *args)
+        except Exception as e:
+            logging.error(f"Recording the outcome of job {job_id} failed: {type(e).__name__}: {e}")
+
+
+def init_job_queue(app, handler, partition_key=None, start=True):
+    if app.config["JOB_QUEUE_BACKEND"] == "memory":
+        backend = MemoryJobBackend()
+    else:
+        backend = SQLiteJobBackend(
+            app.config["JOB_QUEUE_PATH"],
+            visibility_timeout=app.config["JOB_QUEUE_VISIBILITY_TIMEOUT"],
+        )
+    queue = JobQueue(
+        app,
+        backend,
+        handler,
+        workers=app.config["JOB_QUEUE_WORKERS"],
+        max_retries=app.config["JOB_QUEUE_MAX_RETRIES"],
+        retry_backoff=app.config["JOB_QUEUE_RETRY_BACKOFF"],
+        partition_key=partition_key,
+    )
+    app.extensions["job_queue"] = queue
+    if start:
+        queue.start()
+    return queue
+
+
+def get_job_queue():
+    return current_app.extensions["job_queue"]
@@ -0,0 +1,84 @@
+import importlib
+import logging
+import threading
+import time
+
+from .audio_cache import get_audio_cache
+from .definition_cache import get_definition_cache
+from .headwords import HEADWORD_LANGUAGES, get_headword_index
+from .http_client import get_host_client
+from .sheets_session import get_vocab_worksheet
+from .wiktionary_index import INDEX_PATH_SETTINGS, get_wiktionary_index
+
+
+# One URL per upstream host, so each gets its pooled client before the first message
+WARM_UP_URL_SETTINGS = ["GRAPH_API_URL", "MW_API_URL", "WIKTIONARY_EN_API_URL", "WIKTIONARY_FR_API_URL"]
+
+
+def warm_up(app, background=None):
+    """
+    Build a worker's per-process state: HTTP clients, caches, the Datastore
+    client, the text-to-speech library and the authorized vocabulary
+    worksheet, all of which are otherwise loaded on first use. Failures are
+    only logged, the first request will then build whatever is missing.
+
+    In the background (WARM_UP_BACKGROUND, the default) the worker takes
+    traffic straight away: status webhooks need none of this, and a message
+    arriving mid warm-up just waits for the part it needs.
+    """
+    if not app.config["WARM_UP_ENABLED"]:
+        return None
+    if background is None:
+        background = app.config["WARM_UP_BACKGROUND"]
+    if background:
+        thread = threading.Thread(target=_warm_up, args=(app,), name="warm-up", daemon=True)
+        thread.start()
+        return thread
+    _warm_up(app)
+    return None
+
+
+def _warm_up(app):
+    start = time.perf_counter()
+    with app.app_context():
+        steps = [
+            ("http clients", lambda: [get_host_client(app.config[setting]) for setting in WARM_UP_URL_SETTINGS]),
+            ("definition cache", get_definition_cache),
+            ("audio cache", get_audio_cache),
+            ("wiktionary indexes", lambda: [get_wiktionary_index(source) for source in INDEX_PATH_SETTINGS]),
+            ("headword indexes", lambda: [get_headword_index(language) for language in HEADWORD_LANGUAGES]),
+            ("text-to-speech", lambda: importlib.import_module("gtts")),
+        ]
+        backend = app.extensions["deduplicator"].backend
+        if hasattr(backend, "client"):
+            steps.append(("datastore client", backend.client))
+        if app.config["GOOGLE_SHEETS_CREDENTIALS"]:
+            steps.append(("vocab worksheet", get_vocab_worksheet))
+        for name, step in steps:
+            step_start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logging.warning(f"Warm-up of {name} failed: {e}")
+            else:
+                logging.info(f"Warmed up {name} in {(time.perf_counter() - step_start) * 1000:.0f}ms")
+    logging.info(f"Worker warmed up in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def shutdown_app(app, timeout=None):
+    """
+    Stop the background threads of a worker that is shutting down.
+
+    Webhooks are no longer being accepted by then. The job workers finish the
+    messages they are processing (and the queued ones too if the queue is in
+    memory), then the replies due in the outbox are sent, and the pending
+    sheet operations are flushed.
+    """
+    if timeout is None:
+        timeout = app.config["SHUTDOWN_TIMEOUT"]
+    deadline = time.time() + timeout
+    for name in ("job_queue", "outbox", "deduplicator", "sheet_sync"):
+        component = app.extensions.get(name)
+        if component is not None:
+            component.stop(timeout=max(1, deadline - time.time()))
+    logging.info("Background work stopped")
@@ -0,0 +1,311 @@
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, has_app_context
+
+
+# Upper bounds in seconds, from a cache hit to a slow upstream call with retries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    "stage_seconds": "Time spent in each stage of message processing.",
+    "message_seconds": "Time to process a message in a job worker, by command.",
+    "message_age_seconds": "Time from the message being sent on WhatsApp to its processing being done.",
+    "messages_total": "Messages processed by the job workers, by command and outcome.",
+    "upstream_request_seconds": "Outbound HTTP attempts, by host, method and outcome.",
+    "sheets_session_seconds": "Google Sheets authorization and worksheet handle acquisition.",
+    "outbox_send_seconds": "Graph API calls sending queued messages, by outcome.",
+    "outbox_delivery_seconds": "Time from a reply being queued to Meta accepting it.",
+    "outbox_sent_total": "Messages sent from the outbox, counting a coalesced batch once.",
+    "outbox_coalesced_total": "Replies merged into a message queued before them.",
+    "outbox_throttled_total": "Sends rejected by Meta's rate limits.",
+    "outbox_dead_total": "Queued messages given up on.",
+}
+
+_local = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value is True or value is False:
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Counters and latency histograms of one server process, rendered in the
+    Prometheus text format.
+
+    Gauges are not stored: collectors registered with `add_collector` are
+    called at scrape time and read the stats the caches, pools and queues
+    already keep. Each gunicorn worker has its own registry, so a scrape
+    answers for the worker that served it.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, prefix="vocab_bot"):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._collectors = []
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[(name, _label_key(labels))] += amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket, then the total count and sum
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def add_collector(self, collector):
+        """
+        Register `collector()`, returning (name, labels dict, value) gauges read at scrape time.
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {self.prefix}_{name} {HELP[name]}")
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            describe(name, "counter")
+            lines.append(f"{self.prefix}_{name}{_format_labels(key)} {_format_value(value)}")
+
+        for (name, key), histogram in sorted(histograms.items()):
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{self.prefix}_{name}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram[-2]}")
+            lines.append(f"{self.prefix}_{name}_count{_format_labels(key)} {histogram[-2]}")
+            lines.append(f"{self.prefix}_{name}_sum{_format_labels(key)} {_format_value(histogram[-1])}")
+
+        gauges = defaultdict(list)
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    if value is not None:
+                        gauges[name].append((_label_key(labels), value))
+            except Exception as e:
+                logging.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        for name, samples in sorted(gauges.items()):
+            # Collectors also report running totals kept elsewhere, named *_total
+            describe(name, "counter" if name.endswith("_total") else "gauge")
+            for key, value in samples:
+                lines.append(f"{self.prefix}_{name}{_format_labels(key)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics():
+    metrics = current_app.extensions.get("metrics")
+    if metrics is None:
+        metrics = current_app.extensions.setdefault("metrics", Metrics())
+    return metrics
+
+
+def component_gauges(app):
+    """
+    Gauges and running totals read from the stats of the components in `app.extensions`.
+    """
+    extensions = app.extensions
+    for host, client in list(extensions.get("http_clients", {}).items()):
+        stats = client.stats()
+        for name in ("requests", "retries", "failures", "breaker_opens", "short_circuited"):
+            yield f"http_{name}_total", {"host": host}, stats[name]
+        for name in ("in_flight", "connections_opened", "breaker_open"):
+            yield f"http_{name}", {"host": host}, stats[name]
+
+    cache = extensions.get("definition_cache")
+    if cache is not None:
+        stats = cache.stats()
+        for result in ("memory_hits", "disk_hits", "misses"):
+            yield "definition_cache_lookups_total", {"result": result}, stats.get(result)
+        yield "definition_cache_memory_items", {}, stats.get("memory_items")
+        yield "definition_cache_hit_ratio", {}, stats.get("hit_ratio")
+
+    session = extensions.get("sheet_session")
+    if session is not None:
+        stats = session.stats()
+        for event in ("authorizations", "refreshes", "opens", "reuses"):
+            yield "sheets_session_events_total", {"event": event}, stats[event]
+
+    status_counter = extensions.get("status_counter")
+    if status_counter is not None:
+        for status, count in status_counter.counts().items():
+            yield "whatsapp_statuses_total", {"status": status}, count
+
+    queue = extensions.get("job_queue")
+    if queue is not None:
+        yield "job_queue_depth", {}, queue.backend.depth()
+
+    outbox = extensions.get("outbox")
+    if outbox is not None:
+        yield "outbox_depth", {}, outbox.depth()
+        yield "outbox_dead", {}, outbox.dead_count()
+        yield "outbox_oldest_pending_seconds", {}, outbox.oldest_pending_age()
+
+    registry = extensions.get("tenant_registry")
+    if registry is not None:
+        yield "tenants_registered", {}, registry.count()
+
+    store = extensions.get("vocab_store")
+    if store is not None:
+        yield "sheet_sync_pending_ops", {}, store.pending_count()
+
+    for source, index in list(extensions.get("wiktionary_indexes", {}).items()):
+        if index is not None:
+            stats = index.stats()
+            yield "wiktionary_index_entries", {"source": source}, stats["entries"]
+            for result in ("hits", "misses"):
+                yield "wiktionary_index_lookups_total", {"source": source, "result": result}, stats[result]
+
+    for language, index in list(extensions.get("headword_indexes", {}).items()):
+        stats = index.stats()
+        yield "headwords_known", {"language": language}, stats["headwords"]
+        for result in ("suggested", "no_suggestion"):
+            yield "headword_misses_total", {"language": language, "result": result}, stats[result]
+
+    router = extensions.get("mw_router")
+    if router is not None:
+        stats = router.stats()
+        yield "mw_fallback_ratio", {}, stats.pop("fallback_ratio")
+        for name, value in stats.items():
+            yield f"mw_{name}_total", {}, value
+
+
+def init_metrics(app):
+    metrics = app.extensions.setdefault("metrics", Metrics())
+    metrics.add_collector(lambda: component_gauges(app))
+    return metrics
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Time a stage into the stage_seconds histogram, and into the trace of the
+    message being processed by this thread if any.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if has_app_context():
+            get_metrics().observe("stage_seconds", elapsed, stage=stage, outcome=outcome, **labels)
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace["spans"].append((stage, elapsed))
+
+
+def timed(stage):
+    """
+    Decorator running the whole function in a `span`.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def tag_trace(**tags):
+    """
+    Attach tags, such as the command, to the trace of the message being processed.
+    """
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["tags"].update(tags)
+
+
+def _message_timestamp(payload):
+    try:
+        return int(payload["entry"][0]["changes"][0]["value"]["messages"][0]["timestamp"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def traced(handler):
+    """
+    Decorator for the job handler: times the whole message, and logs one line
+    with the time spent in each stage once it is processed.
+    """
+    @wraps(handler)
+    def wrapper(payload):
+        trace = _local.trace = {"tags": {"command": "unknown"}, "spans": []}
+        sent_at = _message_timestamp(payload)
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return handler(payload)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.trace = None
+            command = trace["tags"]["command"]
+            metrics = get_metrics()
+            metrics.observe("message_seconds", elapsed, command=command)
+            metrics.inc("messages_total", command=command, outcome=outcome)
+            if sent_at is not None:
+                metrics.observe("message_age_seconds", max(0.0, time.time() - sent_at), command=command)
+
+            stages = defaultdict(float)
+            for stage, seconds in trace["spans"]:
+                stages[stage] += seconds
+            timings = " ".join(f"{stage}_ms={seconds * 1000:.0f}" for stage, seconds in stages.items())
+            tags = " ".join(f"{name}={value}" for name, value in trace["tags"].items())
+            logging.info(f"timing {tags} outcome={outcome} total_ms={elapsed * 1000:.0f} {timings}".rstrip())
+    return wrapper
@@ -0,0 +1,113 @@
+import logging
+import threading
+
+from flask import current_app
+
+from .definition_cache import get_definition_cache
+
+
+LEARNERS = "mw_learners"
+COLLEGIATE = "mw_collegiate"
+
+
+def pick_mw_entry(data, cat=None):
+    """
+    The first entry of a Merriam-Webster payload with a part of speech and at
+    least one short definition, in category `cat` if given. None if there is
+    none, e.g. when the payload is a list of spelling suggestions.
+    """
+    for entry in data or []:
+        if not isinstance(entry, dict):
+            return None
+        if "fl" in entry and entry.get("shortdef") and (cat is None or entry["fl"] == cat):
+            return entry
+    return None
+
+
+class MWRouter:
+    """
+    Decides which Merriam-Webster dictionaries to query for a word, and learns
+    from the outcome.
+
+    The learner's dictionary is asked first, the collegiate one when it has
+    nothing suitable. Once a word has been answered, the winning dictionary is
+    remembered in the definition cache, whatever the category and for longer
+    than the definition itself, so the next lookup the cached definitions
+    can't answer (another category, or after they expire) goes straight there. For words never seen before, both dictionaries are
+    asked in parallel as soon as the observed fallback rate reaches
+    `parallel_threshold`, which trades a request for a round-trip. `stats`
+    tells how often each dictionary answers and how often the fallback is used.
+    """
+
+    def __init__(self, parallel_threshold=0.25, min_samples=20):
+        self.parallel_threshold = parallel_threshold
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0,
+            "learned_routes": 0,
+            "parallel": 0,
+            "answered_by_learners": 0,
+            "answered_by_collegiate": 0,
+            "fallbacks": 0,
+            "unanswered": 0,
+            "unused_responses": 0,
+        }
+
+    def fallback_ratio(self):
+        with self._lock:
+            answered = self._stats["answered_by_learners"] + self._stats["answered_by_collegiate"]
+            if answered < self.min_samples:
+                return 0.0
+            return self._stats["fallbacks"] / answered
+
+    def plan(self, word, cat=None, advanced=False):
+        """
+        Return the dictionaries to try in order, and whether to query them in parallel.
+        """
+        with self._lock:
+            self._stats["lookups"] += 1
+        if advanced:
+            return [COLLEGIATE, LEARNERS], False
+        hit, route = get_definition_cache().get("route", "mw_route", word)
+        if hit:
+            with self._lock:
+                self._stats["learned_routes"] += 1
+            return [route, LEARNERS if route == COLLEGIATE else COLLEGIATE], False
+        if self.fallback_ratio() >= self.parallel_threshold:
+            with self._lock:
+                self._stats["parallel"] += 1
+            return [LEARNERS, COLLEGIATE], True
+        return [LEARNERS, COLLEGIATE], False
+
+    def record(self, word, cat, order, winner, requested, advanced=False):
+        """
+        Count the outcome of a lookup. `requested` lists the dictionaries that were actually queried.
+        """
+        with self._lock:
+            if winner is None:
+                self._stats["unanswered"] += 1
+            else:
+                self._stats[f"answered_by_{winner.split('_')[1]}"] += 1
+                if winner != order[0]:
+                    self._stats["fallbacks"] += 1
+                self._stats["unused_responses"] += len([source for source in requested if source != winner])
+        if winner is not None and not advanced:
+            get_definition_cache().set("route", "mw_route", word, winner)
+            if winner != order[0]:
+                logging.info(f"{word} is answered by {winner}, will ask it first next time")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        answered = stats["answered_by_learners"] + stats["answered_by_collegiate"]
+        stats["fallback_ratio"] = stats["fallbacks"] / answered if answered else 0.0
+        return stats
+
+
+def get_mw_router():
+    router = current_app.extensions.get("mw_router")
+    if router is None:
+        router = MWRouter(parallel_threshold=current_app.config["MW_PARALLEL_THRESHOLD"])
+        router = current_app.extensions.setdefault("mw_router", router)
+    return router
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import current_app
+
+from .audio_cache import get_audio_cache
+from .http_client import http_post
+from .metrics import get_metrics
+from .rate_limit import TokenBucket
+from .sqlite_utils import SQLiteDatabase
+
+
+# Graph API errors meaning "slow down", which Meta sends with HTTP 400 rather than 429:
+# app, account, throughput, spam and per-recipient (pair) rate limits
+THROTTLING_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+REPLY_SEPARATOR = "\n\n――――――――\n\n"
+MAX_BODY_LENGTH = 4096
+
+# Token buckets kept, for the most recent recipients. The least recent one has normally
+# refilled by the time it is dropped, so a new bucket for it behaves the same
+MAX_BUCKETS = 4096
+
+
+def join_messages(messages, separator=REPLY_SEPARATOR, limit=MAX_BODY_LENGTH):
+    """
+    Join replies into as few WhatsApp messages as fit under the body size limit, keeping their order.
+    """
+    bodies = []
+    for message in messages:
+        if bodies and len(bodies[-1]) + len(separator) + len(message) <= limit:
+            bodies[-1] += separator + message
+        else:
+            bodies.append(message)
+    return bodies
+
+
+def text_message(recipient, body):
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient,
+        "type": "text",
+        "text": {"preview_url": False, "body": body},
+    }
+
+
+def is_throttled(response):
+    if response.status_code == 429:
+        return True
+    if response.status_code != 400:
+        return False
+    try:
+        return response.json().get("error", {}).get("code") in THROTTLING_ERROR_CODES
+    except ValueError:
+        return False
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else None
+
+
+class Outbox:
+    """
+    Durable queue of the WhatsApp messages to send, drained by a dispatcher thread.
+
+    Messages are written to SQLite and only deleted once the Graph API has
+    accepted them, so replies survive a restart or an outage of the API (a
+    crash right after a send can repeat that one message). Each recipient's
+    messages go out in order, through a token bucket per recipient number.
+    Sends run on a pool of threads and the dispatcher never waits for them:
+    a recipient with a send in flight, or no token left, is skipped until
+    the next pass, so a slow or throttled recipient holds up no one else.
+    Text messages are held for `coalesce_window` seconds, and the texts
+    queued for the same recipient by then are sent as one message.
+
+    A 429, or one of Meta's throttling errors, parks the recipient for its
+    Retry-After (or an exponential backoff); 5xx and network errors are
+    retried with backoff up to `max_attempts` times; any other error is
+    logged and the message kept as dead. When several server processes share
+    the file, a lease row makes sure only one of them dispatches at a time,
+    which keeps the per-recipient limits exact; it is renewed on every pass,
+    so it can't lapse while sends are in flight.
+    """
+
+    def __init__(self, app, path, rate=1.0, burst=5, coalesce_window=0.3, workers=4, max_attempts=8,
+                 retry_backoff=2.0, poll_interval=0.25, lease_seconds=30):
+        self.app = app
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.db = SQLiteDatabase(path)
+        self._buckets = OrderedDict()
+        self._buckets_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+        # Recipient -> future of the send in flight, only touched by the dispatching thread
+        self._in_flight = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                meta TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_status_recipient ON outbox (status, recipient, id)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_lease (id INTEGER PRIMARY KEY CHECK (id = 1), owner TEXT, expires_at REAL)"
+        )
+        self.db.execute("INSERT OR IGNORE INTO outbox_lease (id, owner, expires_at) VALUES (1, NULL, 0)")
+
+    def send_text(self, recipient, body):
+        return self._put(recipient, "text", body)
+
+    def send(self, message, meta=None):
+        """
+        Queue a Graph API message payload; only text messages (see `send_text`) are coalesced.
+        """
+        return self._put(message["to"], "message", json.dumps(message), meta)
+
+    def _put(self, recipient, kind, payload, meta=None):
+        now = time.time()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (recipient, kind, payload, meta, created_at, available_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (recipient, kind, payload, json.dumps(meta) if meta else None, now, now),
+            )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def depth(self):
+        return self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def dead_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+
+    def oldest_pending_age(self):
+        row = self.db.execute("SELECT MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()
+        return time.time() - row[0] if row[0] is not None else 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        remaining = self.depth()
+        if remaining:
+            logging.warning(f"{remaining} outgoing messages left in the outbox, they will be sent after the restart")
+
+    def _acquire_lease(self):
+        now = time.time()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE outbox_lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner = ? OR expires_at < ?)",
+                (self.owner, now + self.lease_seconds, self.owner, now),
+            )
+            return cursor.rowcount == 1
+
+    def _release_lease(self):
+        self.db.execute("UPDATE outbox_lease SET expires_at = 0 WHERE id = 1 AND owner = ?", (self.owner,))
+
+    def _run(self):
+        with self.app.app_context():
+            wait = 0
+            while not self._stopping.is_set():
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                wait = self.poll_interval
+                try:
+                    if self._acquire_lease():
+                        wait = min(wait, self.dispatch())
+                except Exception as e:
+                    logging.error(f"Outbox dispatch failed, will retry: {e}")
+            # Send what is due right away on shutdown, without waiting for more replies to coalesce
+            try:
+                if self._acquire_lease():
+                    self.dispatch(final=True)
+                    self._release_lease()
+            except Exception as e:
+                logging.error(f"Outbox dispatch failed on shutdown: {e}")
+
+    def _collect(self, wait=False):
+        """
+        Forget the sends that are over (all of them with `wait`), logging those that failed.
+        """
+        for recipient, future in list(self._in_flight.items()):
+            if not (wait or future.done()):
+                continue
+            del self._in_flight[recipient]
+            error = future.exception()
+            if error is not None:
+                logging.error(f"Sending to {recipient} failed: {type(error).__name__}: {error}")
+
+    def dispatch(self, final=False):
+        """
+        Start sending one batch to every recipient whose next message is due
+        and who has a token, and return the time until the next pass is due.
+        With `final`, wait for the sends to finish.
+        """
+        self._collect()
+        now = time.time()
+        heads = self.db.execute(
+            """
+            SELECT id, recipient, kind, created_at, available_at FROM outbox
+            WHERE id IN (SELECT MIN(id) FROM outbox WHERE status = 'pending' GROUP BY recipient)
+            """
+        ).fetchall()
+        next_due = self.poll_interval
+        for head_id, recipient, kind, created_at, available_at in heads:
+            if recipient in self._in_flight:
+                continue
+            due_at = available_at
+            if kind == "text" and not final:
+                due_at = max(due_at, created_at + self.coalesce_window)
+            if due_at > now:
+                next_due = min(next_due, due_at - now)
+                continue
+            wait = self._bucket(recipient).try_acquire()
+            if wait > 0:
+                next_due = min(next_due, wait)
+                continue
+            future = self._executor.submit(self._send_next, recipient)
+            # A finished send may free the recipient's next message
+            future.add_done_callback(lambda _: self._wakeup.set())
+            self._in_flight[recipient] = future
+        if final:
+            self._collect(wait=True)
+        return next_due
+
+    def _bucket(self, recipient):
+        with self._buckets_lock:
+            bucket = self._buckets.get(recipient)
+            if bucket is None:
+                bucket = self._buckets[recipient] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(recipient)
+            return bucket
+
+    def _next_batch(self, recipient):
+        rows = self.db.execute(
+            """
+            SELECT id, kind, payload, meta, attempts, created_at FROM outbox
+            WHERE status = 'pending' AND recipient = ? ORDER BY id LIMIT 50
+            """,
+            (recipient,),
+        ).fetchall()
+        if not rows or rows[0][1] != "text":
+            return rows[:1]
+        # Consecutive texts, as many as fit in one message
+        batch, length = [], 0
+        for row in rows:
+            added = len(row[2]) + (len(REPLY_SEPARATOR) if batch else 0)
+            if row[1] != "text" or (batch and length + added > MAX_BODY_LENGTH):
+                break
+            batch.append(row)
+            length += added
+        return batch
+
+    def _send_next(self, recipient):
+        with self.app.app_context():
+            batch = self._next_batch(recipient)
+            if not batch:
+                return
+            if batch[0][1] == "text":
+                message = text_message(recipient, REPLY_SEPARATOR.join(row[2] for row in batch))
+            else:
+                message = json.loads(batch[0][2])
+            self._post(recipient, message, batch)
+
+    def _post(self, recipient, message, batch):
+        config = current_app.config
+        url = f"{config['GRAPH_API_URL']}/{config['VERSION']}/{config['PHONE_NUMBER_ID']}/messages"
+        headers = {
+            "Content-type": "application/json",
+            "Authorization": f"Bearer {config['ACCESS_TOKEN']}",
+        }
+        metrics = get_metrics()
+        ids = [row[0] for row in batch]
+        start = time.perf_counter()
+        try:
+            # Throttling is handled here, per recipient, rather than by sleeping in the HTTP client
+            response = http_post(url, json=message, headers=headers, retries=0)
+        except requests.RequestException as e:
+            metrics.observe("outbox_send_seconds", time.perf_counter() - start, outcome=type(e).__name__)
+            self._retry(batch, f"{type(e).__name__}: {e}")
+            return
+        metrics.observe("outbox_send_seconds", time.perf_counter() - start, outcome=str(response.status_code))
+
+        if response.status_code == 200:
+            now = time.time()
+            self.db.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids)
+            for row in batch:
+                metrics.observe("outbox_delivery_seconds", now - row[5], kind=row[1])
+            metrics.inc("outbox_sent_total", kind=batch[0][1])
+            if len(batch) > 1:
+                metrics.inc("outbox_coalesced_total", len(batch) - 1)
+            logging.info(f"Sent {len(batch)} queued message(s) to {recipient}")
+            return
+
+        error = f"status {response.status_code}: {response.text[:500]}"
+        if is_throttled(response):
+            metrics.inc("outbox_throttled_total")
+            self._retry(batch, error, delay=retry_after(response), throttled=True)
+        elif response.status_code >= 500:
+            self._retry(batch, error)
+        else:
+            self._dead_letter(batch, error)
+
+    def _backoff(self, attempts):
+        return random.uniform(0.5, 1.0) * min(300.0, self.retry_backoff * 2 ** attempts)
+
+    def _retry(self, batch, error, delay=None, throttled=False):
+        attempts = max(row[4] for row in batch) + 1
+        # Throttling only delays the messages, it never gives up on them
+        if attempts >= self.max_attempts and not throttled:
+            self._dead_letter(batch, error)
+            return
+        if delay is None:
+            delay = self._backoff(attempts)
+        logging.warning(f"Sending messages {[row[0] for row in batch]} failed ({error}), retrying in {delay:.1f}s")
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE outbox SET attempts = ?, available_at = ?, last_error = ? WHERE id = ?",
+                [(attempts, time.time() + delay, error, row[0]) for row in batch],
+            )
+
+    def _dead_letter(self, batch, error):
+        logging.error(f"Could not send {len(batch)} message(s), keeping them as dead: {error}")
+        get_metrics().inc("outbox_dead_total", len(batch))
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = 'dead', last_error = ? WHERE id = ?",
+                [(error, row[0]) for row in batch],
+            )
+        for row in batch:
+            meta = json.loads(row[3]) if row[3] else {}
+            # The media may have expired on Meta's side: upload it again next time
+            if meta.get("audio_cache_key"):
+                get_audio_cache().forget_media_id(meta["audio_cache_key"])
+
+
+def init_outbox(app, start=True):
+    config = app.config
+    outbox = Outbox(
+        app,
+        config["OUTBOX_PATH"],
+        rate=config["OUTBOX_RATE"],
+        burst=config["OUTBOX_BURST"],
+        coalesce_window=config["OUTBOX_COALESCE_WINDOW"],
+        workers=config["OUTBOX_WORKERS"],
+        max_attempts=config["OUTBOX_MAX_ATTEMPTS"],
+        retry_backoff=config["OUTBOX_RETRY_BACKOFF"],
+    )
+    app.extensions["outbox"] = outbox
+    if start:
+        outbox.start()
+    return outbox
+
+
+def get_outbox():
+    return current_app.extensions["outbox"]
@@ -0,0 +1,104 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import current_app
+
+
+# Key set on a queued webhook body when the request asked to be profiled
+PROFILE_FLAG = "_profile"
+
+
+class SamplingProfiler:
+    """
+    Samples the call stack of one thread from a helper thread.
+
+    The profiled code runs unchanged: every `interval` seconds the helper
+    reads the thread's current frame and counts its stack, so the overhead is
+    a few microseconds per sample whatever the code does. The result is in
+    the "folded" format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopping.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def top(self, n=5):
+        """
+        The functions the thread was most often found in, with their share of the samples.
+        """
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(function, count / total) for function, count in leaves.most_common(n)]
+
+
+def should_profile(requested):
+    """
+    Whether to profile a webhook, when asked to by its request or picked by the sample rate.
+    """
+    config = current_app.config
+    if not config["PROFILE_ENABLED"]:
+        return False
+    return requested or random.random() < config["PROFILE_SAMPLE_RATE"]
+
+
+def profiled(handler):
+    """
+    Decorator for the job handler, running it under a `SamplingProfiler` when
+    the webhook was flagged for profiling. The stacks are written to
+    PROFILE_DIR/<message id>.folded.
+    """
+    @wraps(handler)
+    def wrapper(payload):
+        if not payload.pop(PROFILE_FLAG, False):
+            return handler(payload)
+        config = current_app.config
+        try:
+            message_id = payload["entry"][0]["changes"][0]["value"]["messages"][0]["id"]
+        except (KeyError, IndexError, TypeError):
+            message_id = f"job-{int(time.time() * 1000)}"
+        profiler = SamplingProfiler(interval=config["PROFILE_INTERVAL"])
+        try:
+            with profiler:
+                return handler(payload)
+        finally:
+            os.makedirs(config["PROFILE_DIR"], exist_ok=True)
+            path = os.path.join(config["PROFILE_DIR"], f"{message_id.replace('/', '_')}.folded")
+            with open(path, "w") as f:
+                f.write(profiler.folded())
+            top = ", ".join(f"{function} {share:.0%}" for function, share in profiler.top())
+            logging.info(f"Profile of {message_id} written to {path} ({sum(profiler.samples.values())} samples): {top}")
+    return wrapper
@@ -0,0 +1,176 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from .metrics import get_metrics
+
+
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+def redirected_http_client(api_url):
+    """
+    gspread HTTP client class sending Sheets API calls to `api_url` instead of Google, e.g. a local stand-in.
+    """
+    import gspread
+
+    google_url = gspread.urls.SPREADSHEETS_API_V4_BASE_URL
+
+    class RedirectedHTTPClient(gspread.HTTPClient):
+        def request(self, method, endpoint, *args, **kwargs):
+            if endpoint.startswith(google_url):
+                endpoint = api_url.rstrip("/") + endpoint[len(google_url):]
+            return super().request(method, endpoint, *args, **kwargs)
+
+    return RedirectedHTTPClient
+
+
+class SheetSession:
+    """
+    Process-wide Google Sheets client.
+
+    The service account credentials are parsed and authorized once, the access
+    token is refreshed a little before it expires, and worksheet handles are
+    cached per spreadsheet key, the `max_worksheets` most recently used ones
+    since every tenant has its own spreadsheet. Every handler can share one
+    instance from any thread.
+
+    Timing hooks registered with `add_timing_hook` are called with
+    (event, seconds) for "authorize", "refresh", "open" (cold worksheet
+    handle) and "reuse" (cached worksheet handle).
+    """
+
+    def __init__(self, creds_json, refresh_margin=300, api_url=None, max_worksheets=256):
+        self.creds_json = creds_json
+        self.refresh_margin = refresh_margin
+        self.api_url = api_url
+        self.max_worksheets = max_worksheets
+        self._client = None
+        self._worksheets = OrderedDict()
+        self._lock = threading.RLock()
+        self._hooks = []
+        self._stats = {"authorizations": 0, "refreshes": 0, "opens": 0, "reuses": 0, "cold_seconds": 0.0}
+
+    def add_timing_hook(self, hook):
+        self._hooks.append(hook)
+
+    def _emit(self, event, seconds):
+        for hook in self._hooks:
+            try:
+                hook(event, seconds)
+            except Exception as e:
+                logging.warning(f"Sheets timing hook failed: {e}")
+
+    def _authorize(self):
+        # gspread and oauth2client take a third of a second to import, which
+        # webhooks that never touch the sheet shouldn't pay for on a cold start
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        start = time.perf_counter()
+        # strict=False accepts the raw newlines of a private key pasted into the env var
+        creds_dict = json.loads(self.creds_json, strict=False)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+        http_client = redirected_http_client(self.api_url) if self.api_url else gspread.HTTPClient
+        self._client = gspread.authorize(creds, http_client=http_client)
+        self._client.http_client.login()
+        elapsed = time.perf_counter() - start
+        self._stats["authorizations"] += 1
+        self._stats["cold_seconds"] += elapsed
+        self._emit("authorize", elapsed)
+
+    def _refresh_if_needed(self):
+        auth = self._client.http_client.auth
+        expiry = getattr(auth, "expiry", None)
+        if expiry is None:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if (expiry - now).total_seconds() > self.refresh_margin:
+            return
+        start = time.perf_counter()
+        self._client.http_client.login()
+        elapsed = time.perf_counter() - start
+        self._stats["refreshes"] += 1
+        self._emit("refresh", elapsed)
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._authorize()
+            else:
+                self._refresh_if_needed()
+            return self._client
+
+    def worksheet(self, key, index=0):
+        """
+        Return a cached handle on worksheet `index` of spreadsheet `key`.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            client = self.client()
+            handle = self._worksheets.get((key, index))
+            if handle is not None:
+                self._worksheets.move_to_end((key, index))
+                self._stats["reuses"] += 1
+                self._emit("reuse", time.perf_counter() - start)
+                return handle
+            handle = client.open_by_key(key).get_worksheet(index)
+            self._worksheets[(key, index)] = handle
+            while len(self._worksheets) > self.max_worksheets:
+                self._worksheets.popitem(last=False)
+            elapsed = time.perf_counter() - start
+            self._stats["opens"] += 1
+            self._stats["cold_seconds"] += elapsed
+            self._emit("open", elapsed)
+            return handle
+
+    def invalidate(self, key=None):
+        """
+        Forget cached worksheet handles, e.g. after the sheet was renamed or re-shared.
+        """
+        with self._lock:
+            if key is None:
+                self._worksheets.clear()
+            else:
+                for cached in [k for k in self._worksheets if k[0] == key]:
+                    del self._worksheets[cached]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        # Every reuse avoided one authorize + open_by_key round-trip
+        cold_acquisitions = stats["opens"] or 1
+        stats["estimated_saved_seconds"] = stats["reuses"] * stats["cold_seconds"] / cold_acquisitions
+        return stats
+
+
+def get_sheet_session():
+    session = current_app.extensions.get("sheet_session")
+    if session is None:
+        session = SheetSession(
+            current_app.config["GOOGLE_SHEETS_CREDENTIALS"],
+            refresh_margin=current_app.config["SHEETS_TOKEN_REFRESH_MARGIN"],
+            api_url=current_app.config["SHEETS_API_URL"],
+            max_worksheets=current_app.config["SHEETS_CACHE_ITEMS"],
+        )
+        metrics = get_metrics()
+        session.add_timing_hook(lambda event, seconds: metrics.observe("sheets_session_seconds", seconds, event=event))
+        session = current_app.extensions.setdefault("sheet_session", session)
+    return session
+
+
+def get_vocab_worksheet(key=None):
+    """
+    The worksheet of vocabulary spreadsheet `key`, the default tenant's if not given.
+    """
+    return get_sheet_session().worksheet(key or current_app.config["VOCAB_SPREADSHEET_KEY"])
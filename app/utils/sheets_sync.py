@@ -0,0 +1,217 @@
+import logging
+import os
+import threading
+import time
+
+from .metrics import span
+from .tenants import DEFAULT_TENANT, get_tenant_registry
+from .vocab_sheet import get_vocab_sheet
+
+
+class SheetSync:
+    """
+    Background thread replaying local vocabulary changes onto the Google Sheets.
+
+    Pending operations are read in order and replayed onto the sheet of the
+    tenant they belong to; runs of consecutive appends are sent as a single
+    `append_rows` call. When several server processes share the store, a
+    lease row makes sure only one of them syncs at a time.
+    """
+
+    def __init__(self, app, store, interval=2.0, batch_size=100, lease_seconds=60):
+        self.app = app
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.store.db.execute(
+            "CREATE TABLE IF NOT EXISTS sync_lease (id INTEGER PRIMARY KEY CHECK (id = 1), owner TEXT, expires_at REAL)"
+        )
+        self.store.db.execute("INSERT OR IGNORE INTO sync_lease (id, owner, expires_at) VALUES (1, NULL, 0)")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sheet-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _acquire_lease(self):
+        now = time.time()
+        with self.store.db.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE sync_lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner = ? OR expires_at < ?)",
+                (self.owner, now + self.lease_seconds, self.owner, now),
+            )
+            return cursor.rowcount == 1
+
+    def _release_lease(self):
+        self.store.db.execute("UPDATE sync_lease SET expires_at = 0 WHERE id = 1 AND owner = ?", (self.owner,))
+
+    def sync_once(self):
+        """
+        Push pending operations from a process that doesn't run the sync
+        thread, e.g. a command line tool. Returns False, leaving them to the
+        server, when a running server holds the lease.
+        """
+        if not self._acquire_lease():
+            return False
+        try:
+            self.flush()
+        finally:
+            self._release_lease()
+        return True
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                if self._acquire_lease():
+                    self.reconcile()
+            except Exception as e:
+                logging.error(f"Vocabulary sheet reconciliation failed: {e}")
+            while not self._stopping.is_set():
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    if self._acquire_lease():
+                        self.flush()
+                except Exception as e:
+                    logging.error(f"Vocabulary sheet sync failed, will retry: {e}")
+            # Last chance to push what is left before shutting down
+            try:
+                if self._acquire_lease():
+                    self.flush()
+            except Exception as e:
+                logging.error(f"Vocabulary sheet sync failed on shutdown: {e}")
+
+    def flush(self):
+        """
+        Push all pending operations to the sheets.
+
+        Operations stay in order within each tenant. A tenant whose sheet
+        fails is left for the next round without holding up the others.
+        """
+        failed = []
+        while True:
+            ops = self.store.pending_ops(self.batch_size, skip_tenants=failed)
+            if not ops:
+                return
+            by_tenant = {}
+            for op_id, op, entry_id, tenant_id in ops:
+                by_tenant.setdefault(tenant_id, []).append((op_id, op, entry_id))
+            for tenant_id, tenant_ops in by_tenant.items():
+                try:
+                    self._flush_tenant(tenant_id, tenant_ops)
+                except Exception as e:
+                    logging.error(f"Vocabulary sheet sync of tenant {tenant_id} failed, will retry: {e}")
+                    failed.append(tenant_id)
+
+    def _flush_tenant(self, tenant_id, ops):
+        tenant = get_tenant_registry().get(tenant_id)
+        if tenant is None or not tenant["spreadsheet_key"]:
+            # Tenants without a sheet, or no longer registered, only have the local store
+            self.store.mark_done([op_id for op_id, _, _ in ops])
+            return
+        vocab_sheet = get_vocab_sheet(tenant["spreadsheet_key"])
+        appends = []
+        # An edit is superseded by a later edit or delete of the same entry, and made
+        # redundant by an append still in this batch, which sends the current definition
+        last_op = {entry_id: index for index, (_, _, entry_id) in enumerate(ops)}
+        appending = set()
+        for index, (op_id, op, entry_id) in enumerate(ops):
+            if op == "append":
+                appends.append((op_id, entry_id))
+                appending.add(entry_id)
+                continue
+            if op == "update" and (last_op[entry_id] != index or entry_id in appending):
+                self.store.mark_done([op_id])
+                continue
+            # Anything else ends the run of appends, which must land first
+            self._flush_appends(vocab_sheet, appends)
+            appends = []
+            self._apply(vocab_sheet, op_id, op, entry_id)
+        self._flush_appends(vocab_sheet, appends)
+
+    def _flush_appends(self, vocab_sheet, appends):
+        if not appends:
+            return
+        op_ids, entries = [], []
+        for op_id, entry_id in appends:
+            op_ids.append(op_id)
+            entry = self.store.get_entry(entry_id)
+            # Entries deleted before they ever reached the sheet are skipped
+            if entry is not None and not entry["deleted"]:
+                entries.append(entry)
+        rows = [
+            [entry["language"], entry["word"], entry["category"], entry["definition"], entry["quote"]]
+            for entry in entries
+        ]
+        sheet_rows = []
+        if rows:
+            with span("sheets_append"):
+                sheet_rows = vocab_sheet.append_rows(rows)
+        self.store.mark_appended(op_ids, [(entry["id"], row) for entry, row in zip(entries, sheet_rows)])
+        logging.info(f"Synced {len(rows)} new vocabulary rows to the sheet")
+
+    def _apply(self, vocab_sheet, op_id, op, entry_id):
+        entry = self.store.get_entry(entry_id)
+        sheet_row = entry["sheet_row"] if entry else None
+        if op == "update":
+            if sheet_row is not None and not entry["deleted"] and self._row_holds(vocab_sheet, entry, op):
+                with span("sheets_update"):
+                    vocab_sheet.update_definition(sheet_row, entry["definition"])
+            self.store.mark_done([op_id])
+        elif op == "delete":
+            if sheet_row is not None and not self._row_holds(vocab_sheet, entry, op):
+                # Left in the sheet rather than deleting someone else's row
+                sheet_row = None
+            if sheet_row is not None:
+                with span("sheets_delete"):
+                    vocab_sheet.delete_row(sheet_row)
+            self.store.mark_row_deleted(op_id, entry_id, sheet_row)
+
+    def _row_holds(self, vocab_sheet, entry, op):
+        """
+        Edits address rows by position: check that the entry's row is still
+        its own before writing to it, in case the sheet was changed by hand.
+        """
+        with span("sheets_check_row"):
+            holds = vocab_sheet.holds(entry["sheet_row"], entry["word"])
+        if not holds:
+            logging.warning(
+                f"Row {entry['sheet_row']} of the vocabulary sheet no longer holds {entry['word']!r}, "
+                f"skipping its {op}"
+            )
+        return holds
+
+    def reconcile(self):
+        """
+        Bring the local store and the default tenant's sheet back in line on startup.
+
+        Pending operations are pushed first. If the sheet then differs from
+        the local copy (someone edited it by hand, or the store is new), the
+        sheet wins and the store is rebuilt from it. The sheets of the other
+        tenants were only ever written by the sync, so they are not read.
+        """
+        self.flush()
+        if self.store.pending_count():
+            logging.warning("Vocabulary sheet still has pending changes, skipping reconciliation")
+            return
+        vocab_sheet = get_vocab_sheet()
+        with span("sheets_read_all"):
+            rows = vocab_sheet.worksheet.get_all_values()
+        sheet_words = [row[1] if len(row) > 1 else "" for row in rows[1:]]
+        if sheet_words == self.store.synced_words(DEFAULT_TENANT):
+            logging.info("Vocabulary store matches the sheet")
+        else:
+            self.store.replace_from_sheet(rows, DEFAULT_TENANT)
@@ -0,0 +1,226 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import with_appcontext
+
+from .metrics import tag_trace
+from .sqlite_utils import SQLiteDatabase
+
+
+# The learner configured with RECIPIENT_WAID and VOCAB_SPREADSHEET_KEY, who owns every entry saved before tenancy
+DEFAULT_TENANT = "default"
+
+TENANT_COLUMNS = ["id", "recipient", "spreadsheet_key", "language"]
+
+
+def normalize_wa_id(wa_id):
+    """
+    WhatsApp IDs are sent as bare digits, while RECIPIENT_WAID is often written "+33 6 ...".
+    """
+    return re.sub(r"\D", "", wa_id or "")
+
+
+class TenantRegistry:
+    """
+    The learners the bot serves, keyed by the WhatsApp ID they write from.
+
+    A tenant is a dict with its `id` (its WhatsApp ID), the `recipient` its
+    replies go to, the `spreadsheet_key` its vocabulary is synced to (None to
+    keep it in the local store only) and the `language` assumed when a vocab
+    message names none. Tenants are rows of a SQLite table; senders resolved
+    recently, unknown ones included, are kept in a bounded LRU for `ttl`
+    seconds, so a warm sender costs no I/O and tenants added from another
+    process show up within `ttl`.
+
+    Messages from senders that are not registered go to the default tenant,
+    or are dropped with `unknown_senders="ignore"`.
+    """
+
+    def __init__(self, path, default, unknown_senders="default", memory_items=4096, ttl=60):
+        self.db = SQLiteDatabase(path)
+        self.default = default
+        self.default_wa_id = normalize_wa_id(default["recipient"])
+        self.unknown_senders = unknown_senders
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tenants (
+                id TEXT PRIMARY KEY,
+                recipient TEXT NOT NULL,
+                spreadsheet_key TEXT,
+                language TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+
+    def _load(self, tenant_id):
+        now = time.time()
+        with self._lock:
+            cached = self._recent.get(tenant_id)
+            if cached is not None and cached[1] > now:
+                self._recent.move_to_end(tenant_id)
+                return cached[0]
+        row = self.db.execute(
+            f"SELECT {', '.join(TENANT_COLUMNS)} FROM tenants WHERE id = ?", (tenant_id,)
+        ).fetchone()
+        tenant = dict(zip(TENANT_COLUMNS, row)) if row else None
+        with self._lock:
+            self._recent[tenant_id] = (tenant, now + self.ttl)
+            self._recent.move_to_end(tenant_id)
+            while len(self._recent) > self.memory_items:
+                self._recent.popitem(last=False)
+        return tenant
+
+    def get(self, tenant_id):
+        """
+        Return the tenant with this ID, or None if it is not (or no longer) registered.
+        """
+        if tenant_id == DEFAULT_TENANT:
+            return self.default
+        return self._load(tenant_id)
+
+    def lookup(self, wa_id):
+        """
+        Return the tenant writing from `wa_id`, or None if it is not registered.
+        """
+        wa_id = normalize_wa_id(wa_id)
+        if not wa_id:
+            return None
+        if wa_id == self.default_wa_id:
+            return self.default
+        return self._load(wa_id)
+
+    def resolve(self, wa_id):
+        """
+        Return the tenant a message from `wa_id` belongs to, or None to ignore it.
+        """
+        tenant = self.lookup(wa_id)
+        if tenant is None and self.unknown_senders == "default":
+            return self.default
+        return tenant
+
+    def register(self, wa_id, spreadsheet_key=None, recipient=None, language=None):
+        tenant_id = normalize_wa_id(wa_id)
+        if not tenant_id:
+            raise ValueError(f"Not a WhatsApp ID: {wa_id!r}")
+        self.db.execute(
+            "INSERT OR REPLACE INTO tenants (id, recipient, spreadsheet_key, language, created_at) VALUES (?, ?, ?, ?, ?)",
+            (tenant_id, normalize_wa_id(recipient) or tenant_id, spreadsheet_key, language, time.time()),
+        )
+        self.forget(tenant_id)
+        return self.get(tenant_id)
+
+    def remove(self, wa_id):
+        """
+        Unregister a tenant. Its entries stay in the vocabulary store.
+        """
+        tenant_id = normalize_wa_id(wa_id)
+        cursor = self.db.execute("DELETE FROM tenants WHERE id = ?", (tenant_id,))
+        self.forget(tenant_id)
+        return cursor.rowcount == 1
+
+    def forget(self, tenant_id):
+        with self._lock:
+            self._recent.pop(tenant_id, None)
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM tenants").fetchone()[0]
+
+
+def init_tenant_registry(app):
+    config = app.config
+    default = {
+        "id": DEFAULT_TENANT,
+        "recipient": config["RECIPIENT_WAID"] or "",
+        "spreadsheet_key": config["VOCAB_SPREADSHEET_KEY"],
+        "language": config["TENANT_DEFAULT_LANGUAGE"],
+    }
+    registry = TenantRegistry(
+        config["TENANTS_PATH"],
+        default,
+        unknown_senders=config["TENANT_UNKNOWN_SENDERS"],
+        memory_items=config["TENANT_MEMORY_ITEMS"],
+        ttl=config["TENANT_CACHE_TTL"],
+    )
+    app.extensions["tenant_registry"] = registry
+    return registry
+
+
+def get_tenant_registry():
+    return current_app.extensions["tenant_registry"]
+
+
+def get_tenant():
+    """
+    The tenant of the message being processed, or the default tenant outside of one.
+    """
+    tenant = g.get("tenant") if has_app_context() else None
+    return tenant or get_tenant_registry().default
+
+
+def message_sender(payload):
+    """
+    The WhatsApp ID a single-message webhook payload comes from, or None.
+    Also the job queue's partition key, so each sender's messages run in order.
+    """
+    try:
+        value = payload["entry"][0]["changes"][0]["value"]
+        return normalize_wa_id(value["messages"][0].get("from") or value["contacts"][0]["wa_id"]) or None
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def tenant_scoped(handler):
+    """
+    Decorator for the job handler: resolves the sender's tenant, which
+    `get_tenant` then returns for the rest of the job, and drops messages
+    from senders that have none.
+    """
+    @wraps(handler)
+    def wrapper(payload):
+        sender = message_sender(payload)
+        tenant = get_tenant_registry().resolve(sender)
+        if tenant is None:
+            logging.info(f"Ignoring a message from {sender}, who is not a registered learner")
+            return None
+        # Each job runs in its own app context, so `g` holds this message's tenant only
+        g.tenant = tenant
+        tag_trace(tenant=tenant["id"])
+        return handler(payload)
+    return wrapper
+
+
+@click.command("add-tenant")
+@click.argument("wa_id")
+@click.option("--sheet", "spreadsheet_key", help="Key of the spreadsheet to sync the vocabulary to (none: local store only).")
+@click.option("--recipient", help="WhatsApp ID replies go to, if not WA_ID.")
+@click.option("--language", type=click.Choice(["en", "fr", "fren"]), help="Language of vocab messages that name none.")
+@with_appcontext
+def add_tenant_command(wa_id, spreadsheet_key, recipient, language):
+    """Register (or update) the learner writing from WA_ID."""
+    tenant = get_tenant_registry().register(wa_id, spreadsheet_key, recipient, language)
+    click.echo(
+        f"Tenant {tenant['id']}: replies to {tenant['recipient']}, "
+        f"sheet {tenant['spreadsheet_key'] or '(none)'}, language {tenant['language'] or '(none)'}"
+    )
+
+
+@click.command("remove-tenant")
+@click.argument("wa_id")
+@with_appcontext
+def remove_tenant_command(wa_id):
+    """Stop serving the learner writing from WA_ID. Their saved words are kept."""
+    if get_tenant_registry().remove(wa_id):
+        click.echo(f"Removed tenant {normalize_wa_id(wa_id)}")
+    else:
+        raise click.ClickException(f"No tenant {normalize_wa_id(wa_id)}")
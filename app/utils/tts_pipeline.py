@@ -0,0 +1,122 @@
+import logging
+import subprocess
+import threading
+import time
+from io import BytesIO
+
+
+# Same container and codec pydub's export(format="opus") asks ffmpeg for
+FFMPEG_OPUS_ARGS = [
+    "-hide_banner", "-loglevel", "error",
+    "-f", "mp3", "-i", "pipe:0",
+    "-vn", "-c:a", "libopus", "-f", "opus", "pipe:1",
+]
+
+
+def _drain(stream, chunks):
+    for chunk in iter(lambda: stream.read(65536), b""):
+        chunks.append(chunk)
+
+
+def transcode_to_opus(mp3_chunks, ffmpeg="ffmpeg"):
+    """
+    Pipe MP3 chunks through a single ffmpeg process and collect the Opus output.
+
+    The encoder starts while the first chunks are still being produced, and no
+    decoded PCM ever reaches Python. Returns the Opus buffer and the time
+    spent in each stage, in seconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [ffmpeg] + FFMPEG_OPUS_ARGS,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    timings["spawn"] = time.perf_counter() - start
+
+    out_chunks, err_chunks = [], []
+    readers = [
+        threading.Thread(target=_drain, args=(process.stdout, out_chunks), daemon=True),
+        threading.Thread(target=_drain, args=(process.stderr, err_chunks), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    produce_start = time.perf_counter()
+    fed = False
+    try:
+        try:
+            for chunk in mp3_chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg exited early, its return code says why
+            pass
+        fed = True
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        timings["synthesis"] = time.perf_counter() - produce_start
+
+        encode_start = time.perf_counter()
+        if not fed:
+            # The speech stream failed: don't let ffmpeg encode half of it
+            process.kill()
+        process.wait()
+        for reader in readers:
+            reader.join()
+    timings["encode_tail"] = time.perf_counter() - encode_start
+    timings["total"] = time.perf_counter() - start
+
+    if process.returncode != 0:
+        error = b"".join(err_chunks).decode("utf-8", "replace").strip()
+        raise RuntimeError(f"ffmpeg failed with code {process.returncode}: {error}")
+
+    opus_buffer = BytesIO(b"".join(out_chunks))
+    return opus_buffer, timings
+
+
+def transcode_with_pydub(mp3_bytes):
+    """
+    Previous pipeline: decode the whole MP3 to PCM with one ffmpeg process, then
+    encode it with a second one. Kept for comparison and as a fallback.
+    """
+    from pydub import AudioSegment
+
+    timings = {}
+    start = time.perf_counter()
+    audio = AudioSegment.from_file(BytesIO(mp3_bytes), format="mp3")
+    timings["decode"] = time.perf_counter() - start
+    encode_start = time.perf_counter()
+    opus_buffer = BytesIO()
+    audio.export(opus_buffer, format="opus")
+    opus_buffer.seek(0)
+    timings["encode"] = time.perf_counter() - encode_start
+    timings["total"] = time.perf_counter() - start
+    return opus_buffer, timings
+
+
+def synthesize_opus(lang, text, pipeline="stream"):
+    """
+    Turn text into an Opus voice note. Returns the buffer and per-stage timings.
+    """
+    from gtts import gTTS
+
+    tts = gTTS(text=text, lang=lang)
+    if pipeline == "pydub":
+        start = time.perf_counter()
+        mp3_buffer = BytesIO()
+        tts.write_to_fp(mp3_buffer)
+        synthesis = time.perf_counter() - start
+        opus_buffer, timings = transcode_with_pydub(mp3_buffer.getvalue())
+        timings["synthesis"] = synthesis
+        timings["total"] += synthesis
+    else:
+        opus_buffer, timings = transcode_to_opus(tts.stream())
+    logging.info(
+        "Generated voice note: " + ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+    )
+    return opus_buffer, timings
@@ -0,0 +1,71 @@
+import re
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from .sheets_session import get_vocab_worksheet
+
+
+# Row numbers out of an A1 range such as "Sheet1!A12:E12"
+UPDATED_RANGE_PATTERN = re.compile(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+_sheets_lock = threading.Lock()
+
+
+class VocabSheet:
+    """
+    Vocabulary worksheet, addressed by row number.
+
+    New rows are written with the Sheets append API, which finds the end of
+    the table server-side, and their row numbers are read back from the
+    response, so the sheet is never downloaded to find where it ends.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def append_rows(self, rows):
+        """
+        Append rows at the end of the sheet and return their row numbers.
+        """
+        response = self.worksheet.append_rows(rows, table_range="A1")
+        match = UPDATED_RANGE_PATTERN.search(response["updates"]["updatedRange"])
+        last = int(match.group(2) or match.group(1))
+        return list(range(last - len(rows) + 1, last + 1))
+
+    def holds(self, row, word):
+        """
+        Whether `row` still holds `word`, i.e. rows were not inserted, deleted or sorted by hand since it was synced.
+        """
+        values = self.worksheet.get(f"B{row}")
+        found = values[0][0] if values and values[0] else ""
+        return found.strip().lower() == (word or "").strip().lower()
+
+    def update_definition(self, row, definition):
+        self.worksheet.update_cell(row, 4, definition)
+
+    def delete_row(self, row):
+        self.worksheet.delete_rows(row)
+
+
+def get_vocab_sheet(key=None):
+    """
+    The VocabSheet of spreadsheet `key`, the default tenant's if not given.
+
+    Only the SHEETS_CACHE_ITEMS most recently used sheets are kept.
+    """
+    key = key or current_app.config["VOCAB_SPREADSHEET_KEY"]
+    with _sheets_lock:
+        sheets = current_app.extensions.setdefault("vocab_sheets", OrderedDict())
+        sheet = sheets.get(key)
+        if sheet is not None:
+            sheets.move_to_end(key)
+            return sheet
+    sheet = VocabSheet(get_vocab_worksheet(key))
+    with _sheets_lock:
+        sheet = sheets.setdefault(key, sheet)
+        sheets.move_to_end(key)
+        while len(sheets) > current_app.config["SHEETS_CACHE_ITEMS"]:
+            sheets.popitem(last=False)
+    return sheet
@@ -0,0 +1,244 @@
+import logging
+import time
+
+from flask import current_app
+
+from .sheets_sync import SheetSync
+from .sqlite_utils import SQLiteDatabase
+from .tenants import DEFAULT_TENANT
+
+
+ENTRY_COLUMNS = ["id", "language", "word", "category", "definition", "quote", "sheet_row", "deleted", "tenant", "version"]
+
+
+class VocabStore:
+    """
+    Local SQLite copy of the vocabulary, used for every read and write.
+
+    Each change is also recorded in the `sheet_ops` table; SheetSync replays
+    those operations onto the Google Sheet in the background. `sheet_row` is
+    the row an entry currently occupies in the sheet, or NULL until its
+    append has been synced.
+
+    Every entry belongs to a tenant, whose sheet it is synced to. One file
+    holds all of them: reads and writes are scoped by the `tenant` column,
+    which leads every index.
+
+    `version` goes up with every change to an entry. Edits made from an
+    entry read earlier pass its version, and are refused if the entry has
+    changed since, instead of overwriting that change.
+    """
+
+    def __init__(self, path):
+        self.db = SQLiteDatabase(path)
+        self.listeners = []
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                language TEXT NOT NULL,
+                word TEXT NOT NULL,
+                category TEXT,
+                definition TEXT,
+                quote TEXT,
+                sheet_row INTEGER,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                tenant TEXT NOT NULL DEFAULT 'default',
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(entries)")}
+        if "tenant" not in columns:
+            # Stores from before tenancy hold the default tenant's words
+            self.db.execute(f"ALTER TABLE entries ADD COLUMN tenant TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'")
+        if "version" not in columns:
+            self.db.execute("ALTER TABLE entries ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        for index in ("entries_word", "entries_language", "entries_sheet_row"):
+            self.db.execute(f"DROP INDEX IF EXISTS {index}")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_tenant_recent ON entries (tenant, deleted)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_tenant_word ON entries (tenant, lower(word), deleted)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_tenant_sheet_row ON entries (tenant, sheet_row)")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sheet_ops (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                entry_id INTEGER NOT NULL
+            )
+            """
+        )
+
+    def _entry(self, row):
+        return dict(zip(ENTRY_COLUMNS, row)) if row else None
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def add_entry(self, language, word, category, definition, quote, tenant=DEFAULT_TENANT):
+        return self.add_entries([(language, word, category, definition, quote)], tenant)[0]
+
+    def add_entries(self, entries, tenant=DEFAULT_TENANT):
+        """
+        Insert (language, word, category, definition, quote) tuples in one
+        transaction, so that the sync sends them to the sheet together.
+        """
+        entry_ids = []
+        now = time.time()
+        with self.db.transaction() as conn:
+            for language, word, category, definition, quote in entries:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO entries (language, word, category, definition, quote, created_at, tenant)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (language, word, category, definition, quote, now, tenant),
+                )
+                entry_ids.append(cursor.lastrowid)
+                conn.execute("INSERT INTO sheet_ops (op, entry_id) VALUES ('append', ?)", (cursor.lastrowid,))
+        self._changed()
+        return entry_ids
+
+    def get_entry(self, entry_id):
+        row = self.db.execute(
+            f"SELECT {', '.join(ENTRY_COLUMNS)} FROM entries WHERE id = ?", (entry_id,)
+        ).fetchone()
+        return self._entry(row)
+
+    def last_entry(self, tenant=DEFAULT_TENANT):
+        row = self.db.execute(
+            f"SELECT {', '.join(ENTRY_COLUMNS)} FROM entries WHERE tenant = ? AND deleted = 0 ORDER BY id DESC LIMIT 1",
+            (tenant,),
+        ).fetchone()
+        return self._entry(row)
+
+    def find_latest_by_word(self, word, language=None, tenant=DEFAULT_TENANT):
+        """
+        Return the tenant's most recent entry for `word` (case-insensitive), or None.
+        """
+        sql = f"SELECT {', '.join(ENTRY_COLUMNS)} FROM entries WHERE tenant = ? AND lower(word) = ? AND deleted = 0"
+        params = [tenant, word.strip().lower()]
+        if language is not None:
+            sql += " AND language = ?"
+            params.append(language)
+        row = self.db.execute(sql + " ORDER BY id DESC LIMIT 1", params).fetchone()
+        return self._entry(row)
+
+    def _change(self, op, entry_id, version, assignment, params=()):
+        sql = f"UPDATE entries SET {assignment}, version = version + 1 WHERE id = ? AND deleted = 0"
+        params = (*params, entry_id)
+        if version is not None:
+            sql += " AND version = ?"
+            params += (version,)
+        with self.db.transaction() as conn:
+            if conn.execute(sql, params).rowcount != 1:
+                return False
+            conn.execute("INSERT INTO sheet_ops (op, entry_id) VALUES (?, ?)", (op, entry_id))
+        self._changed()
+        return True
+
+    def update_definition(self, entry_id, definition, version=None):
+        """
+        Replace an entry's definition. Returns False, changing nothing, if the
+        entry was deleted or, when `version` is given, changed since it was read.
+        """
+        return self._change("update", entry_id, version, "definition = ?", (definition,))
+
+    def delete_entry(self, entry_id, version=None):
+        """
+        Delete an entry, with the same checks as `update_definition`.
+        """
+        return self._change("delete", entry_id, version, "deleted = 1")
+
+    def pending_ops(self, limit, skip_tenants=()):
+        """
+        Return the oldest (op id, op, entry id, tenant) operations, leaving out those of `skip_tenants`.
+        """
+        skip = ", ".join("?" * len(skip_tenants))
+        return self.db.execute(
+            f"""
+            SELECT sheet_ops.id, op, entry_id, COALESCE(entries.tenant, '{DEFAULT_TENANT}')
+            FROM sheet_ops LEFT JOIN entries ON entries.id = sheet_ops.entry_id
+            {f"WHERE COALESCE(entries.tenant, '{DEFAULT_TENANT}') NOT IN ({skip})" if skip_tenants else ""}
+            ORDER BY sheet_ops.id LIMIT ?
+            """,
+            (*skip_tenants, limit),
+        ).fetchall()
+
+    def pending_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM sheet_ops").fetchone()[0]
+
+    def mark_appended(self, op_ids, entry_rows):
+        with self.db.transaction() as conn:
+            conn.executemany("UPDATE entries SET sheet_row = ? WHERE id = ?", [(row, entry_id) for entry_id, row in entry_rows])
+            conn.executemany("DELETE FROM sheet_ops WHERE id = ?", [(op_id,) for op_id in op_ids])
+
+    def mark_row_deleted(self, op_id, entry_id, sheet_row):
+        with self.db.transaction() as conn:
+            conn.execute("UPDATE entries SET sheet_row = NULL WHERE id = ?", (entry_id,))
+            if sheet_row is not None:
+                # Rows below the deleted one move up by one in the tenant's sheet
+                conn.execute(
+                    """
+                    UPDATE entries SET sheet_row = sheet_row - 1
+                    WHERE tenant = (SELECT tenant FROM entries WHERE id = ?) AND sheet_row > ?
+                    """,
+                    (entry_id, sheet_row),
+                )
+            conn.execute("DELETE FROM sheet_ops WHERE id = ?", (op_id,))
+
+    def mark_done(self, op_ids):
+        with self.db.transaction() as conn:
+            conn.executemany("DELETE FROM sheet_ops WHERE id = ?", [(op_id,) for op_id in op_ids])
+
+    def synced_words(self, tenant=DEFAULT_TENANT):
+        """
+        Return the words of the tenant's synced entries, in sheet order.
+        """
+        rows = self.db.execute(
+            "SELECT word FROM entries WHERE tenant = ? AND deleted = 0 AND sheet_row IS NOT NULL ORDER BY sheet_row",
+            (tenant,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def replace_from_sheet(self, rows, tenant=DEFAULT_TENANT):
+        """
+        Rebuild the tenant's entries from its sheet contents (a list of rows, header first).
+        """
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM entries WHERE tenant = ? AND (sheet_row IS NOT NULL OR deleted = 1)", (tenant,))
+            now = time.time()
+            conn.executemany(
+                """
+                INSERT INTO entries (language, word, category, definition, quote, sheet_row, created_at, tenant)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    ((row + [""] * 5)[:5] + [index, now, tenant])
+                    for index, row in enumerate(rows[1:], start=2)
+                ],
+            )
+        logging.info(f"Vocabulary store of tenant {tenant} rebuilt from {len(rows) - 1} sheet rows")
+
+
+def init_vocab_store(app, start=True):
+    store = VocabStore(app.config["VOCAB_STORE_PATH"])
+    app.extensions["vocab_store"] = store
+    if app.config["VOCAB_SYNC_ENABLED"]:
+        sync = SheetSync(
+            app,
+            store,
+            interval=app.config["VOCAB_SYNC_INTERVAL"],
+            batch_size=app.config["VOCAB_SYNC_BATCH_SIZE"],
+        )
+        store.listeners.append(sync.notify)
+        app.extensions["sheet_sync"] = sync
+        if start:
+            sync.start()
+    return store
+
+
+def get_vocab_store():
+    return current_app.extensions["vocab_store"]
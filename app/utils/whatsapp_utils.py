@@ -1,32 +1,29 @@
 import logging
-from flask import current_app, jsonify
+from flask import current_app
 import json
 import requests
 import re
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from pprint import pprint as pp
 import os
-from dotenv import load_dotenv
-from google.cloud import datastore
 from io import BytesIO 
-from gtts import gTTS
-from pydub import AudioSegment
+from functools import wraps
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .audio_cache import get_audio_cache
+from .definition_cache import get_definition_cache
+from .headwords import SOURCE_LANGUAGES, did_you_mean, get_headword_index
+from .http_client import http_get, http_post
+from .metrics import span, tag_trace, timed
+from .mw_routing import get_mw_router, pick_mw_entry
+from .outbox import get_outbox, join_messages
+from .rate_limit import TokenBucket
+from .tenants import get_tenant
+from .tts_pipeline import synthesize_opus
+from .vocab_store import get_vocab_store
+from .wiktionary_index import get_wiktionary_index
+from .wiktionary_parser import parse_extract
 
 
-def is_duplicate_message(client, message_id):
-    # Create a key for the message ID
-    key = client.key("MessageID", message_id)
-    entity = client.get(key)
-    return entity is not None
-
-def store_message_id(client, message_id):
-    # Create a new entity to store the message ID
-    key = client.key("MessageID", message_id)
-    entity = datastore.Entity(key)
-    entity.update({"processed": True})
-    client.put(entity)
-
 def log_http_response(response):
     logging.info(f"Status: {response.status_code}")
     logging.info(f"Content-type: {response.headers.get('content-type')}")
@@ -56,9 +53,10 @@ def get_audio_message_input(recipient, audio_url):
         }
     )
 
+@timed("upload_audio")
 def upload_audio(file_obj):
 
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/media"
+    url = f"{current_app.config['GRAPH_API_URL']}/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/media"
     headers = {
         "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
     }
@@ -76,7 +74,7 @@ def upload_audio(file_obj):
     }
 
     # Send the request as multipart/form-data
-    response = requests.post(url, headers=headers, files=files, data=data)
+    response = http_post(url, headers=headers, files=files, data=data)
     if response.status_code == 200:
         media_id = response.json().get('id')
         print("Media uploaded successfully, media ID:", media_id)
@@ -85,35 +83,32 @@ def upload_audio(file_obj):
         print(f"Failed to upload media: {response.status_code} - {response.text}")
         return None
 
+@timed("tts")
 def generate_audio_file(lang, word):
-    
-    tts = gTTS(text=word, lang=lang)
-    mp3_buffer = BytesIO()
-    tts.write_to_fp(mp3_buffer)
-    mp3_buffer.seek(0)  # Reset buffer position
-
-    # Load the MP3 file from memory and convert to OPUS using pydub
-    audio = AudioSegment.from_file(mp3_buffer, format="mp3")
-    opus_buffer = BytesIO()
-    audio.export(opus_buffer, format="opus")
-    opus_buffer.seek(0)  # Reset buffer position
 
+    opus_buffer, _ = synthesize_opus(lang, word, pipeline=current_app.config["TTS_PIPELINE"])
     return opus_buffer
 
 def send_audio_message(recipient, lang, word):
 
-    audio_file = generate_audio_file(lang, word)
-    media_id = upload_audio(audio_file)
+    # Repeated phrases skip synthesis, transcoding and upload when possible
+    audio_cache = get_audio_cache()
+    cache_key = audio_cache.key(lang, word)
+    media_id = audio_cache.get_media_id(cache_key)
     if media_id is None:
-        error_message = "Media_ID not found"
-        data = get_text_message_input(current_app.config["RECIPIENT_WAID"], error_message)
-        return send_message(error_message)
+        audio = audio_cache.get_audio(cache_key)
+        if audio is None:
+            audio_file = generate_audio_file(lang, word)
+            audio_cache.put_audio(cache_key, audio_file.getvalue())
+        else:
+            audio_file = BytesIO(audio)
+        media_id = upload_audio(audio_file)
+        if media_id is None:
+            error_message = "Media_ID not found"
+            data = get_text_message_input(recipient, error_message)
+            return send_message(data)
+        audio_cache.set_media_id(cache_key, media_id)
     
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
     data = {
         "messaging_product": "whatsapp",
         "to": recipient,
@@ -123,37 +118,22 @@ def send_audio_message(recipient, lang, word):
         }
     }
 
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code == 200:
-        print("Audio message sent successfully")
-    else:
-        print(f"Failed to send audio message: {response.status_code} - {response.text}")
+    # If Meta rejects the media ID, the outbox forgets it so the next send uploads it again
+    with span("send_message"):
+        get_outbox().send(data, meta={"audio_cache_key": cache_key})
 
+@timed("send_message")
 def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-
-    try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
-        response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-    except requests.Timeout:
-        logging.error("Timeout occurred while sending message")
-        return jsonify({"status": "error", "message": "Request timed out"}), 408
-    except (
-        requests.RequestException
-    ) as e:  # This will catch any general request exception
-        logging.error(f"Request failed due to: {e}")
-        return jsonify({"status": "error", "message": "Failed to send message"}), 500
-    else:
-        # Process the response as normal
-        log_http_response(response)
-        return response
+    """
+    Queue a message (as built by get_text_message_input) in the outbox, which
+    sends it within Meta's rate limits and retries it until it is accepted.
+    Returns the outbox ID.
+    """
+    message = json.loads(data)
+    if message.get("type") == "text":
+        # Text replies queued for the same recipient within the coalescing window go out as one message
+        return get_outbox().send_text(message["to"], message["text"]["body"])
+    return get_outbox().send(message)
 
 def process_text_for_whatsapp(text):
     # Remove brackets
@@ -172,6 +152,7 @@ def process_text_for_whatsapp(text):
 
     return whatsapp_style_text
 
+@timed("parse")
 def extract_word_and_category_and_quote(text):
     cat, quote, word, quote_style = "", "", text.strip(), None
     match_cat = re.search(r'\((.*)\)', text)
@@ -190,14 +171,184 @@ def extract_word_and_category_and_quote(text):
 
     return [word, cat, quote]
 
+def is_empty_mw_payload(data):
+    # Unknown words come back as an empty list or a list of spelling suggestions
+    return len(data) == 0 or not isinstance(data[0], dict)
+
+def is_empty_wiktionary_payload(data):
+    pages = data.get("query", {}).get("pages", {})
+    return not any(page.get("extract") for page in pages.values())
+
+# Settings capping the number of concurrent requests to each upstream API
+UPSTREAM_LIMIT_SETTINGS = {
+    "mw": "MW_MAX_PARALLEL",
+    "wiktionary": "WIKTIONARY_MAX_PARALLEL",
+}
+
+# Settings capping the request rate to each upstream API
+UPSTREAM_RATE_SETTINGS = {
+    "mw": "MW_MAX_RATE",
+    "wiktionary": "WIKTIONARY_MAX_RATE",
+}
+
+def upstream_rate_limit(source):
+    upstream = source.split("_")[0]
+    buckets = current_app.extensions.setdefault("upstream_rate_limits", {})
+    if upstream not in buckets:
+        buckets.setdefault(upstream, TokenBucket(current_app.config[UPSTREAM_RATE_SETTINGS[upstream]]))
+    return buckets[upstream]
+
+def upstream_slot(source):
+    # "mw_learners" and "mw_collegiate" share the "mw" limit, and so on
+    upstream = source.split("_")[0]
+    semaphores = current_app.extensions.setdefault("upstream_semaphores", {})
+    if upstream not in semaphores:
+        limit = current_app.config[UPSTREAM_LIMIT_SETTINGS[upstream]]
+        semaphores.setdefault(upstream, threading.BoundedSemaphore(limit))
+    return semaphores[upstream]
+
+def fetch_json(source, word, url, params=None, is_negative=None):
+    """
+    GET a dictionary API, serving the raw payload from the definition cache when possible.
+
+    Returns the HTTP status code and the decoded JSON (None on failure).
+    """
+    cache = get_definition_cache()
+    hit, data = cache.get("raw", source, word)
+    if hit:
+        return 200, data
+
+    # Includes the wait for the upstream's rate and concurrency limits
+    with span("dictionary", source=source):
+        upstream_rate_limit(source).acquire()
+        with upstream_slot(source):
+            response = http_get(url, params=params)
+    if response.status_code != 200:
+        return response.status_code, None
+    data = response.json()
+    negative = is_negative(data) if is_negative else False
+    cache.set("raw", source, word, data, negative=negative)
+    return 200, data
+
+class DictionaryUnavailable(Exception):
+    """
+    Raised by a lookup whose dictionary API could not be reached, with the message to send back.
+    """
+
+def cache_definition(source):
+    """
+    Decorator serving repeated lookups of the same (word, category, advanced) from the definition cache.
+
+    The quote is not part of the cache key: the lookup runs without it and the
+    quote of the current message is put back into the result. A dictionary
+    that could not be reached is answered with an error, not cached. Words defined
+    are recorded as headwords, and a word known to be one is only briefly
+    cached as a miss, which is then more likely a passing upstream problem.
+    """
+    def decorator(lookup):
+        @wraps(lookup)
+        def wrapper(full_word, advanced=False):
+            word, cat, quote = extract_word_and_category_and_quote(full_word)
+            quote = quote if len(quote) > 1 else None
+            cache = get_definition_cache()
+            hit, result = cache.get("parsed", source, word, cat, advanced)
+            if not hit:
+                bare_word = f"{word} ({cat})" if cat else word
+                try:
+                    if source == "en":
+                        result = list(lookup(bare_word, advanced=advanced))
+                    else:
+                        result = list(lookup(bare_word))
+                except DictionaryUnavailable as e:
+                    return word, cat or None, None, quote, str(e)
+                headwords = get_headword_index(SOURCE_LANGUAGES[source])
+                negative = result[4] is not None
+                if result[2] and not negative and headwords is not None:
+                    headwords.learn([word])
+                # Neither a definition nor an error means the upstream call failed: don't cache that
+                if result[2] is not None or negative:
+                    known = negative and headwords is not None and headwords.knows(word)
+                    ttl = current_app.config["HEADWORDS_KNOWN_NEGATIVE_TTL"] if known else None
+                    cache.set("parsed", source, word, result, cat, advanced, negative=negative, ttl=ttl)
+            # The cached result is shared with other threads: never write into it
+            return (*result[:3], quote, result[4])
+        return wrapper
+    return decorator
+
+# API key setting of each Merriam-Webster dictionary
+MW_DICTIONARIES = {
+    "mw_learners": ("learners", "DICT_LEARNER_KEY"),
+    "mw_collegiate": ("collegiate", "DICT_DICT_KEY"),
+}
+
+def fetch_mw(source, word):
+    reference, key_setting = MW_DICTIONARIES[source]
+    url = f"{current_app.config['MW_API_URL']}/references/{reference}/json/{word}?key={os.getenv(key_setting)}"
+    return fetch_json(source, word, url, is_negative=is_empty_mw_payload)
+
+def mw_executor():
+    executor = current_app.extensions.get("mw_executor")
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=current_app.config["MW_MAX_PARALLEL"], thread_name_prefix="mw")
+        executor = current_app.extensions.setdefault("mw_executor", executor)
+    return executor
+
+def resolve_mw_entry(word, cat=None, advanced=False):
+    """
+    Find the Merriam-Webster entry for `word`, as a `cat` if given.
+
+    The dictionaries are tried in the order planned by the router, all at once
+    when a fallback is likely. The first one with a matching entry wins, and
+    requests to the others are cancelled or their answers ignored.
+
+    Returns the winning dictionary, its entry and the (status, data) responses
+    received, (None, None) for a request that failed.
+    """
+    router = get_mw_router()
+    order, parallel = router.plan(word, cat, advanced)
+    futures = {}
+    if parallel:
+        app = current_app._get_current_object()
+
+        def fetch_in_context(source):
+            with app.app_context():
+                return fetch_mw(source, word)
+
+        futures = {source: mw_executor().submit(fetch_in_context, source) for source in order}
+
+    responses = {}
+    winner, entry = None, None
+    for source in order:
+        try:
+            responses[source] = futures[source].result() if futures else fetch_mw(source, word)
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"{source} lookup of {word} failed: {type(e).__name__}: {e}")
+            responses[source] = None, None
+        status_code, data = responses[source]
+        entry = pick_mw_entry(data, cat) if status_code == 200 else None
+        if entry is not None:
+            winner = source
+            break
+
+    requested = list(responses)
+    for source, future in futures.items():
+        if source not in responses and not future.cancel():
+            requested.append(source)
+    router.record(word, cat, order, winner, requested, advanced)
+    return winner, entry, responses
+
+def format_definitions(definitions):
+    if len(definitions)>1:
+        return "\n".join(f"•\u00A0 {definition}" for definition in definitions)
+    return definitions[0]
+
+@cache_definition("en")
 def lookup_en_def(full_word,advanced=False):
     
     word_definition=None
     cat = None
     quote = None
     error_message = None
-    load_dotenv()
-    api_key = os.getenv("DICT_LEARNER_KEY")
     word_and_cat_and_quote = extract_word_and_category_and_quote(full_word)
     word = word_and_cat_and_quote[0]
     if len(word_and_cat_and_quote[1])>1:
@@ -205,93 +356,89 @@ def lookup_en_def(full_word,advanced=False):
     if len(word_and_cat_and_quote[2])>1:
         quote = word_and_cat_and_quote[2]
 
-    url = f"https://www.dictionaryapi.com/api/v3/references/learners/json/{word}?key={api_key}"
-    response = requests.get(url)
+    winner, entry, responses = resolve_mw_entry(word, cat, advanced)
+    if entry is not None:
+        cat = entry["fl"]
+        word_definition = format_definitions(entry["shortdef"])
+    elif all(status_code != 200 for status_code, _ in responses.values()):
+        logging.error(f"Failed to retrieve Merriam-Webster data for {word}: {[status_code for status_code, _ in responses.values()]}")
+        raise DictionaryUnavailable("Could not reach Merriam-Webster, please try again later.")
+    elif cat is not None and any(pick_mw_entry(data) for status_code, data in responses.values() if status_code == 200):
+        word_definition = ''
+        error_message = f"{word} is not a {cat}."
+    else:
+        # Unknown words come back with Merriam-Webster's spelling suggestions
+        suggestions = [
+            suggestion for status_code, data in responses.values() if status_code == 200
+            for suggestion in data or [] if isinstance(suggestion, str)
+        ]
+        headwords = get_headword_index("en")
+        if headwords is not None:
+            headwords.learn(suggestions, looked_up=False)
+        word_definition = ''
+        error_message = f"{word} not found in any dictionary.{did_you_mean('en', word, suggestions)}"
 
-    if response.status_code == 200:
-        data = response.json()
-        
-        # If word not found
-
-        if (len(data)>0 and "fl" not in data[0]) or advanced:
-            # Use other Dictionary api
-            second_api_key = os.getenv("DICT_DICT_KEY")
-            
-            url = f"https://www.dictionaryapi.com/api/v3/references/collegiate/json/{word}?key={second_api_key}"
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                if len(data)>0 and "fl" not in data[0]:
-                    error_message = f"{word} not found in any dictionary."
-                    return word, cat, word_definition, quote, error_message
-                
-        if cat is not None:
-            i = 0
-            found_cat = False
-            while i<len(data):
-                if "fl" in data[i] and data[i]["fl"]==cat:
-                    found_cat = True
-                    break
-                i += 1
-            if found_cat==True:
-                if len(data[i]["shortdef"])>1:
-                    word_definition = ''
-                    for definition in data[i]["shortdef"]:
-                        if len(word_definition)>0:
-                            word_definition += f"\n"    
-                        word_definition += f"•\u00A0 {definition}"
-                else:
-                    word_definition = data[i]["shortdef"][0]
-            else:
-                word_definition = ''
-                error_message = f"{word} is not a {cat}."
-        else:
-            if len(data) > 0 and "shortdef" and "fl"in data[0]:
-                cat = data[0]["fl"]
-                if len(data[0]["shortdef"])>1:
-                    word_definition = ''
-                    for definition in data[0]["shortdef"]:
-                        if len(word_definition)>0:
-                            word_definition += f"\n"    
-                        word_definition += f"•\u00A0 {definition}"
-                else:
-                    try:
-                        word_definition = data[0]["shortdef"][0]
-                    except IndexError:
-                        try:
-                            second_api_key = os.getenv("DICT_DICT_KEY")
-                            url = f"https://www.dictionaryapi.com/api/v3/references/collegiate/json/{word}?key={second_api_key}"
-                            response = requests.get(url)
-                            if response.status_code == 200:
-                                data = response.json()
-                                if "fl" in data[0] and "shortdef" in data[0]:
-                                    cat = data[0]["fl"]
-                                    if len(data[0]["shortdef"])>1:
-                                        word_definition = ''
-                                        for definition in data[0]["shortdef"]:
-                                            if len(word_definition)>0:
-                                                word_definition += f"\n"    
-                                            word_definition += f"•\u00A0 {definition}"
-                                    elif len(data[0]["shortdef"]) == 1 :
-                                        word_definition = data[0]["shortdef"][0]
-                                else:
-                                    error_message = f"No definition found for the word '{word}'"
-                            else:
-                                error_message = f"Failed to use the API for the word '{word}'"
-
-                        except:
-                            error_message = f"No definition found for the word '{word}'"
+    return word, cat, word_definition, quote, error_message
 
-            else:
-                word_definition = ''
-                error_message = f"No definition found for the word '{word}'"
+def keep_en_wiktionary_definition(word, definition):
+    # Lines with a horizontal bar are usage examples
+    return "―" not in definition
 
-    else:
-        print(f"Failed to retrieve data: {response.status_code}")
+def keep_fr_wiktionary_definition(word, definition):
+    # Lines with an em dash are examples (except notes), and so are lines quoting the word itself
+    return (
+        ("—" not in definition or "— Note" in definition)
+        and not any(variant in definition.lower() for variant in {word, word + "e", word + "s", word + "es"})
+    )
 
-    return word, cat, word_definition, quote, error_message
+# How to look up the French section of each Wiktionary
+WIKTIONARY_LOOKUPS = {
+    "wiktionary_en": {
+        "url_setting": "WIKTIONARY_EN_API_URL",
+        "language": "french",
+        "keep_definition": keep_en_wiktionary_definition,
+        "wrong_category_message": "No definition found for the word {word} in the {cat} category. Are you sure it is a {cat}?",
+    },
+    "wiktionary_fr": {
+        "url_setting": "WIKTIONARY_FR_API_URL",
+        "language": "français",
+        "keep_definition": keep_fr_wiktionary_definition,
+        "wrong_category_message": "No definition found for the word {word} in the {cat} category. Are you sure *{word} is a {cat}?*\n\nIf you need the list of gramatical categories, send a message using the following template: 'vocab categories language'.\n\nFor example, in French: 'vocab categories fr'",
+    },
+}
+
+def definition_from_extract(source, title, extract, word, cat):
+    """
+    Pick the definition of `word` as a `cat` out of a Wiktionary extract. Returns (definition, error message).
+    """
+    parts_of_speech = parse_extract(title, extract, WIKTIONARY_LOOKUPS[source]["language"])
+    return definition_from_parts(source, parts_of_speech, word, cat)
 
-def lookup_fr_to_en_def(full_word):
+def definition_from_parts(source, parts_of_speech, word, cat):
+    """
+    Pick the definition of `word` as a `cat` out of its parsed French entry. Returns (definition, error message).
+    """
+    settings = WIKTIONARY_LOOKUPS[source]
+    if parts_of_speech is None:
+        return None, f"No definition found for the word {word}"
+    if cat not in parts_of_speech:
+        return None, settings["wrong_category_message"].format(word=word, cat=cat)
+    lines = parts_of_speech[cat]
+    if lines is None:
+        return None, f"No definition found for the word {word}. Error of matches."
+
+    keep_definition = settings["keep_definition"]
+    definitions_final = [line for line in lines if keep_definition(word, line)]
+    if len(definitions_final)>1:
+        return "\n".join(f"•\u00A0 {definition}" for definition in definitions_final), None
+    elif len(definitions_final)==1:
+        return definitions_final[0], None
+    return None, f"Word found, but definition not retrieved"
+
+def lookup_wiktionary_def(full_word, source):
+    """
+    Shared lookup for the French sections of the English and French Wiktionaries.
+    """
     error_message = None
     word_definition = None
     word, cat, quote = extract_word_and_category_and_quote(full_word)
@@ -299,7 +446,15 @@ def lookup_fr_to_en_def(full_word):
         error_message=f"Please specify in parantheses the category of the word: verb, noun, adjective, adverb, expression.\nExample: berger (noun)"
         return full_word, None, None, quote, error_message
 
-    url = f"https://en.wiktionary.org/w/api.php"
+    # The offline index answers for the words and categories of its dump, the live API for the rest
+    index = get_wiktionary_index(source)
+    if index is not None:
+        with span("wiktionary_index", source=source):
+            parts_of_speech = index.get(word)
+        if parts_of_speech is not None and cat in parts_of_speech:
+            word_definition, error_message = definition_from_parts(source, parts_of_speech, word, cat)
+            return word, cat, word_definition, quote, error_message
+
     params = {
         "action": "query",
         "format": "json",
@@ -308,180 +463,114 @@ def lookup_fr_to_en_def(full_word):
         "explaintext": True,
     }
 
-    response = requests.get(url, params=params)
-    data = response.json()
+    url = current_app.config[WIKTIONARY_LOOKUPS[source]["url_setting"]]
+    try:
+        status_code, data = fetch_json(source, word, url, params=params, is_negative=is_empty_wiktionary_payload)
+    except (requests.RequestException, ValueError) as e:
+        # Network errors, an open circuit breaker, or a body that isn't JSON
+        logging.error(f"Failed to retrieve {source} data for {word}: {type(e).__name__}: {e}")
+        raise DictionaryUnavailable("Could not reach Wiktionary, please try again later.")
+    if status_code != 200 or data is None or "pages" not in data.get("query", {}):
+        logging.error(f"Failed to retrieve {source} data for {word}: {status_code}")
+        raise DictionaryUnavailable("Could not reach Wiktionary, please try again later.")
     pages = data["query"]["pages"]
     for page in pages.values():
         extract = page.get("extract", None)
         if extract:
-            language_sections = re.split(r"(?m)^==\s+(.*?)\s+==\s*$", extract)
-            for i in range(1, len(language_sections), 2):
-                language = language_sections[i].strip().lower()  # Language name
-                content = language_sections[i + 1].strip()  # Content for that language section
-                if language == 'french':
-                    sub_sections = re.split(r"(?m)^===\s+(.*?)\s+===\s*$", content)
-                    for j in range(1, len(sub_sections), 2):
-                        sub_section = re.sub(r'\d+', '',sub_sections[j]).strip().lower()
-                        sub_section_content = sub_sections[j + 1].strip()
-                        if sub_section == cat:
-                            matches = re.findall(r'\n\n(.*?)\n\n\n', sub_section_content, re.DOTALL)
-                            if len(matches)==0:
-                                matches = re.findall(r'\n\n(.*?)\n', sub_section_content, re.DOTALL)                            
-                                if len(matches)==0:
-                                    matches = re.findall(r'\n\n(.*)', sub_section_content, re.DOTALL)
-                                    if len(matches)==0:
-                                        error_message= f"No definition found for the word {word}. Error of matches."
-                                        return word, cat, word_definition, quote, error_message
-
-                            definitions_int = matches[0].strip()
-                            definitions = definitions_int.split("\n")
-                            definitions_final = []
-                            for definition in definitions:
-                                if len(definition.split()) > 0 and definition.split()[0] not in ["Synonyms:", "Synonym:", "Antonym:", "Antonyms:"] and "―" not in definition:
-                                    definitions_final.append(definition)
-                            if len(definitions_final)>1:
-                                word_definition = ''
-                                for definition in definitions_final:
-                                    if len (word_definition)>0:
-                                        word_definition += f"\n"
-                                    word_definition += f"•\u00A0 {definition}"
-                            elif len(definitions_final)==1:
-                                word_definition = definitions_final[0]
-                            else:
-                                error_message = f"Word found, but definition not retrieved"
-                            return word, cat, word_definition, quote, error_message
-                    error_message = f"No definition found for the word {word} in the {cat} category. Are you sure it is a {cat}?"
-                    return word, cat, word_definition, quote, error_message
-            error_message= f"No definition found for the word {word}"
+            parts_of_speech = parse_extract(page.get("title", word), extract, WIKTIONARY_LOOKUPS[source]["language"])
+            word_definition, error_message = definition_from_parts(source, parts_of_speech, word, cat)
+            if parts_of_speech is None:
+                error_message += did_you_mean("fr", word)
+            return word, cat, word_definition, quote, error_message
+        if "missing" in page:
+            error_message = f"No definition found for the word {word}{did_you_mean('fr', word)}"
             return word, cat, word_definition, quote, error_message
         error_message = f"There is a bug, please contact Augustin."
         return word, cat, word_definition, quote, error_message
 
+@cache_definition("fren")
+def lookup_fr_to_en_def(full_word):
+    return lookup_wiktionary_def(full_word, "wiktionary_en")
+
+@cache_definition("fr")
 def lookup_fr_to_fr_def(full_word):
-    error_message = None
-    word_definition = None
-    word, cat, quote = extract_word_and_category_and_quote(full_word)
-    if len(cat)==0:
-        error_message=f"Please specify in parantheses the category of the word: verb, noun, adjective, adverb, expression.\nExample: berger (noun)"
-        return full_word, None, None, quote, error_message
+    return lookup_wiktionary_def(full_word, "wiktionary_fr")
 
-    url = f"https://fr.wiktionary.org/w/api.php"
-    params = {
-        "action": "query",
-        "format": "json",
-        "titles": word,
-        "prop": "extracts",
-        "explaintext": True,
-    }
+def split_definitions(definition):
+    """
+    The numbered definitions of a saved entry: its bullet lines, or the whole text when it has a single one.
+    """
+    items = [re.sub(r'^•\xa0', '', line).strip() for line in re.findall(r'•\xa0[^\n]+', definition or "")]
+    if items:
+        return items
+    return [definition.strip()] if definition and definition.strip() else []
 
-    response = requests.get(url, params=params)
-    data = response.json()
-    pages = data["query"]["pages"]
-    for page in pages.values():
-        extract = page.get("extract", None)
-        if extract:
-            language_sections = re.split(r"(?m)^==\s+(.*?)\s+==\s*$", extract)
-            for i in range(1, len(language_sections), 2):
-                language = language_sections[i].strip().lower()  # Language name
-                content = language_sections[i + 1].strip()  # Content for that language section
-                if language == 'français':
-                    sub_sections = re.split(r"(?m)^===\s+(.*?)\s+===\s*$", content)
-                    for j in range(1, len(sub_sections), 2):
-                        sub_section = re.sub(r'\d+', '',sub_sections[j]).strip().lower()
-                        sub_section_content = sub_sections[j + 1].strip()
-                        if sub_section == cat:
-                            matches = re.findall(r'\n\n(.*?)\n\n\n', sub_section_content, re.DOTALL)
-                            if len(matches)==0:
-                                matches = re.findall(r'\n\n(.*?)\n', sub_section_content, re.DOTALL)                            
-                                if len(matches)==0:
-                                    matches = re.findall(r'\n\n(.*)', sub_section_content, re.DOTALL)
-                                    if len(matches)==0:
-                                        error_message= f"No definition found for the word {word}. Error of matches."
-                                        return word, cat, word_definition, quote, error_message                            
-                            
-                            definitions_int = matches[0].strip()
-                            definitions = definitions_int.split("\n")
-                            definitions_final = []
-                            for definition in definitions:
-                                if (
-                                    len(definition.split()) > 0 
-                                    and definition.split()[0] not in {"Synonyms:", "Synonym:", "Antonym:", "Antonyms:"} 
-                                    and ("—" not in definition or "— Note" in definition)
-                                    and not any(variant in definition.lower() for variant in {word, word + "e", word + "s", word + "es"})
-                                ):
-                                    definitions_final.append(definition)
-                            if len(definitions_final)>1:
-                                word_definition = ''
-                                for definition in definitions_final:
-                                    if len (word_definition)>0:
-                                        word_definition += f"\n"
-                                    word_definition += f"•\u00A0 {definition}"
-                            elif len(definitions_final)==1:
-                                word_definition = definitions_final[0]
-                            else:
-                                error_message = f"Word found, but definition not retrieved"
-                            return word, cat, word_definition, quote, error_message
-                    error_message = f"No definition found for the word {word} in the {cat} category. Are you sure *{word} is a {cat}?*\n\nIf you need the list of gramatical categories, send a message using the following template: 'vocab categories language'.\n\nFor example, in French: 'vocab categories fr'"
-                    return word, cat, word_definition, quote, error_message
-            error_message= f"No definition found for the word {word}"
-            return word, cat, word_definition, quote, error_message
-        error_message = f"There is a bug, please contact Augustin."
-        return word, cat, word_definition, quote, error_message
+def parse_edit_command(text):
+    """
+    Split what follows keep/delete into an optional word and the definition
+    numbers, e.g. "berger 1,3" or "2, 3". Returns (word or None, numbers), or
+    (None, None) when there are no numbers at the end.
+    """
+    match = re.match(r'^(.*?)\s*(\d+(?:\s*,\s*\d+)*)$', text.strip())
+    if not match:
+        return None, None
+    word = match.group(1).strip() or None
+    return word, [int(number) for number in re.findall(r'\d+', match.group(2))]
 
+@timed("store")
 def modify_last_definition(keep=True, to_keep=None,to_del=None):
-    
-    scope = ["https://spreadsheets.google.com/feeds",'https://www.googleapis.com/auth/spreadsheets',"https://www.googleapis.com/auth/drive.file","https://www.googleapis.com/auth/drive"]
-    creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
-    creds_json = creds_json.replace('\n', '\\n')
-    creds_dict = json.loads(creds_json)
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
-    
-    sheet = client.open_by_key('1CloiuVCnGD38rPQogj1eG_yHAcQ7uxuQ4ICD_CswHhw').sheet1
-    column_values = sheet.col_values(4)
-    column_words = sheet.col_values(2)
-    word = column_words[-1]
-    last_value = column_values[-1] if column_values else None
-    matches = re.findall(r'•\xa0[^\n]+', last_value)
+    """
+    Keep (or delete) some of the numbered definitions of the last saved
+    entry, or of the latest entry for a word when the numbers follow it, e.g.
+    "keep berger 1,3". The change is one row update in the local store, which
+    the sheet sync turns into a single cell update. It is only written if the
+    entry is still the one read: the numbers were picked from that version.
+
+    Returns the word, its new definition and an error message for the user (None if it worked).
+    """
+    store = get_vocab_store()
+    tenant_id = get_tenant()["id"]
+    word, numbers = parse_edit_command(to_keep if keep else to_del)
+    if numbers is None:
+        return word, None, "Send the numbers of the definitions, e.g. 'keep 1,3' or 'delete berger 2'."
+    entry = store.find_latest_by_word(word, tenant=tenant_id) if word else store.last_entry(tenant_id)
+    if entry is None:
+        return word, None, f"Could not find {word} in database." if word else "There is no definition to edit."
+
+    word = entry["word"]
+    definitions = split_definitions(entry["definition"])
+    wrong = [number for number in numbers if not 1 <= number <= len(definitions)]
+    if wrong:
+        return word, None, (
+            f"*{word}* has {len(definitions)} definition{'s' if len(definitions) != 1 else ''}, "
+            f"there is no definition {', '.join(map(str, wrong))}."
+        )
 
     if keep:
-        final_def = ""
-        to_keep_lst = to_keep.split(",")
-        to_keep_lst = [int(k) - 1  for k in to_keep_lst]
-        for i,j in enumerate(to_keep_lst):
-            if i==0:
-                final_def += matches[j]
-            else:
-                final_def += "\n" + matches[j]
-        if len(re.findall(r'•\xa0[^\n]+', final_def))==1:
-            final_def = re.sub(r'•\xa0','',final_def).strip()
-    
+        kept = [definitions[number - 1] for number in dict.fromkeys(numbers)]
     else:
-        final_def_lst = matches
-        to_del_lst = to_del.split(",")
-        to_del_lst = sorted([int(k) - 1  for k in to_del_lst], reverse=True)
-        for i in to_del_lst:
-            del final_def_lst[i]
-        
-        final_def = ""
-        
-        for j,k in enumerate(final_def_lst):
-            if j==0:
-                final_def += k
-            else:
-                final_def += "\n" + k
-        if len(re.findall(r'•\xa0[^\n]+', final_def))==1:
-            final_def = re.sub(r'•\xa0','',final_def).strip()
+        kept = [definition for i, definition in enumerate(definitions, start=1) if i not in numbers]
+        if not kept:
+            return word, None, f"That would delete every definition of *{word}*, send 'remove {word}' instead."
 
-    num_rows = len(sheet.get_all_values())
-    sheet.update_cell(num_rows, 4, final_def)
-    
-    return word, final_def
+    final_def = format_definitions(kept)
+    if final_def != entry["definition"] and not store.update_definition(entry["id"], final_def, entry["version"]):
+        return word, None, f"*{word}* was changed at the same time, check it and try again."
+    return word, final_def, None
 
-def add_row_to_padme_vocab(language, word):
-    
-    error_status = False
-    print(language)
+# The first word of a message, naming what to do
+COMMANDS = {"vocab", "dis", "say", "keep", "delete", "remove"}
+
+# What may follow "vocab": a dictionary, or a request for the list of categories
+VOCAB_LANGUAGES = {"en", "fr", "fren", "categories", "categorie", "category"}
+
+def lookup_definition(language, word):
+    """
+    Look up a word in the dictionary for `language`, without saving it.
+
+    Returns word, cat, word_definition, quote, error_message.
+    """
+    cat, word_definition, quote, error_message = None, None, None, None
 
     if language == "en":
         if "advanced" in word:
@@ -550,146 +639,210 @@ def add_row_to_padme_vocab(language, word):
         else :
             error_message = "This language does not exist or is not supported."
     
-    if language not in {"en", "fr", "fren", "categories","categorie", "category"}:
+    if language not in VOCAB_LANGUAGES:
         error_message = "This language does not exist or is not supported."
     
 
-    if error_message is not None:
-        error_status = True
-        return error_message, error_status
-
-    elif cat is not None and word_definition is not None:
+    return word, cat, word_definition, quote, error_message
 
-        scope = ["https://spreadsheets.google.com/feeds",'https://www.googleapis.com/auth/spreadsheets',"https://www.googleapis.com/auth/drive.file","https://www.googleapis.com/auth/drive"]
-        creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
-        creds_dict = json.loads(creds_json)
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        sheet = client.open_by_key('1CloiuVCnGD38rPQogj1eG_yHAcQ7uxuQ4ICD_CswHhw').sheet1
-        num_rows = len(sheet.get_all_values())
+def add_rows_to_padme_vocab(language, words):
+    """
+    Look up several words concurrently and save all the definitions found in one batch.
 
-        new_row = [language, word, cat, word_definition, quote]
+    A word sent twice in the same message is only looked up once. Returns a
+    (word, message, error_status) tuple per distinct word, in the order sent.
+    """
+    unique_words = []
+    seen = set()
+    for word in words:
+        if word.lower() not in seen:
+            seen.add(word.lower())
+            unique_words.append(word)
+
+    with span("lookup"):
+        if len(unique_words) == 1:
+            results = [lookup_definition(language, unique_words[0])]
+        else:
+            app = current_app._get_current_object()
+
+            def lookup(word):
+                with app.app_context():
+                    return lookup_definition(language, word)
+
+            max_workers = min(len(unique_words), current_app.config["VOCAB_FANOUT_WORKERS"])
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lookup, unique_words))
+
+    store = get_vocab_store()
+    tenant_id = get_tenant()["id"]
+    replies = []
+    new_entries = []
+    for requested_word, (word, cat, word_definition, quote, error_message) in zip(unique_words, results):
+        if error_message is not None:
+            replies.append((requested_word, error_message, True))
+
+        elif cat is not None and word_definition is not None:
+            with span("store"):
+                already_saved = store.find_latest_by_word(word, language, tenant_id) is not None
+            new_entries.append((language, word, cat, word_definition, quote))
+            if word_definition[0]==f'•':
+                message = f"*{word}*:\n{word_definition}"
+            else:
+                message = f"*{word}*: {word_definition}"
+            if already_saved:
+                message += f"\n\n(*{word}* was already in your vocabulary.)"
+            replies.append((requested_word, message, False))
 
-        sheet.insert_row(new_row, num_rows + 1)
-        if word_definition[0]==f'•':
-            message = f"*{word}*:\n{word_definition}"
         else:
-            message = f"*{word}*: {word_definition}"
-        
-    else:
-        message = "Retrieval failed."
+            replies.append((requested_word, "Retrieval failed.", True))
+
+    if new_entries:
+        with span("store"):
+            store.add_entries(new_entries, tenant_id)
+
+    return replies
 
+def add_row_to_padme_vocab(language, word):
+    _, message, error_status = add_rows_to_padme_vocab(language, [word])[0]
     return message, error_status
 
 def process_whatsapp_message(body):
 
     message = body["entry"][0]["changes"][0]["value"]["messages"][0]
     full_message_body = message["text"]["body"]
-    service = full_message_body.split()[0].strip().lower()
-    language = full_message_body.split()[1].lower()
+    # A message may be a single word (or empty), which no command takes
+    parts = full_message_body.split()
+    service = parts[0].lower() if parts else ""
+    language = parts[1].lower() if len(parts) > 1 else ""
     words = [word.strip() for word in full_message_body.split(' ',2)[-1].split(',')]
-    message_content = full_message_body.split(" ",1)[1].strip().lower()
+    message_content = full_message_body.split(None, 1)[1].strip().lower() if len(parts) > 1 else ""
+    # Metric label: anything else users type would make a new time series
+    tag_trace(command=service if service in COMMANDS else "other")
+    tenant = get_tenant()
+    recipient = tenant["recipient"]
         
     if service == 'vocab':
+        # Learners with a preferred language may leave it out
+        if language not in VOCAB_LANGUAGES and tenant["language"]:
+            language = tenant["language"]
+            words = [word.strip() for word in full_message_body.split(' ',1)[-1].split(',')]
 
-        for word in words:
-            response_message, error_status = add_row_to_padme_vocab(language, word)
+        response_messages = []
+        for word, response_message, error_status in add_rows_to_padme_vocab(language, words):
             if error_status:
                 response_message += f"\n\nNo action taken."
             else:
                 response_message += f"\n\n*{word}* added to database."
-            data = get_text_message_input(current_app.config["RECIPIENT_WAID"], response_message)
+            response_messages.append(response_message)
+
+        # One reply for the whole message, split only if it is too long for WhatsApp
+        for response_message in join_messages(response_messages):
+            data = get_text_message_input(recipient, response_message)
             send_message(data)
     
     elif service == 'dis':
         try:    
-            send_audio_message(current_app.config["RECIPIENT_WAID"],
+            send_audio_message(recipient,
                                 lang="fr",
                                 word=message_content)
         except Exception as e:
             error_message = f"Tried to send you a vocal, but could not: {e}"
-            data = get_text_message_input(current_app.config["RECIPIENT_WAID"], error_message)
+            data = get_text_message_input(recipient, error_message)
             send_message(data)
 
     elif service == 'say':
         try:
-            send_audio_message(current_app.config["RECIPIENT_WAID"],
+            send_audio_message(recipient,
                             lang="en",
                             word=message_content)
         except Exception as e:
             error_message = f"Tried to send you a vocal, but could not: {e}"
-            data = get_text_message_input(current_app.config["RECIPIENT_WAID"], error_message)
+            data = get_text_message_input(recipient, error_message)
             send_message(data)
 
-    elif service == 'keep':
-        word, final_def = modify_last_definition(keep=True, to_keep=message_content)
-        match = re.search(r'•\xa0[^\n]+', final_def)
-        if match:
-            update_message = "*Definition updated* ✅" + f"\n\n*{word}*:\n" + final_def
+    elif service in ('keep', 'delete'):
+        if service == 'keep':
+            word, final_def, error_message = modify_last_definition(keep=True, to_keep=message_content)
         else:
-            update_message = "*Definition updated* ✅" + f"\n\n*{word}*: " + final_def
-        data = get_text_message_input(current_app.config["RECIPIENT_WAID"], update_message)
-        send_message(data)
-
-    elif service== 'delete':
-        word, final_def = modify_last_definition(keep=False, to_del=message_content)
-        match = re.search(r'•\xa0[^\n]+', final_def)
-        if match:
+            word, final_def, error_message = modify_last_definition(keep=False, to_del=message_content)
+        if error_message is not None:
+            update_message = error_message + "\n\nNo action taken."
+        elif final_def.startswith('•'):
             update_message = "*Definition updated* ✅" + f"\n\n*{word}*:\n" + final_def
         else:
             update_message = "*Definition updated* ✅" + f"\n\n*{word}*: " + final_def
-        data = get_text_message_input(current_app.config["RECIPIENT_WAID"], update_message)
+        data = get_text_message_input(recipient, update_message)
         send_message(data)
 
     elif service == 'remove':
         message = remove_def(message_content)
-        data = get_text_message_input(current_app.config["RECIPIENT_WAID"], message)
+        data = get_text_message_input(recipient, message)
         send_message(data)
 
     else:
         response_message = "Error - no action taken."
-        data = get_text_message_input(current_app.config["RECIPIENT_WAID"], message)
+        data = get_text_message_input(recipient, response_message)
         send_message(data)
 
+def _changes(body):
+    for entry in body.get("entry") or []:
+        if not isinstance(entry, dict):
+            continue
+        for change in entry.get("changes") or []:
+            if isinstance(change, dict) and isinstance(change.get("value"), dict):
+                yield entry, change
+
+def split_messages(body):
+    """
+    Meta may batch several entries, changes and messages into one delivery.
+    Return a (message id, payload) pair for each message, where the payload
+    is the webhook body narrowed down to that one message, with its entry id,
+    metadata and contacts, so each one is processed as if delivered alone.
+    """
+    messages = []
+    for entry, change in _changes(body):
+        value = {key: item for key, item in change["value"].items() if key not in ("messages", "statuses")}
+        for message in change["value"].get("messages") or []:
+            if not isinstance(message, dict) or not message.get("id"):
+                continue
+            payload = {
+                "object": body.get("object"),
+                "entry": [{**entry, "changes": [{**change, "value": {**value, "messages": [message]}}]}],
+            }
+            messages.append((message["id"], payload))
+    return messages
+
+def has_status_updates(body):
+    return any(change["value"].get("statuses") for _, change in _changes(body))
+
 def is_valid_whatsapp_message(body):
     """
-    Check if the incoming webhook event has a valid WhatsApp message structure.
+    Check if the incoming webhook event has a valid WhatsApp message structure, with at least one message.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
-    )
+    return bool(body.get("object") and split_messages(body))
 
+@timed("store")
 def remove_def(message_content="last def"):
 
-    scope = ["https://spreadsheets.google.com/feeds",'https://www.googleapis.com/auth/spreadsheets',"https://www.googleapis.com/auth/drive.file","https://www.googleapis.com/auth/drive"]
-    creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
-    creds_json = creds_json.replace('\n', '\\n')
-    creds_dict = json.loads(creds_json)
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
-
-    sheet = client.open_by_key('1CloiuVCnGD38rPQogj1eG_yHAcQ7uxuQ4ICD_CswHhw').sheet1
-    num_rows = len(sheet.get_all_values())
+    store = get_vocab_store()
+    tenant_id = get_tenant()["id"]
 
     body = message_content.lower().strip()
     
+    # Deleted only if unchanged since read, so two removes can't take out two entries
     if body == "last def":
-        sheet.delete_rows(num_rows)
+        entry = store.last_entry(tenant_id)
+        if entry is not None and not store.delete_entry(entry["id"], entry["version"]):
+            return f"*{entry['word']}* was changed at the same time - no action taken."
         message = "Last definition removed from database ✅"
         return message
     
     else:
-        try:
-            column_words = sheet.col_values(2)[1:][::-1]
-            row_to_delete = num_rows - column_words.index(body)
-            sheet.delete_rows(row_to_delete)
-            message = f"*{body}* removed from database ✅"
-            return message
-        except ValueError:
+        entry = store.find_latest_by_word(body, tenant=tenant_id)
+        if entry is None:
             message=f"Could not find {body} in database - no action taken."
-            return message
\ No newline at end of file
+            return message
+        if not store.delete_entry(entry["id"], entry["version"]):
+            return f"*{body}* was changed at the same time - no action taken."
+        message = f"*{body}* removed from database ✅"
+        return message
\ No newline at end of file
@@ -0,0 +1,225 @@
+import bz2
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+# File layout: header, then one offset per record (sorted by headword), then the records
+MAGIC = b"VOCABWX1"
+HEADER = struct.Struct("<8sQ")
+OFFSET = struct.Struct("<Q")
+RECORD = struct.Struct("<HI")
+
+DIGITS = re.compile(r"\d+")
+
+# Wiktextract part-of-speech codes of the English edition, as the section headings users name
+EN_POS_TITLES = {
+    "abbrev": "abbreviation",
+    "adj": "adjective",
+    "adv": "adverb",
+    "article": "article",
+    "character": "letter",
+    "conj": "conjunction",
+    "contraction": "contraction",
+    "det": "determiner",
+    "intj": "interjection",
+    "name": "proper noun",
+    "noun": "noun",
+    "num": "numeral",
+    "particle": "particle",
+    "phrase": "phrase",
+    "prefix": "prefix",
+    "prep": "preposition",
+    "prep_phrase": "prepositional phrase",
+    "pron": "pronoun",
+    "proverb": "proverb",
+    "suffix": "suffix",
+    "verb": "verb",
+}
+
+# Settings holding the index path of each Wiktionary lookup source
+INDEX_PATH_SETTINGS = {
+    "wiktionary_en": "WIKTIONARY_EN_INDEX_PATH",
+    "wiktionary_fr": "WIKTIONARY_FR_INDEX_PATH",
+}
+
+
+class WiktionaryIndex:
+    """
+    Read-only headword index built from a Wiktionary dump.
+
+    Each headword maps to the parts of speech of its French entry, with their
+    definition lines, in the shape `wiktionary_parser.parse_language` returns.
+    The file is memory-mapped and looked up by binary search over its sorted
+    offset table, so a lookup touches a few pages and the pages are shared by
+    every worker through the OS page cache. A rebuilt index is picked up when
+    the workers restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a Wiktionary index")
+        self._records_start = HEADER.size + self.count * OFFSET.size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        (offset,) = OFFSET.unpack_from(self._map, HEADER.size + i * OFFSET.size)
+        key_length, value_length = RECORD.unpack_from(self._map, offset)
+        key_start = offset + RECORD.size
+        return key_start, key_length, value_length
+
+    def get(self, word):
+        """
+        Return {part of speech: definition lines} for `word`, or None if the dump has no French entry for it.
+        """
+        key = word.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            key_start, key_length, value_length = self._record(middle)
+            candidate = self._map[key_start:key_start + key_length]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                value_start = key_start + key_length
+                with self._lock:
+                    self.hits += 1
+                return json.loads(self._map[value_start:value_start + value_length])
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {"entries": self.count, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self._map.close()
+
+
+def write_index(path, entries):
+    """
+    Write {headword: parts of speech} to `path`, replacing any previous index in one step.
+    """
+    records = sorted(
+        (word.encode("utf-8"), json.dumps(parts, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        for word, parts in entries.items()
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        offset = HEADER.size + len(records) * OFFSET.size
+        for key, value in records:
+            f.write(OFFSET.pack(offset))
+            offset += RECORD.size + len(key) + len(value)
+        for key, value in records:
+            f.write(RECORD.pack(len(key), len(value)))
+            f.write(key)
+            f.write(value)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def sense_lines(senses):
+    """
+    One line per gloss, each parent gloss before its subsenses and only once.
+    """
+    lines = []
+    for sense in senses:
+        for gloss in sense.get("raw_glosses") or sense.get("glosses") or []:
+            gloss = gloss.strip()
+            if gloss and gloss not in lines:
+                lines.append(gloss)
+    return lines
+
+
+def read_wiktextract(path, lang_code="fr"):
+    """
+    Read the entries in `lang_code` of a Wiktextract JSONL dump (one entry per
+    line, as published on kaikki.org, optionally gzip or bz2 compressed).
+
+    Returns {headword: {part of speech: definition lines}}. Parts of speech
+    are named after their section heading (lowercased, digits removed) like
+    the live lookup names them; when a headword has the same part of speech
+    under several etymologies, the first one wins, as it does live.
+    """
+    entries = {}
+    with open_dump(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("lang_code") != lang_code or not entry.get("word"):
+                continue
+            title = entry.get("pos_title") or EN_POS_TITLES.get(entry.get("pos"), entry.get("pos"))
+            if not title:
+                continue
+            pos = DIGITS.sub("", title).strip().lower()
+            parts = entries.setdefault(entry["word"], {})
+            if pos not in parts:
+                parts[pos] = sense_lines(entry.get("senses", [])) or None
+    return entries
+
+
+def get_wiktionary_index(source):
+    """
+    The index of a Wiktionary lookup source, or None if it has none configured (or it can't be opened).
+    """
+    indexes = current_app.extensions.setdefault("wiktionary_indexes", {})
+    if source not in indexes:
+        path = current_app.config[INDEX_PATH_SETTINGS[source]]
+        index = None
+        if path and os.path.exists(path):
+            try:
+                index = WiktionaryIndex(path)
+                logging.info(f"Wiktionary index for {source} opened at {path}, {len(index)} headwords")
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f"Ignoring the Wiktionary index at {path}: {e}")
+        indexes.setdefault(source, index)
+    return indexes[source]
+
+
+@click.command("build-wiktionary-index")
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--source", type=click.Choice(sorted(INDEX_PATH_SETTINGS)), required=True,
+    help="Lookup the index serves: wiktionary_en for fren, wiktionary_fr for fr (the dump's edition).",
+)
+@click.option("--output", type=click.Path(dir_okay=False), help="Index file to write (default: the source's configured path).")
+@with_appcontext
+def build_wiktionary_index_command(dump, source, output):
+    """Build the offline Wiktionary index of a lookup source from a Wiktextract JSONL DUMP."""
+    output = output or current_app.config[INDEX_PATH_SETTINGS[source]]
+    if not output:
+        raise click.UsageError(f"Pass --output or set {INDEX_PATH_SETTINGS[source]}")
+    entries = read_wiktextract(dump)
+    count = write_index(output, entries)
+    click.echo(f"Wrote {count} French headwords to {output} ({os.path.getsize(output) / 1e6:.1f} MB)")
@@ -0,0 +1,119 @@
+import re
+import threading
+from collections import OrderedDict
+
+
+# "== French ==" and "=== Noun ===" headings of an explaintext extract
+LANGUAGE_HEADING = re.compile(r"(?m)^==\s+(.*?)\s+==\s*$")
+POS_HEADING = re.compile(r"(?m)^===\s+(.*?)\s+===\s*$")
+DIGITS = re.compile(r"\d+")
+
+# Lines starting with one of these list related words, not senses
+LABEL_WORDS = frozenset({"Synonyms:", "Synonym:", "Antonym:", "Antonyms:"})
+
+MEMO_ITEMS = 512
+
+
+def split_sections(text, heading, normalize):
+    """
+    Map each heading name to the stripped text under it, in one pass over the
+    headings. When a name repeats, the first section wins.
+    """
+    sections = {}
+    matches = list(heading.finditer(text))
+    for i, match in enumerate(matches):
+        name = normalize(match.group(1))
+        if name in sections:
+            continue
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections[name] = text[match.end():end].strip()
+    return sections
+
+
+def first_paragraph(section):
+    """
+    The block of text after the headword line, or None if there is none.
+
+    The first blank line starts it. It runs up to the next double blank line,
+    or else to the end of that line.
+    """
+    start = section.find("\n\n")
+    if start == -1:
+        return None
+    start += 2
+    end = section.find("\n\n\n", start)
+    if end == -1:
+        end = section.find("\n", start)
+    return section[start:end] if end != -1 else section[start:]
+
+
+def definition_lines(paragraph):
+    """
+    The lines of a definition block, without empty lines and synonym/antonym lists.
+    """
+    lines = []
+    for line in paragraph.strip().split("\n"):
+        tokens = line.split(None, 1)
+        if tokens and tokens[0] not in LABEL_WORDS:
+            lines.append(line)
+    return lines
+
+
+def parse_language(extract, language):
+    """
+    Parse the part of an extract written in `language` (e.g. "french").
+
+    Returns None when the extract has no such language section, otherwise a
+    dict mapping each part of speech (lowercased, digits removed) to its
+    definition lines, or to None when no definition block could be found.
+    """
+    languages = split_sections(extract, LANGUAGE_HEADING, lambda name: name.strip().lower())
+    content = languages.get(language)
+    if content is None:
+        return None
+    sections = split_sections(content, POS_HEADING, lambda name: DIGITS.sub("", name).strip().lower())
+    parts_of_speech = {}
+    for pos, section in sections.items():
+        paragraph = first_paragraph(section)
+        parts_of_speech[pos] = definition_lines(paragraph) if paragraph is not None else None
+    return parts_of_speech
+
+
+class ExtractParser:
+    """
+    Memoizes `parse_language` per (title, language).
+
+    The extract is kept next to the result, so a refreshed extract for the
+    same title is parsed again rather than served stale.
+    """
+
+    def __init__(self, max_items=MEMO_ITEMS):
+        self.max_items = max_items
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, title, extract, language):
+        key = (title, language)
+        with self._lock:
+            entry = self._memo.get(key)
+            if entry is not None and entry[0] == extract:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        result = parse_language(extract, language)
+        with self._lock:
+            self._memo[key] = (extract, result)
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_items:
+                self._memo.popitem(last=False)
+        return result
+
+
+_parser = ExtractParser()
+
+
+def parse_extract(title, extract, language):
+    return _parser.parse(title, extract, language)
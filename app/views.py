@@ -1,73 +1,94 @@
 import logging
 import json
 
-from flask import Blueprint, request, jsonify, current_app
+import hmac
+
+from flask import Blueprint, Response, request, jsonify, current_app
 
 from .decorators.security import signature_required
-from .utils.whatsapp_utils import (
-    process_whatsapp_message,
-    is_valid_whatsapp_message,
-    is_duplicate_message,
-    store_message_id,
-)
-from google.cloud import datastore
+from .decorators.status_updates import acknowledge_status_updates
+from .utils.dedup import get_deduplicator
+from .utils.job_queue import get_job_queue
+from .utils.metrics import get_metrics
+from .utils.profiler import PROFILE_FLAG, should_profile
+from .utils.whatsapp_utils import has_status_updates, split_messages
 
 webhook_blueprint = Blueprint("webhook", __name__)
-client = datastore.Client()
 
-def handle_message(client):
+def accept_webhook(body, profile=False):
     """
     Handle incoming webhook events from the WhatsApp API.
 
     This function processes incoming WhatsApp messages and other events,
     such as delivery statuses. If the event is a valid message, it gets
-    processed. If the incoming payload is not a recognized WhatsApp event,
+    queued for the background workers and acknowledged straight away, so
+    that Meta does not time out and retry. If the incoming payload is not a recognized WhatsApp event,
     an error is returned.
 
     Every message send will trigger 4 HTTP requests to your webhook: message, sent, delivered, read.
 
+    Meta may batch several messages into one delivery: their IDs are claimed
+    in one call to the deduplicator and the new ones are queued in one write,
+    each as its own job.
+
+    It only deals with the parsed body, so both the Flask blueprint and the
+    aiohttp app in `app.aio` use it. With `profile`, the messages are processed
+    under the sampling profiler (when PROFILE_ENABLED is on).
+
     Returns:
-        response: A tuple containing a JSON response and an HTTP status code.
+        response: A tuple containing a JSON-serializable dict and an HTTP status code.
     """
-    body = request.get_json()
-
-    # Check if it's a WhatsApp status update
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("statuses")
-    ):
-        logging.info("Received a WhatsApp status update.")
-        return jsonify({"status": "ok"}), 200
-    message_id = body['entry'][0]['changes'][0]['value']['messages'][0]['id']
-    logging.info(f"message_id: {message_id}")
-
-    if is_duplicate_message(client, message_id):
-        logging.info(f"Duplicate message received: {message_id}")
-        return jsonify({"status": "duplicate"}), 200
+    messages = split_messages(body) if body.get("object") else []
+    if not messages:
+        # Check if it's a WhatsApp status update
+        if has_status_updates(body):
+            logging.info("Received a WhatsApp status update.")
+            return {"status": "ok"}, 200
+        # if the request is not a WhatsApp API event, return an error
+        return {"status": "error", "message": "Not a WhatsApp API event"}, 200
+    logging.info(f"message_ids: {', '.join(message_id for message_id, _ in messages)}")
+
+    # Claiming the IDs is atomic, so concurrent retries from Meta can't both get through
+    deduplicator = get_deduplicator()
+    claimed = set(deduplicator.claim_many([message_id for message_id, _ in messages]))
+    payloads = []
+    for message_id, payload in messages:
+        if message_id not in claimed:
+            logging.info(f"Duplicate message received: {message_id}")
+            continue
+        # The same message twice in one delivery is queued once
+        claimed.discard(message_id)
+        if should_profile(profile):
+            payload[PROFILE_FLAG] = True
+        payloads.append((message_id, payload))
+    if not payloads:
+        return {"status": "duplicate"}, 200
+
     try:
-        if is_valid_whatsapp_message(body):
-            process_whatsapp_message(body)
-            store_message_id(client, message_id)
-            return jsonify({"status": "ok"}), 200
-        else:
-            # if the request is not a WhatsApp API event, return an error
-            return (
-                jsonify({"status": "error", "message": "Not a WhatsApp API event"}),
-                200,
-            )
+        get_job_queue().enqueue_many([payload for _, payload in payloads])
+    except Exception:
+        # Let Meta's retry through since we never queued these
+        for message_id, _ in payloads:
+            deduplicator.release(message_id)
+        raise
+    return {"status": "ok"}, 200
+
+
+def handle_message():
+    try:
+        body = json.loads(request.get_data())
     except json.JSONDecodeError:
         logging.error("Failed to decode JSON")
         return jsonify({"status": "error", "message": "Invalid JSON provided"}), 200
+    response, status = accept_webhook(body, profile=request.headers.get("X-Profile") == "1")
+    return jsonify(response), status
 
 
-# Required webhook verifictaion for WhatsApp
-def verify():
-    # Parse params from the webhook verification request
-    mode = request.args.get("hub.mode")
-    token = request.args.get("hub.verify_token")
-    challenge = request.args.get("hub.challenge")
+def check_verification(mode, token, challenge):
+    """
+    Answer Meta's webhook verification request. Returns a body (the challenge
+    string or a JSON-serializable dict) and an HTTP status code.
+    """
     # Check if a token and mode were sent
     if mode and token:
         # Check the mode and token sent are correct
@@ -78,11 +99,42 @@ def verify():
         else:
             # Responds with '403 Forbidden' if verify tokens do not match
             logging.info("VERIFICATION_FAILED")
-            return jsonify({"status": "error", "message": "Verification failed"}), 403
+            return {"status": "error", "message": "Verification failed"}, 403
     else:
         # Responds with '400 Bad Request' if verify tokens do not match
         logging.info("MISSING_PARAMETER")
-        return jsonify({"status": "error", "message": "Missing parameters"}), 400
+        return {"status": "error", "message": "Missing parameters"}, 400
+
+
+# Required webhook verifictaion for WhatsApp
+def verify():
+    # Parse params from the webhook verification request
+    mode = request.args.get("hub.mode")
+    token = request.args.get("hub.verify_token")
+    challenge = request.args.get("hub.challenge")
+    response, status = check_verification(mode, token, challenge)
+    if isinstance(response, dict):
+        return jsonify(response), status
+    return response, status
+
+
+def render_metrics(authorization):
+    """
+    Return the Prometheus text exposition of this worker's metrics, and an HTTP status code.
+    """
+    config = current_app.config
+    if not config["METRICS_ENABLED"]:
+        return "Metrics are disabled\n", 404
+    token = config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(authorization or "", f"Bearer {token}"):
+        return "Unauthorized\n", 401
+    return get_metrics().render(), 200
+
+
+@webhook_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    body, status = render_metrics(request.headers.get("Authorization"))
+    return Response(body, status=status, mimetype="text/plain; version=0.0.4")
 
 
 @webhook_blueprint.route("/webhook", methods=["GET"])
@@ -90,8 +142,9 @@ def webhook_get():
     return verify()
 
 @webhook_blueprint.route("/webhook", methods=["POST"])
+@acknowledge_status_updates
 @signature_required
 def webhook_post():
-    return handle_message(client)
+    return handle_message()
 
 
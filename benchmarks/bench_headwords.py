@@ -0,0 +1,89 @@
+"""
+Check and time the headword index behind "did you mean" suggestions.
+
+A vocabulary of --words synthetic headwords (French-looking, with accents)
+is loaded into a BK-tree, then misspellings of them (a dropped accent, a
+dropped, doubled or swapped letter) are looked up. Every lookup must return
+the same candidates as a scan of the whole vocabulary, and so the misspelled
+word whenever the misspelling is within the distance searched; any
+difference is printed and makes the script exit with status 1.
+
+Usage:
+    python benchmarks/bench_headwords.py [--words 20000] [--queries 500]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.utils.headwords import BKTree, distance_to, edit_distance, fold  # noqa: E402
+
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+ACCENTED = {"e": "éèê", "a": "àâ", "c": "ç", "i": "î", "o": "ô", "u": "ù"}
+
+
+def headword(rng):
+    word = "".join(rng.choice(LETTERS) for _ in range(rng.randint(4, 11)))
+    return "".join(rng.choice(ACCENTED[c]) if c in ACCENTED and rng.random() < 0.15 else c for c in word)
+
+
+def misspell(word, rng):
+    kind = rng.choice(["accent", "drop", "double", "swap"])
+    i = rng.randrange(len(word) - 1)
+    if kind == "accent":
+        return fold(word)
+    if kind == "drop":
+        return word[:i] + word[i + 1:]
+    if kind == "double":
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=20000, help="headwords in the index")
+    parser.add_argument("--queries", type=int, default=500, help="misspellings to look up")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    words = list(dict.fromkeys(headword(rng) for _ in range(args.words)))
+    keys = list(dict.fromkeys(fold(word) for word in words))
+    start = time.perf_counter()
+    tree = BKTree()
+    for key in keys:
+        tree.add(key)
+    print(f"Loaded {tree.size} folded headwords in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    failures = []
+    timings = {(name, distance): [] for name in ("BK-tree", "full scan") for distance in (1, 2)}
+    for word in rng.sample(words, min(args.queries, len(words))):
+        query = fold(misspell(word, rng))
+        distance = distance_to(query)
+        for max_distance in (1, 2):
+            start = time.perf_counter()
+            found = sorted(tree.search(query, max_distance))
+            timings["BK-tree", max_distance].append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            expected = sorted((d, key) for key in keys if (d := distance(key)) <= max_distance)
+            timings["full scan", max_distance].append((time.perf_counter() - start) * 1000)
+            within_reach = edit_distance(query, fold(word)) <= max_distance
+            if found != expected or within_reach and fold(word) not in {key for _, key in found}:
+                failures.append((word, query, max_distance))
+
+    for (name, max_distance), samples in timings.items():
+        samples.sort()
+        print(f"  {name:<10} within {max_distance}  median {statistics.median(samples):7.2f}ms  "
+              f"p99 {samples[int(len(samples) * 0.99)]:7.2f}ms")
+    if failures:
+        print(f"{len(failures)} lookups differ from the scan, e.g. {failures[:5]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
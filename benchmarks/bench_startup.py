@@ -0,0 +1,132 @@
+"""
+Time a cold start of the webhook process, the way a scale-to-zero host sees it.
+
+Each run is a fresh interpreter. It reports:
+  - the import of the `app` package, broken down by top-level package and by
+    the slowest modules (from python -X importtime);
+  - create_app(), the first status webhook and the first verification
+    request, answered through the Flask test client;
+  - a foreground warm-up, i.e. what the background warm-up thread does while
+    the worker is already serving.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in the child interpreter, prints one JSON line of timings in milliseconds
+CHILD = r"""
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+from app import create_app
+from app.utils.lifecycle import warm_up
+flask_app = create_app()
+created = time.perf_counter()
+client = flask_app.test_client()
+status = b'{"object":"whatsapp_business_account","entry":[{"changes":[{"value":{"statuses":[{"status":"read"}]}}]}]}'
+client.post("/webhook", data=status, headers={"Content-Type": "application/json"})
+first_status = time.perf_counter()
+client.get("/webhook", query_string={"hub.mode": "subscribe", "hub.verify_token": "bench", "hub.challenge": "1"})
+first_verify = time.perf_counter()
+warm_up(flask_app, background=False)
+warmed = time.perf_counter()
+print(json.dumps({
+    "import app": (imported - start) * 1000,
+    "create_app": (created - imported) * 1000,
+    "first status webhook": (first_status - created) * 1000,
+    "first verification": (first_verify - first_status) * 1000,
+    "warm-up": (warmed - first_verify) * 1000,
+}))
+import os
+os._exit(0)
+"""
+
+
+def child_env(data_dir):
+    env = dict(os.environ)
+    env.update({
+        "VERIFY_TOKEN": "bench",
+        "APP_SECRET": "bench",
+        "DEDUP_BACKEND": env.get("DEDUP_BACKEND", "sqlite"),
+        "DEDUP_SQLITE_PATH": os.path.join(data_dir, "message_ids.sqlite3"),
+        "JOB_QUEUE_PATH": os.path.join(data_dir, "jobs.sqlite3"),
+        "OUTBOX_PATH": os.path.join(data_dir, "outbox.sqlite3"),
+        "TENANTS_PATH": os.path.join(data_dir, "tenants.sqlite3"),
+        "VOCAB_STORE_PATH": os.path.join(data_dir, "vocab.sqlite3"),
+        "DEF_CACHE_PATH": os.path.join(data_dir, "definitions.sqlite3"),
+        "AUDIO_CACHE_DIR": os.path.join(data_dir, "audio"),
+        "VOCAB_SYNC_ENABLED": "false",
+        # No network: the warm-up times the imports and local state only
+        "GOOGLE_SHEETS_CREDENTIALS": "",
+    })
+    return env
+
+
+def parse_importtime(stderr):
+    """
+    Return {module: (self_us, cumulative_us)} from python -X importtime output.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to time")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    timings = defaultdict(list)
+    package_self = defaultdict(list)
+    module_cumulative = defaultdict(list)
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="bench-startup-") as data_dir:
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", CHILD],
+                cwd=ROOT, env=child_env(data_dir), capture_output=True, text=True,
+            )
+        if result.returncode != 0:
+            sys.exit(f"Child process failed:\n{result.stderr[-2000:]}")
+        for stage, ms in json.loads(result.stdout.strip().splitlines()[-1]).items():
+            timings[stage].append(ms)
+        per_package = defaultdict(int)
+        for module, (self_us, cumulative_us) in parse_importtime(result.stderr).items():
+            per_package[module.split(".")[0]] += self_us
+            module_cumulative[module].append(cumulative_us)
+        for package, self_us in per_package.items():
+            package_self[package].append(self_us)
+
+    print(f"Cold start, median of {args.runs} runs (ms)")
+    for stage, values in timings.items():
+        print(f"  {stage:<24} {statistics.median(values):8.1f}")
+
+    print("\nImport time by top-level package, own time of its modules (ms)")
+    packages = sorted(package_self.items(), key=lambda item: -statistics.median(item[1]))
+    for package, values in packages[:args.top]:
+        print(f"  {package:<24} {statistics.median(values) / 1000:8.1f}")
+
+    print("\nSlowest modules including what they import (ms)")
+    modules = sorted(module_cumulative.items(), key=lambda item: -statistics.median(item[1]))
+    for module, values in modules[:args.top]:
+        print(f"  {module:<40} {statistics.median(values) / 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
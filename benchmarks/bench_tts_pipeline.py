@@ -0,0 +1,76 @@
+"""
+Compare the streaming ffmpeg pipeline with the previous pydub one on phrases
+of typical say/dis length.
+
+The MP3 for each phrase is fetched from gTTS once, then replayed in
+gTTS-sized chunks so that both pipelines are timed on identical input
+without network noise. Pass --live to also time end-to-end synthesis.
+
+Usage:
+    python benchmarks/bench_tts_pipeline.py [--runs 5] [--live]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from gtts import gTTS  # noqa: E402
+
+from app.utils.tts_pipeline import synthesize_opus, transcode_to_opus, transcode_with_pydub  # noqa: E402
+
+
+PHRASES = [
+    ("fr", "bonjour"),
+    ("fr", "je voudrais un croissant, s'il vous plaît"),
+    ("en", "serendipity"),
+    ("en", "the quick brown fox jumps over the lazy dog"),
+    ("fr", "il était une fois, dans un pays lointain, une princesse qui rêvait de voyager"),
+]
+
+
+def chunked(data, size=4096):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def summarize(name, samples):
+    stages = sorted({stage for sample in samples for stage in sample})
+    parts = []
+    for stage in stages:
+        values = [sample[stage] * 1000 for sample in samples if stage in sample]
+        parts.append(f"{stage} p50={statistics.median(values):.1f}ms")
+    print(f"  {name:<8} " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="also time gTTS synthesis end to end")
+    args = parser.parse_args()
+
+    for lang, text in PHRASES:
+        mp3_buffer = BytesIO()
+        gTTS(text=text, lang=lang).write_to_fp(mp3_buffer)
+        mp3 = mp3_buffer.getvalue()
+        print(f"[{lang}] {text!r} ({len(mp3)} bytes of MP3)")
+
+        stream_samples, pydub_samples = [], []
+        for _ in range(args.runs):
+            stream_samples.append(transcode_to_opus(chunked(mp3))[1])
+            pydub_samples.append(transcode_with_pydub(mp3)[1])
+        summarize("stream", stream_samples)
+        summarize("pydub", pydub_samples)
+
+        if args.live:
+            for pipeline in ("stream", "pydub"):
+                start = time.perf_counter()
+                synthesize_opus(lang, text, pipeline=pipeline)
+                print(f"  live {pipeline:<6} total={(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Build an offline Wiktionary index from a synthetic Wiktextract dump, check
+every headword reads back as it was written, and time lookups.
+
+The dump has --words French headwords, each with one to three parts of
+speech of a few senses, plus as many entries in other languages, which the
+build skips. Lookups of present and absent headwords are timed, and the
+memory a worker gains from opening the index and reading every
+record once is reported next to the index size on disk.
+
+Usage:
+    python benchmarks/bench_wiktionary_index.py [--words 200000] [--lookups 100000]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.utils.wiktionary_index import WiktionaryIndex, read_wiktextract, write_index  # noqa: E402
+
+
+POS = ["noun", "verb", "adj", "adv", "phrase"]
+LETTERS = "abcdefghijklmnopqrstuvwxyzéèàç"
+
+
+def memory_mb():
+    """
+    (anonymous, resident) memory of this process in MB. Anonymous memory is the
+    worker's own, the rest of what is resident are file pages shared with others.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+        return fields["Anonymous"] / 1e3, fields["Rss"] / 1e3
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+        return peak, peak
+
+
+def synthetic_dump(path, words, rng):
+    headwords = set()
+    with open(path, "w", encoding="utf-8") as f:
+        while len(headwords) < words:
+            word = "".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 12)))
+            if word in headwords:
+                continue
+            headwords.add(word)
+            for pos in rng.sample(POS, rng.randint(1, 3)):
+                senses = [
+                    {"glosses": [f"({pos}) sense {i} of {word}, " + " ".join(rng.choice(LETTERS) * 4 for _ in range(8))]}
+                    for i in range(rng.randint(1, 4))
+                ]
+                f.write(json.dumps({"word": word, "lang_code": "fr", "pos": pos, "senses": senses}) + "\n")
+            f.write(json.dumps({"word": word, "lang_code": "en", "pos": "noun", "senses": [{"glosses": ["skipped"]}]}) + "\n")
+    return sorted(headwords)
+
+
+def time_lookups(index, words):
+    samples = []
+    for word in words:
+        start = time.perf_counter()
+        index.get(word)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=200000, help="French headwords in the dump")
+    parser.add_argument("--lookups", type=int, default=100000, help="lookups to time, of each kind")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="bench-wiktionary-index-") as data_dir:
+        dump_path = os.path.join(data_dir, "fr-extract.jsonl")
+        index_path = os.path.join(data_dir, "wiktionary.idx")
+        headwords = synthetic_dump(dump_path, args.words, rng)
+
+        start = time.perf_counter()
+        entries = read_wiktextract(dump_path)
+        write_index(index_path, entries)
+        built = time.perf_counter() - start
+        print(f"Built {len(entries)} headwords in {built:.1f}s: {os.path.getsize(index_path) / 1e6:.1f} MB on disk "
+              f"({os.path.getsize(dump_path) / 1e6:.1f} MB dump)")
+
+        expected = {word: entries[word] for word in rng.sample(headwords, min(1000, len(headwords)))}
+        del entries
+
+        anonymous_before, rss_before = memory_mb()
+        index = WiktionaryIndex(index_path)
+        mismatches = [word for word, parts in expected.items() if index.get(word) != parts]
+        if mismatches or index.get("zzzz-absent") is not None:
+            sys.exit(f"Index returned the wrong entry for {mismatches[:5]}")
+
+        present = [rng.choice(headwords) for _ in range(args.lookups)]
+        absent = [f"{word}#" for word in present]
+        for name, words in (("present", present), ("absent", absent)):
+            median, p99 = time_lookups(index, words)
+            print(f"  {name + ' headword':<18} median {median:6.1f}us  p99 {p99:6.1f}us")
+
+        for word in headwords:
+            index.get(word)
+        anonymous, rss = memory_mb()
+        print(f"Worker memory after reading every headword: +{anonymous - anonymous_before:.1f} MB private, "
+              f"+{rss - rss_before:.1f} MB resident, shared page cache")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
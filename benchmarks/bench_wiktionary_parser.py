@@ -0,0 +1,167 @@
+"""
+Check and time the Wiktionary extract parser against the inline regex cascade
+it replaced, on the saved extracts in benchmarks/fixtures/wiktionary.
+
+Every fixture lists the (word, category) lookups to run and the result the
+previous implementation gave. Both implementations must still give it; any
+difference is printed and makes the script exit with status 1.
+
+Usage:
+    python benchmarks/bench_wiktionary_parser.py [--runs 200] [--save]
+
+--save rewrites the expected results from the previous implementation, after
+adding a new fixture.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.utils import wiktionary_parser  # noqa: E402
+from app.utils.whatsapp_utils import WIKTIONARY_LOOKUPS, definition_from_extract  # noqa: E402
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "wiktionary")
+
+
+def legacy_definition(source, extract, word, cat):
+    """
+    The parsing part of lookup_fr_to_en_def / lookup_fr_to_fr_def before the shared parser.
+    """
+    settings = WIKTIONARY_LOOKUPS[source]
+    language_sections = re.split(r"(?m)^==\s+(.*?)\s+==\s*$", extract)
+    for i in range(1, len(language_sections), 2):
+        language = language_sections[i].strip().lower()
+        content = language_sections[i + 1].strip()
+        if language == settings["language"]:
+            sub_sections = re.split(r"(?m)^===\s+(.*?)\s+===\s*$", content)
+            for j in range(1, len(sub_sections), 2):
+                sub_section = re.sub(r'\d+', '', sub_sections[j]).strip().lower()
+                sub_section_content = sub_sections[j + 1].strip()
+                if sub_section == cat:
+                    matches = re.findall(r'\n\n(.*?)\n\n\n', sub_section_content, re.DOTALL)
+                    if len(matches) == 0:
+                        matches = re.findall(r'\n\n(.*?)\n', sub_section_content, re.DOTALL)
+                        if len(matches) == 0:
+                            matches = re.findall(r'\n\n(.*)', sub_section_content, re.DOTALL)
+                            if len(matches) == 0:
+                                return None, f"No definition found for the word {word}. Error of matches."
+                    definitions = matches[0].strip().split("\n")
+                    definitions_final = []
+                    for definition in definitions:
+                        if (
+                            len(definition.split()) > 0
+                            and definition.split()[0] not in ["Synonyms:", "Synonym:", "Antonym:", "Antonyms:"]
+                            and settings["keep_definition"](word, definition)
+                        ):
+                            definitions_final.append(definition)
+                    if len(definitions_final) > 1:
+                        word_definition = ''
+                        for definition in definitions_final:
+                            if len(word_definition) > 0:
+                                word_definition += "\n"
+                            word_definition += f"•  {definition}"
+                        return word_definition, None
+                    elif len(definitions_final) == 1:
+                        return definitions_final[0], None
+                    return None, "Word found, but definition not retrieved"
+            return None, settings["wrong_category_message"].format(word=word, cat=cat)
+    return None, f"No definition found for the word {word}"
+
+
+def load_fixtures():
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            fixtures.append((path, json.load(f)))
+    return fixtures
+
+
+def lookups(fixtures):
+    for _, fixture in fixtures:
+        for case in fixture["cases"]:
+            yield fixture, case
+
+
+def check(fixtures):
+    failures = 0
+    for fixture, case in lookups(fixtures):
+        expected = [case["definition"], case["error"]]
+        results = {
+            "legacy": legacy_definition(fixture["source"], fixture["extract"], fixture["title"], case["cat"]),
+            "parser": definition_from_extract(
+                fixture["source"], fixture["title"], fixture["extract"], fixture["title"], case["cat"]
+            ),
+        }
+        for name, result in results.items():
+            if list(result) != expected:
+                failures += 1
+                print(f"MISMATCH {name} {fixture['source']} {fixture['title']!r} ({case['cat']}):")
+                print(f"  expected {expected!r}")
+                print(f"  got      {list(result)!r}")
+    return failures
+
+
+def save(fixtures):
+    for path, fixture in fixtures:
+        for case in fixture["cases"]:
+            case["definition"], case["error"] = legacy_definition(
+                fixture["source"], fixture["extract"], fixture["title"], case["cat"]
+            )
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+def time_runs(runs, fixtures, lookup, before_run=None):
+    start = time.perf_counter()
+    for _ in range(runs):
+        if before_run:
+            before_run()
+        for fixture, case in lookups(fixtures):
+            lookup(fixture, case)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--save", action="store_true", help="record the previous implementation's results")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    if args.save:
+        save(fixtures)
+        print(f"Saved expected results for {len(fixtures)} fixtures")
+        return
+
+    failures = check(fixtures)
+    count = sum(1 for _ in lookups(fixtures))
+    print(f"{len(fixtures)} extracts, {count} lookups, {failures} mismatches")
+
+    def legacy(fixture, case):
+        legacy_definition(fixture["source"], fixture["extract"], fixture["title"], case["cat"])
+
+    def shared(fixture, case):
+        definition_from_extract(fixture["source"], fixture["title"], fixture["extract"], fixture["title"], case["cat"])
+
+    def forget():
+        wiktionary_parser._parser = wiktionary_parser.ExtractParser()
+
+    timings = {
+        "legacy": time_runs(args.runs, fixtures, legacy),
+        "parser (cold)": time_runs(args.runs, fixtures, shared, before_run=forget),
+        "parser (memoized)": time_runs(args.runs, fixtures, shared),
+    }
+    for name, seconds in timings.items():
+        print(f"  {name:<18} {seconds * 1e6 / count:8.1f}us per lookup")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Local stand-ins for the upstream APIs the bot talks to: the WhatsApp Cloud
+API (Graph), Merriam-Webster, the English and French Wiktionaries, and Google
+Sheets with its OAuth token endpoint.
+
+Each upstream listens on its own port, with its own latency and error rate.
+Dictionary answers are synthesized from the word, so any word can be looked
+up:
+    - words starting with "zz" are unknown everywhere
+    - words starting with "rare" are missing from the learner's dictionary,
+      which forces the Merriam-Webster collegiate fallback
+Every message sent through Graph is recorded with the time it arrived, which
+is what the load test measures end-to-end latency against.
+
+Datastore has no stand-in: load tests run with DEDUP_BACKEND=sqlite, or
+against the official Datastore emulator through DATASTORE_EMULATOR_HOST.
+
+Usage:
+    python benchmarks/emulator.py [--latency mw=80,graph=150] [--errors mw=0.02]
+prints the environment to give the app, then serves until interrupted.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+UPSTREAMS = ["graph", "mw", "wiktionary_en", "wiktionary_fr", "sheets"]
+DEFAULT_LATENCY_MS = {"graph": 120, "mw": 80, "wiktionary_en": 150, "wiktionary_fr": 150, "sheets": 200}
+
+MEDIA_TOKEN_PATTERN = re.compile(rb"LOADTEST-MEDIA:([\w-]+);")
+A1_PATTERN = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+def parse_settings(value, cast=float):
+    """
+    Parse "mw=80,graph=150" into {"mw": 80.0, "graph": 150.0}.
+    """
+    settings = {}
+    for item in filter(None, (value or "").split(",")):
+        name, _, setting = item.partition("=")
+        if name.strip() not in UPSTREAMS:
+            raise ValueError(f"Unknown upstream {name!r}, expected one of {', '.join(UPSTREAMS)}")
+        settings[name.strip()] = cast(setting)
+    return settings
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index
+
+
+def parse_a1_range(range_name):
+    """
+    "'Sheet1'!A5:E6" -> (first row, last row, first column, last column), 1-based, None meaning open-ended.
+    """
+    cells = unquote(range_name).rpartition("!")[2] if "!" in unquote(range_name) else ""
+    if not cells:
+        return 1, None, 1, None
+    start, _, end = cells.partition(":")
+    end = end or start
+    start_col, start_row = A1_PATTERN.match(start).groups()
+    end_col, end_row = A1_PATTERN.match(end).groups()
+    return (
+        int(start_row) if start_row else 1,
+        int(end_row) if end_row else None,
+        column_index(start_col) if start_col else 1,
+        column_index(end_col) if end_col else None,
+    )
+
+
+class FakeSpreadsheet:
+    """
+    One worksheet of values, enough for the calls VocabSheet and SheetSync make.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def metadata(self):
+        return {
+            "spreadsheetId": self.key,
+            "properties": {"title": "Vocab (emulated)", "locale": "en_US", "timeZone": "Etc/GMT"},
+            "sheets": [
+                {
+                    "properties": {
+                        "sheetId": 0,
+                        "title": "Sheet1",
+                        "index": 0,
+                        "sheetType": "GRID",
+                        "gridProperties": {"rowCount": max(1000, len(self.rows)), "columnCount": 26},
+                    }
+                }
+            ],
+        }
+
+    def get(self, range_name, major_dimension="ROWS"):
+        first_row, last_row, first_col, last_col = parse_a1_range(range_name)
+        with self.lock:
+            rows = self.rows[first_row - 1:last_row]
+            values = [row[first_col - 1:last_col] for row in rows]
+        while values and not any(values[-1]):
+            values.pop()
+        if major_dimension == "COLUMNS":
+            width = max((len(row) for row in values), default=0)
+            values = [[row[i] if i < len(row) else "" for row in values] for i in range(width)]
+            for column in values:
+                while column and column[-1] == "":
+                    column.pop()
+        return {"range": range_name, "majorDimension": major_dimension, "values": values}
+
+    def append(self, values):
+        with self.lock:
+            first = len(self.rows) + 1
+            self.rows.extend([[str(cell) if cell is not None else "" for cell in row] for row in values])
+            last = len(self.rows)
+        return {"updates": {"updatedRange": f"Sheet1!A{first}:E{last}", "updatedRows": len(values)}}
+
+    def update(self, range_name, values):
+        first_row, _, first_col, _ = parse_a1_range(range_name)
+        with self.lock:
+            for i, row in enumerate(values):
+                index = first_row - 1 + i
+                while len(self.rows) <= index:
+                    self.rows.append([])
+                target = self.rows[index]
+                while len(target) < first_col - 1 + len(row):
+                    target.append("")
+                for j, cell in enumerate(row):
+                    target[first_col - 1 + j] = str(cell)
+        return {"updatedRange": range_name, "updatedRows": len(values)}
+
+    def batch_update(self, body):
+        for request in body.get("requests", []):
+            dimension = request.get("deleteDimension", {}).get("range")
+            if dimension and dimension.get("dimension") == "ROWS":
+                with self.lock:
+                    del self.rows[dimension["startIndex"]:dimension["endIndex"]]
+        return {"spreadsheetId": self.key, "replies": [{} for _ in body.get("requests", [])]}
+
+
+def mw_payload(reference, word):
+    if word.startswith("zz"):
+        # Merriam-Webster answers unknown words with spelling suggestions
+        return [word[2:], word[2:] + "s"]
+    if word.startswith("rare") and reference == "learners":
+        return [word + "s", word[:-1]]
+    return [
+        {"meta": {"id": word}, "fl": "noun", "shortdef": [f"first meaning ({reference})", "second meaning"]},
+        {"meta": {"id": f"{word}:2"}, "fl": "verb", "shortdef": ["to do the thing"]},
+    ]
+
+
+def wiktionary_payload(edition, word):
+    if word.startswith("zz"):
+        return {"batchcomplete": "", "query": {"pages": {"-1": {"ns": 0, "title": word, "missing": ""}}}}
+    if edition == "en":
+        extract = (
+            "== French ==\n\n\n=== Etymology ===\nFrom Latin.\n\n\n"
+            f"=== Noun ===\n{word} m (plural {word}s)\n\nfirst sense\nsecond sense\n"
+            "An example. ― A translation.\n\n\n=== Verb ===\n"
+            f"{word}\n\nto do the thing\n\n\n=== Anagrams ===\nnone\n"
+        )
+    else:
+        extract = (
+            "== Français ==\n\n\n=== Étymologie ===\nDu latin.\n\n\n"
+            f"=== Nom commun ===\n{word} masculin\n\nPremier sens.\nSecond sens.\n"
+            "Un exemple. — (Auteur)\n\n\n=== Verbe ===\n"
+            f"{word} transitif\n\nFaire la chose.\n\n\n=== Anagrammes ===\naucun\n"
+        )
+    return {"batchcomplete": "", "query": {"pages": {"1": {"pageid": 1, "ns": 0, "title": word, "extract": extract}}}}
+
+
+class Emulator:
+    """
+    Runs one HTTP server per upstream in background threads.
+    """
+
+    def __init__(self, latency_ms=None, error_rates=None, host="127.0.0.1"):
+        self.host = host
+        self.latency_ms = dict(DEFAULT_LATENCY_MS, **(latency_ms or {}))
+        self.error_rates = error_rates or {}
+        self.sent_messages = []
+        self.listeners = []
+        self.counts = {upstream: 0 for upstream in UPSTREAMS}
+        self.errors = {upstream: 0 for upstream in UPSTREAMS}
+        self.spreadsheets = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._servers = {}
+
+    def start(self):
+        for upstream in UPSTREAMS:
+            server = ThreadingHTTPServer((self.host, 0), self._handler_class(upstream))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"emulator-{upstream}", daemon=True).start()
+            self._servers[upstream] = server
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def url(self, upstream):
+        return f"http://{self.host}:{self._servers[upstream].server_address[1]}"
+
+    def app_env(self):
+        """
+        Settings pointing the app at the stand-ins.
+        """
+        return {
+            "GRAPH_API_URL": self.url("graph"),
+            "MW_API_URL": f"{self.url('mw')}/api/v3",
+            "WIKTIONARY_EN_API_URL": f"{self.url('wiktionary_en')}/w/api.php",
+            "WIKTIONARY_FR_API_URL": f"{self.url('wiktionary_fr')}/w/api.php",
+            "SHEETS_API_URL": f"{self.url('sheets')}/v4/spreadsheets",
+        }
+
+    def token_uri(self):
+        return f"{self.url('sheets')}/token"
+
+    def spreadsheet(self, key):
+        with self._lock:
+            return self.spreadsheets.setdefault(key, FakeSpreadsheet(key))
+
+    def _record_message(self, payload):
+        message = {"payload": payload, "received_at": time.time()}
+        with self._lock:
+            self.sent_messages.append(message)
+        for listener in self.listeners:
+            listener(message)
+
+    def _handler_class(self, upstream):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with emulator._lock:
+                    emulator.counts[upstream] += 1
+                latency = emulator.latency_ms.get(upstream, 0) / 1000
+                time.sleep(latency * random.uniform(0.8, 1.2))
+                if random.random() < emulator.error_rates.get(upstream, 0):
+                    with emulator._lock:
+                        emulator.errors[upstream] += 1
+                    return self._reply(503, {"error": {"code": 503, "message": "Injected error"}})
+                try:
+                    status, response = getattr(emulator, f"_{upstream}")(method, urlparse(self.path), body)
+                except Exception as e:
+                    status, response = 500, {"error": {"code": 500, "message": f"{type(e).__name__}: {e}"}}
+                self._reply(status, response)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+        return Handler
+
+    def _graph(self, method, url, body):
+        if url.path.endswith("/media"):
+            match = MEDIA_TOKEN_PATTERN.search(body)
+            media_id = f"media-{match.group(1).decode()}" if match else f"media-{next(self._ids)}"
+            return 200, {"id": media_id}
+        if url.path.endswith("/messages"):
+            payload = json.loads(body)
+            self._record_message(payload)
+            return 200, {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                "messages": [{"id": f"wamid.emulated{next(self._ids)}"}],
+            }
+        return 404, {"error": {"message": f"Unknown Graph path {url.path}"}}
+
+    def _mw(self, method, url, body):
+        match = re.search(r"/references/(\w+)/json/(.+)$", url.path)
+        if not match:
+            return 404, {"error": "Unknown Merriam-Webster path"}
+        return 200, mw_payload(match.group(1), unquote(match.group(2)))
+
+    def _wiktionary(self, edition, url):
+        titles = parse_qs(url.query).get("titles", [""])[0]
+        return 200, wiktionary_payload(edition, titles)
+
+    def _wiktionary_en(self, method, url, body):
+        return self._wiktionary("en", url)
+
+    def _wiktionary_fr(self, method, url, body):
+        return self._wiktionary("fr", url)
+
+    def _sheets(self, method, url, body):
+        if url.path == "/token":
+            return 200, {"access_token": "emulated-token", "expires_in": 3600, "token_type": "Bearer"}
+        match = re.match(r"^/v4/spreadsheets/([^/:]+)(.*)$", url.path)
+        if not match:
+            return 404, {"error": {"message": f"Unknown Sheets path {url.path}"}}
+        spreadsheet = self.spreadsheet(match.group(1))
+        rest = unquote(match.group(2))
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        data = json.loads(body) if body else {}
+        if rest == "":
+            return 200, spreadsheet.metadata()
+        if rest == ":batchUpdate":
+            return 200, spreadsheet.batch_update(data)
+        if rest.startswith("/values/") and rest.endswith(":append"):
+            return 200, spreadsheet.append(data.get("values", []))
+        if rest.startswith("/values/") and method == "PUT":
+            return 200, spreadsheet.update(rest[len("/values/"):], data.get("values", []))
+        if rest.startswith("/values/"):
+            return 200, spreadsheet.get(rest[len("/values/"):], params.get("majorDimension", "ROWS"))
+        return 404, {"error": {"message": f"Unsupported Sheets call {method} {rest}"}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", default="", help="milliseconds per upstream, e.g. mw=80,graph=150")
+    parser.add_argument("--errors", default="", help="share of requests failing with 503, e.g. mw=0.02")
+    args = parser.parse_args()
+
+    emulator = Emulator(parse_settings(args.latency), parse_settings(args.errors)).start()
+    for name, value in emulator.app_env().items():
+        print(f"{name}={value}")
+    print(f"# token_uri for the service account JSON: {emulator.token_uri()}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"requests {emulator.counts}, injected errors {emulator.errors}, messages {len(emulator.sent_messages)}")
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""
+End-to-end load test of /webhook against local stand-ins for every upstream.
+
+The bot runs under gunicorn (as in production) with its upstream URLs
+pointed at benchmarks/emulator.py and its data files in a temporary
+directory. Correctly signed webhooks are sent at a fixed rate, in a mix of
+commands (vocab, multi-word vocab, say, keep, remove, and several vocab
+messages batched into one delivery) plus status receipts and duplicate
+deliveries. For each kind, the report gives the
+throughput and the p50/p95/p99 latency of the webhook acknowledgement, and
+for commands the end-to-end latency until the reply reaches the Graph
+stand-in.
+
+Usage:
+    python benchmarks/loadtest.py [--rate 20] [--count 500] [--workers 2] [--tenants 20]
+        [--latency mw=80] [--errors mw=0.02] [--json results.json]
+        [--compare baseline.json]
+
+--json saves the results, --compare prints the change against a previous
+run, so that releases can be compared.
+"""
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from emulator import Emulator, parse_settings  # noqa: E402
+
+from app.utils.audio_cache import AudioCache  # noqa: E402
+from app.utils.tenants import DEFAULT_TENANT, TenantRegistry  # noqa: E402
+
+
+APP_SECRET = "loadtest-secret"
+RECIPIENT_WAID = "15550000001"
+SPREADSHEET_KEY = "loadtest-spreadsheet"
+
+# Share of each kind of webhook in the generated traffic
+DEFAULT_MIX = {
+    "vocab": 0.30,
+    "vocab_multi": 0.10,
+    "say": 0.15,
+    "keep": 0.10,
+    "remove": 0.10,
+    "batch": 0.05,
+    "status": 0.15,
+    "duplicate": 0.05,
+}
+COMMANDS = ["vocab", "vocab_multi", "say", "keep", "remove", "batch"]
+
+# A reply belongs to a webhook if it holds its token and one of these phrases
+VOCAB_REPLY_MARKERS = ("added to database", "not found in any dictionary")
+REMOVE_REPLY_MARKERS = ("removed from database", "Could not find")
+KEEP_REPLY_MARKERS = ("Definition updated", "there is no definition", "Could not find")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def service_account_json(token_uri):
+    """
+    Service account credentials whose tokens come from the emulator. The key is real, since google-auth signs with it.
+    """
+    import rsa
+
+    _, private_key = rsa.newkeys(1024)
+    return json.dumps({
+        "type": "service_account",
+        "project_id": "loadtest",
+        "private_key_id": "loadtest",
+        "private_key": private_key.save_pkcs1().decode("ascii"),
+        "client_email": "loadtest@loadtest.iam.gserviceaccount.com",
+        "client_id": "1",
+        "token_uri": token_uri,
+    })
+
+
+class PayloadFactory:
+    """
+    Builds signed WhatsApp webhook bodies, and remembers what reply each one should produce.
+    """
+
+    def __init__(self, app_secret, run_id, senders=(RECIPIENT_WAID,)):
+        self.app_secret = app_secret.encode("latin-1")
+        self.run_id = run_id
+        self.senders = list(senders)
+        self.counter = itertools.count(1)
+        # Each sender is a tenant with its own vocabulary
+        self.saved_words = defaultdict(list)
+        self.sent_bodies = []
+        self.say_phrases = []
+
+    def sign(self, body):
+        return "sha256=" + hmac.new(self.app_secret, body, hashlib.sha256).hexdigest()
+
+    def _token(self):
+        return f"lt{self.run_id}x{next(self.counter):06d}"
+
+    def _envelope(self, value):
+        return {
+            "object": "whatsapp_business_account",
+            "entry": [{"id": "0", "changes": [{"field": "messages", "value": value}]}],
+        }
+
+    def message(self, *texts, sender=RECIPIENT_WAID):
+        """
+        One delivery carrying a message from `sender` for each of `texts`.
+        """
+        return self._envelope({
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "15550000000", "phone_number_id": "123"},
+            "contacts": [{"profile": {"name": "Load test"}, "wa_id": sender}],
+            "messages": [
+                {
+                    "from": sender,
+                    "id": f"wamid.{self._token()}",
+                    "timestamp": str(int(time.time())),
+                    "type": "text",
+                    "text": {"body": text},
+                }
+                for text in texts
+            ],
+        })
+
+    def status(self):
+        return self._envelope({
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "15550000000", "phone_number_id": "123"},
+            "statuses": [{
+                "id": f"wamid.{self._token()}",
+                "status": random.choice(["sent", "delivered", "read"]),
+                "timestamp": str(int(time.time())),
+                "recipient_id": RECIPIENT_WAID,
+            }],
+        })
+
+    def seed_say_phrases(self, count):
+        self.say_phrases = [f"phrase {self._token()}" for _ in range(count)]
+        return self.say_phrases
+
+    def build(self, kind):
+        """
+        Return (body bytes, list of expected reply matchers).
+        """
+        sender = random.choice(self.senders)
+        saved_words = self.saved_words[sender]
+        expects = []
+        if kind == "vocab":
+            # A few words only the collegiate dictionary knows, and a few unknown ones. Unknown
+            # words stay English: the Wiktionary "not found" reply does not name the word
+            word = random.choices(["", "rare", "zz"], [0.85, 0.10, 0.05])[0] + self._token()
+            choices = [("en", word)]
+            if not word.startswith("zz"):
+                choices += [("fren", f"{word} (noun)"), ("fr", f"{word} (nom commun)")]
+            language, text = random.choice(choices)
+            body = self.message(f"vocab {language} {text}", sender=sender)
+            saved_words.append(word)
+            expects.append(("text", word, VOCAB_REPLY_MARKERS))
+        elif kind == "vocab_multi":
+            words = [self._token() for _ in range(random.randint(2, 5))]
+            body = self.message(f"vocab en {', '.join(words)}", sender=sender)
+            saved_words.extend(words)
+            expects.append(("text", words[0], VOCAB_REPLY_MARKERS))
+        elif kind == "say":
+            phrase = random.choice(self.say_phrases)
+            body = self.message(f"say {phrase}", sender=sender)
+            expects.append(("audio", f"media-{phrase.split()[-1]}", ()))
+        elif kind == "keep":
+            # By word, so concurrent edits do not depend on which entry was saved last
+            word = random.choice(saved_words) if saved_words else self._token()
+            body = self.message(f"keep {word} 1", sender=sender)
+            expects.append(("text", word, KEEP_REPLY_MARKERS))
+        elif kind == "remove":
+            word = saved_words.pop(0) if saved_words else self._token()
+            body = self.message(f"remove {word}", sender=sender)
+            expects.append(("text", word, REMOVE_REPLY_MARKERS))
+        elif kind == "batch":
+            words = [self._token() for _ in range(random.randint(2, 4))]
+            body = self.message(*[f"vocab en {word}" for word in words], sender=sender)
+            saved_words.extend(words)
+            expects.extend(("text", word, VOCAB_REPLY_MARKERS) for word in words)
+        elif kind == "status":
+            body = self.status()
+        elif kind == "duplicate" and self.sent_bodies:
+            return random.choice(self.sent_bodies), []
+        else:
+            return self.build("vocab")
+        # Replies must reach the sender, whose tenant's recipient is their own number
+        expects = [expect + (sender,) for expect in expects]
+        raw = json.dumps(body).encode("utf-8")
+        if expects:
+            self.sent_bodies.append(raw)
+        return raw, expects
+
+
+class ReplyTracker:
+    """
+    Matches the messages arriving at the Graph stand-in with the webhooks that caused them.
+
+    A reply matches the oldest pending webhook whose token it contains, along
+    with a phrase telling which command produced it. Replies coalesced by the outbox into
+    one message match a webhook each, so a token found n times matches up to
+    n webhooks.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.latencies = defaultdict(list)
+        self.unmatched = 0
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+
+    def expect(self, kind, expect, sent_at):
+        with self.lock:
+            self.pending.append((kind, expect, sent_at))
+
+    def on_message(self, message):
+        payload = message["payload"]
+        if payload.get("type") == "audio":
+            content, reply_type = payload["audio"].get("id", ""), "audio"
+        else:
+            content, reply_type = payload.get("text", {}).get("body", ""), "text"
+        with self.lock:
+            available, matched = Counter(), []
+            for i, (kind, (expected_type, token, markers, recipient), sent_at) in enumerate(self.pending):
+                if expected_type != reply_type or token not in content or payload.get("to") != recipient:
+                    continue
+                if token not in available:
+                    available[token] = content.count(token)
+                if available[token] and (not markers or any(marker in content for marker in markers)):
+                    available[token] -= 1
+                    matched.append(i)
+                    self.latencies[kind].append(message["received_at"] - sent_at)
+            for i in reversed(matched):
+                del self.pending[i]
+            if not matched:
+                self.unmatched += 1
+            self.done.notify_all()
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.pending and time.time() < deadline:
+                self.done.wait(max(0.1, deadline - time.time()))
+            return len(self.pending)
+
+
+def start_server(env, port):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL if not env.get("LOADTEST_VERBOSE") else None,
+        stderr=subprocess.STDOUT if not env.get("LOADTEST_VERBOSE") else None,
+    )
+    verify_url = f"http://127.0.0.1:{port}/webhook"
+    params = {"hub.mode": "subscribe", "hub.verify_token": env["VERIFY_TOKEN"], "hub.challenge": "ready"}
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}, rerun with LOADTEST_VERBOSE=1")
+        try:
+            if requests.get(verify_url, params=params, timeout=5).text == "ready":
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 20s")
+
+
+def run(args):
+    run_id = f"{int(time.time()) % 100000:05d}"
+    senders = [RECIPIENT_WAID] + [f"1555200{i:04d}" for i in range(args.tenants)]
+    factory = PayloadFactory(APP_SECRET, run_id, senders)
+    tracker = ReplyTracker()
+    emulator = Emulator(parse_settings(args.latency), parse_settings(args.errors)).start()
+    emulator.listeners.append(tracker.on_message)
+
+    data_dir = tempfile.mkdtemp(prefix="loadtest-")
+    # The other senders are registered learners, each with a spreadsheet of their own
+    registry = TenantRegistry(
+        os.path.join(data_dir, "tenants.sqlite3"),
+        {"id": DEFAULT_TENANT, "recipient": RECIPIENT_WAID, "spreadsheet_key": SPREADSHEET_KEY, "language": None},
+    )
+    for sender in senders[1:]:
+        registry.register(sender, f"{SPREADSHEET_KEY}-{sender}")
+    # gTTS has no stand-in: the voice notes of the phrases used by "say" are put in the audio cache beforehand
+    audio_cache = AudioCache(os.path.join(data_dir, "audio"), max_bytes=100 * 1024 * 1024, media_ttl=3600)
+    for phrase in factory.seed_say_phrases(args.say_phrases):
+        audio_cache.put_audio(audio_cache.key("en", phrase), b"OggS" + f"LOADTEST-MEDIA:{phrase.split()[-1]};".encode())
+
+    port = free_port()
+    env = dict(os.environ)
+    env.update(emulator.app_env())
+    env.update({
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(args.web_workers),
+        "APP_SECRET": APP_SECRET,
+        "VERIFY_TOKEN": "loadtest",
+        "ACCESS_TOKEN": "loadtest",
+        "VERSION": "v18.0",
+        "PHONE_NUMBER_ID": "123",
+        "RECIPIENT_WAID": RECIPIENT_WAID,
+        "DICT_LEARNER_KEY": "loadtest",
+        "DICT_DICT_KEY": "loadtest",
+        "GOOGLE_SHEETS_CREDENTIALS": service_account_json(emulator.token_uri()),
+        "VOCAB_SPREADSHEET_KEY": SPREADSHEET_KEY,
+        "VOCAB_STORE_PATH": os.path.join(data_dir, "vocab.sqlite3"),
+        "JOB_QUEUE_PATH": os.path.join(data_dir, "jobs.sqlite3"),
+        "OUTBOX_PATH": os.path.join(data_dir, "outbox.sqlite3"),
+        "TENANTS_PATH": os.path.join(data_dir, "tenants.sqlite3"),
+        "OUTBOX_RATE": str(args.outbox_rate),
+        "JOB_QUEUE_WORKERS": str(args.workers),
+        "DEF_CACHE_PATH": os.path.join(data_dir, "definitions.sqlite3"),
+        "AUDIO_CACHE_DIR": os.path.join(data_dir, "audio"),
+        "DEDUP_BACKEND": "sqlite",
+        "DEDUP_SQLITE_PATH": os.path.join(data_dir, "message_ids.sqlite3"),
+    })
+    server = start_server(env, port)
+
+    url = f"http://127.0.0.1:{port}/webhook"
+    acks = defaultdict(list)
+    failures = defaultdict(int)
+    local = threading.local()
+    kinds = list(DEFAULT_MIX)
+    weights = [DEFAULT_MIX[kind] for kind in kinds]
+
+    def send(kind, body, expects):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        sent_at = time.time()
+        for expect in expects:
+            tracker.expect(kind, expect, sent_at)
+        try:
+            response = session.post(
+                url, data=body, timeout=30,
+                headers={"Content-Type": "application/json", "X-Hub-Signature-256": factory.sign(body)},
+            )
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            acks[kind].append(time.time() - sent_at)
+        else:
+            failures[kind] += 1
+
+    print(f"Sending {args.count} webhooks at {args.rate}/s to {url}")
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for i in range(args.count):
+                delay = start + i / args.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                kind = random.choices(kinds, weights)[0]
+                body, expects = factory.build(kind)
+                executor.submit(send, kind, body, expects)
+        sent_seconds = time.time() - start
+        missing = tracker.wait(args.drain_timeout)
+        total_seconds = time.time() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+        emulator.stop()
+
+    results = {"rate": args.rate, "count": args.count, "seconds": total_seconds, "kinds": {}}
+    for kind in kinds:
+        e2e = tracker.latencies.get(kind, [])
+        results["kinds"][kind] = {
+            "sent": len(acks[kind]) + failures[kind],
+            "failed": failures[kind],
+            "ack_p50": percentile(acks[kind], 0.50),
+            "ack_p95": percentile(acks[kind], 0.95),
+            "ack_p99": percentile(acks[kind], 0.99),
+            "replies": len(e2e),
+            "e2e_p50": percentile(e2e, 0.50),
+            "e2e_p95": percentile(e2e, 0.95),
+            "e2e_p99": percentile(e2e, 0.99),
+        }
+    completed = sum(len(tracker.latencies.get(kind, [])) for kind in COMMANDS)
+    results["throughput"] = completed / total_seconds if total_seconds else 0.0
+    results["missing_replies"] = missing
+    results["unmatched_replies"] = tracker.unmatched
+    results["upstream_requests"] = emulator.counts
+    results["upstream_errors"] = emulator.errors
+    results["sheet_rows"] = sum(len(sheet.rows) for sheet in list(emulator.spreadsheets.values()))
+    print(f"Sent in {sent_seconds:.1f}s, all replies in {total_seconds:.1f}s, data in {data_dir}")
+    return results
+
+
+def ms(value):
+    return f"{value * 1000:7.0f}" if value is not None else "      -"
+
+
+def report(results, baseline=None):
+    print(f"\n{'kind':<12} {'sent':>5} {'fail':>5} {'ack p50':>8} {'p95':>7} {'p99':>7}   "
+          f"{'replies':>7} {'e2e p50':>8} {'p95':>7} {'p99':>7}  (ms)")
+    for kind, stats in results["kinds"].items():
+        line = (
+            f"{kind:<12} {stats['sent']:>5} {stats['failed']:>5} {ms(stats['ack_p50'])} {ms(stats['ack_p95'])}"
+            f" {ms(stats['ack_p99'])}   {stats['replies']:>7} {ms(stats['e2e_p50'])} {ms(stats['e2e_p95'])}"
+            f" {ms(stats['e2e_p99'])}"
+        )
+        previous = (baseline or {}).get("kinds", {}).get(kind, {})
+        if previous.get("e2e_p95") and stats["e2e_p95"]:
+            line += f"  e2e p95 {(stats['e2e_p95'] / previous['e2e_p95'] - 1) * 100:+.0f}%"
+        elif previous.get("ack_p95") and stats["ack_p95"]:
+            line += f"  ack p95 {(stats['ack_p95'] / previous['ack_p95'] - 1) * 100:+.0f}%"
+        print(line)
+    print(f"\nThroughput: {results['throughput']:.1f} commands/s end to end", end="")
+    if baseline and baseline.get("throughput"):
+        print(f" ({(results['throughput'] / baseline['throughput'] - 1) * 100:+.0f}% vs baseline)", end="")
+    print()
+    print(f"Missing replies: {results['missing_replies']}, unmatched replies: {results['unmatched_replies']}")
+    print(f"Upstream requests: {results['upstream_requests']}")
+    print(f"Injected errors: {results['upstream_errors']}, rows in the emulated sheets: {results['sheet_rows']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=20, help="webhooks per second")
+    parser.add_argument("--count", type=int, default=500, help="webhooks to send")
+    parser.add_argument("--concurrency", type=int, default=32, help="webhooks in flight at most")
+    parser.add_argument("--workers", type=int, default=2, help="job queue workers per server process")
+    parser.add_argument(
+        "--outbox-rate", type=float, default=0,
+        help="messages/s to the (single) recipient, 0 = no limit so the server rather than the limit is measured",
+    )
+    parser.add_argument("--web-workers", type=int, default=2, help="gunicorn worker processes")
+    # Each sender's messages run one at a time, so a single sender measures that rather than the server
+    parser.add_argument("--tenants", type=int, default=20, help="learners besides RECIPIENT_WAID sending messages")
+    parser.add_argument("--say-phrases", type=int, default=20, help="distinct phrases used by say")
+    parser.add_argument("--latency", default="", help="upstream latency in ms, e.g. mw=80,graph=150")
+    parser.add_argument("--errors", default="", help="upstream error rates, e.g. mw=0.02")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for the last replies")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
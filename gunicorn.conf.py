@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for production.
+
+    gunicorn -c gunicorn.conf.py run:app
+
+SERVER_MODE=threads (default) serves the Flask app with threaded workers,
+SERVER_MODE=async serves the aiohttp app from app/aio.py instead.
+"""
+import os
+
+from flask import Flask
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("WEB_THREADS", 8))
+timeout = int(os.getenv("WEB_TIMEOUT", 30))
+# Gunicorn waits this long for a worker to finish in-flight requests and drain its
+# job queue, keep SHUTDOWN_TIMEOUT below it
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+accesslog = "-"
+
+# Every worker runs its own job queue, deduplicator and sheet sync threads,
+# so the app must be loaded after forking
+preload_app = False
+
+if os.getenv("SERVER_MODE", "threads") == "async":
+    worker_class = "aiohttp.GunicornWebWorker"
+    wsgi_app = "app.aio:create_aio_app"
+else:
+    worker_class = "gthread"
+    wsgi_app = "run:app"
+
+
+def post_worker_init(worker):
+    # The async app warms itself up in its factory
+    if isinstance(worker.wsgi, Flask):
+        from app.utils.lifecycle import warm_up
+
+        warm_up(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    if isinstance(worker.wsgi, Flask):
+        from app.utils.lifecycle import shutdown_app
+
+        shutdown_app(worker.wsgi)
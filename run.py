@@ -6,6 +6,7 @@ from app import create_app
 
 app = create_app()
 
+# Development server only, production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == "__main__":
     logging.info("Flask app started")
     port = int(os.environ.get("PORT", 8000))
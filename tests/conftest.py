@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    """
+    Settings keeping every store in `tmp_path`, with no Google credentials, so nothing reaches the network.
+    """
+    for setting, filename in [
+        ("TENANTS_PATH", "tenants.sqlite3"),
+        ("VOCAB_STORE_PATH", "vocab.sqlite3"),
+        ("OUTBOX_PATH", "outbox.sqlite3"),
+        ("DEDUP_SQLITE_PATH", "message_ids.sqlite3"),
+        ("JOB_QUEUE_PATH", "jobs.sqlite3"),
+        ("DEF_CACHE_PATH", "definitions.sqlite3"),
+        ("HEADWORDS_PATH", "headwords.sqlite3"),
+        ("AUDIO_CACHE_DIR", "audio"),
+    ]:
+        monkeypatch.setenv(setting, str(tmp_path / filename))
+    for setting, value in [
+        ("DEDUP_BACKEND", "sqlite"),
+        ("VOCAB_SYNC_ENABLED", "false"),
+        ("WARM_UP_ENABLED", "false"),
+        ("GOOGLE_SHEETS_CREDENTIALS", ""),
+        ("WIKTIONARY_EN_INDEX_PATH", ""),
+        ("WIKTIONARY_FR_INDEX_PATH", ""),
+        ("RECIPIENT_WAID", "15550000001"),
+        ("ACCESS_TOKEN", "test-token"),
+        ("PHONE_NUMBER_ID", "123"),
+        ("VERSION", "v18.0"),
+    ]:
+        monkeypatch.setenv(setting, value)
+
+
+@pytest.fixture
+def app(app_env):
+    """
+    An app of `app_env` with no background services running.
+    """
+    from app import create_app
+
+    flask_app = create_app(start_workers=False)
+    yield flask_app
+    for name in ("job_queue", "outbox", "deduplicator", "sheet_sync"):
+        component = flask_app.extensions.get(name)
+        if component is not None:
+            component.stop(timeout=1)
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    Answers dictionary requests with the responses (or exceptions) queued by `upstream.answer`/`upstream.fail`,
+    recording their URLs.
+    """
+    class Upstream:
+        responses = []
+        urls = []
+
+        @classmethod
+        def answer(cls, status_code, data=None):
+            cls.responses.append(FakeResponse(status_code, data))
+
+        @classmethod
+        def fail(cls, error):
+            cls.responses.append(error)
+
+    def http_get(url, **kwargs):
+        Upstream.urls.append(url)
+        response = Upstream.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    from app.utils import whatsapp_utils
+
+    monkeypatch.setattr(whatsapp_utils, "http_get", http_get)
+    return Upstream
@@ -0,0 +1,70 @@
+import click
+import pytest
+
+from app import create_app
+from app.utils import bulk_import
+from app.utils.bulk_import import BulkImporter
+from app.utils.vocab_store import get_vocab_store
+
+
+def stop_services(app):
+    for name in ("job_queue", "outbox", "deduplicator", "sheet_sync"):
+        component = app.extensions.get(name)
+        if component is not None:
+            component.stop(timeout=1)
+
+
+def test_cli_commands_start_no_background_services(app_env):
+    with click.Context(click.Command("import-vocab"), info_name="import-vocab"):
+        app = create_app()
+    assert app.extensions["job_queue"]._threads == []
+    assert app.extensions["outbox"]._thread is None
+    stop_services(app)
+
+    # `flask run` serves webhooks, so it needs them
+    with click.Context(click.Command("run"), info_name="run"):
+        app = create_app()
+    assert app.extensions["job_queue"]._threads
+    assert app.extensions["outbox"]._thread is not None
+    stop_services(app)
+
+
+def test_checkpoint_of_another_word_list_is_refused(app, tmp_path):
+    checkpoint_path = str(tmp_path / "words.txt.checkpoint.json")
+    rejected_path = str(tmp_path / "words.txt.rejected.csv")
+    importer = BulkImporter(app, [("fr", "berger"), ("fr", "chien")], checkpoint_path, rejected_path)
+    importer.progress["done"] = 1
+    importer.save_checkpoint()
+
+    # Same number of words, so only the content tells them apart
+    edited = BulkImporter(app, [("fr", "berger"), ("fr", "chat")], checkpoint_path, rejected_path)
+    with pytest.raises(click.ClickException):
+        edited.load_checkpoint()
+
+    same = BulkImporter(app, [("fr", "berger"), ("fr", "chien")], checkpoint_path, rejected_path)
+    same.load_checkpoint()
+    assert same.progress["done"] == 1
+
+
+def test_import_saves_words_and_resumes(app, tmp_path, monkeypatch):
+    looked_up = []
+
+    def lookup_definition(language, text):
+        looked_up.append(text)
+        return text, "noun", f"definition of {text}", "", None
+
+    monkeypatch.setattr(bulk_import, "lookup_definition", lookup_definition)
+    path = tmp_path / "words.txt"
+    path.write_text("berger\nchien\nchat\n", encoding="utf-8")
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["import-vocab", str(path), "--language", "fr", "--chunk-size", "2"])
+    assert result.exit_code == 0, result.output
+    assert "Imported 3 words" in result.output
+
+    # A second run resumes after the last word instead of looking them up again
+    result = runner.invoke(args=["import-vocab", str(path), "--language", "fr"])
+    assert result.exit_code == 0, result.output
+    assert sorted(looked_up) == ["berger", "chat", "chien"]
+    with app.app_context():
+        assert get_vocab_store().find_latest_by_word("chien", "fr", "default")["definition"] == "definition of chien"
@@ -0,0 +1,207 @@
+import threading
+import time
+
+import pytest
+from google.api_core.exceptions import Aborted
+from google.cloud import datastore
+
+from app.utils.dedup import DatastoreDedupBackend, MessageDeduplicator, SQLiteDedupBackend
+
+
+class FakeDatastore:
+    """
+    Entities shared by several clients, with optimistic transactions: a
+    commit is aborted if an entity it read was written since.
+    """
+
+    def __init__(self, readers_to_sync=0):
+        self.entities = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.aborts = 0
+        # Holds the first transactions' reads until they have all read, to force a conflict
+        self.barrier = threading.Barrier(readers_to_sync) if readers_to_sync else None
+
+
+class FakeTransaction:
+    def __init__(self, client):
+        self.client = client
+        self.read = {}
+        self.writes = []
+
+    def __enter__(self):
+        self.client._local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client._local.transaction = None
+        if exc_type is not None:
+            return False
+        store = self.client.store
+        with store.lock:
+            if any(store.versions.get(name, 0) != version for name, version in self.read.items()):
+                store.aborts += 1
+                raise Aborted("too much contention on these datastore entities")
+            for entity in self.writes:
+                store.entities[entity.key.name] = entity
+                store.versions[entity.key.name] = store.versions.get(entity.key.name, 0) + 1
+        return False
+
+
+class FakeClient:
+    def __init__(self, store):
+        self.store = store
+        self._local = threading.local()
+
+    def key(self, kind, name):
+        return datastore.Key(kind, name, project="test")
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def get_multi(self, keys):
+        transaction = self._local.transaction
+        with self.store.lock:
+            for key in keys:
+                transaction.read[key.name] = self.store.versions.get(key.name, 0)
+            found = [self.store.entities[key.name] for key in keys if key.name in self.store.entities]
+        barrier = self.store.barrier
+        if barrier is not None and not barrier.broken:
+            try:
+                barrier.wait(timeout=1)
+            except threading.BrokenBarrierError:
+                pass
+            barrier.abort()
+        return found
+
+    def put_multi(self, entities):
+        self._local.transaction.writes.extend(entities)
+
+    def delete(self, key):
+        with self.store.lock:
+            self.store.entities.pop(key.name, None)
+            self.store.versions[key.name] = self.store.versions.get(key.name, 0) + 1
+
+
+def datastore_backend(store):
+    backend = DatastoreDedupBackend(ttl=3600)
+    backend._client = FakeClient(store)
+    return backend
+
+
+def claim_concurrently(deduplicators, message_ids, threads_per_deduplicator=4):
+    """
+    Have every thread of every deduplicator claim all of `message_ids` at once; return every claim made.
+    """
+    start = threading.Barrier(len(deduplicators) * threads_per_deduplicator)
+    claims = []
+    claims_lock = threading.Lock()
+
+    def claim(deduplicator):
+        start.wait()
+        claimed = deduplicator.claim_many(message_ids)
+        with claims_lock:
+            claims.extend(claimed)
+
+    threads = [
+        threading.Thread(target=claim, args=(deduplicator,))
+        for deduplicator in deduplicators
+        for _ in range(threads_per_deduplicator)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claims
+
+
+def test_sqlite_claims_each_id_once_across_processes(tmp_path):
+    # Two deduplicators on one file stand for two gunicorn workers
+    path = str(tmp_path / "message_ids.sqlite3")
+    workers = [MessageDeduplicator(SQLiteDedupBackend(path), ttl=3600) for _ in range(2)]
+    message_ids = [f"wamid.{i}" for i in range(50)]
+
+    claims = claim_concurrently(workers, message_ids)
+
+    assert sorted(claims) == sorted(message_ids)
+
+
+def test_datastore_claims_each_id_once_across_processes():
+    store = FakeDatastore(readers_to_sync=2)
+    workers = [MessageDeduplicator(datastore_backend(store), ttl=3600) for _ in range(2)]
+
+    claims = claim_concurrently(workers, ["wamid.1", "wamid.2"], threads_per_deduplicator=1)
+
+    assert sorted(claims) == ["wamid.1", "wamid.2"]
+    # Both read before either committed: the second commit was aborted, and its retry found the IDs taken
+    assert store.aborts == 1
+
+
+class ContendedClient(FakeClient):
+    # Another process writes every entity right after it is read, so every commit conflicts
+    def get_multi(self, keys):
+        found = super().get_multi(keys)
+        with self.store.lock:
+            for key in keys:
+                self.store.versions[key.name] = self.store.versions.get(key.name, 0) + 1
+        return found
+
+
+def test_datastore_gives_up_after_repeated_aborts():
+    store = FakeDatastore()
+    backend = DatastoreDedupBackend(ttl=3600, attempts=2)
+    backend._client = ContendedClient(store)
+    deduplicator = MessageDeduplicator(backend, ttl=3600)
+
+    with pytest.raises(Aborted):
+        deduplicator.claim_many(["wamid.1"])
+    assert store.aborts == 2
+
+    # The failed claim is forgotten, so Meta's retry of the webhook gets another chance
+    backend._client = FakeClient(store)
+    assert deduplicator.claim_many(["wamid.1"]) == ["wamid.1"]
+
+
+class SlowBackend:
+    def __init__(self):
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+        self.slow_ids = set()
+
+    def claim_many(self, message_ids):
+        if self.slow_ids.intersection(message_ids):
+            self.entered.set()
+            self.proceed.wait(5)
+        return list(message_ids)
+
+    def release(self, message_id):
+        pass
+
+
+def test_backend_round_trip_does_not_block_other_claims():
+    backend = SlowBackend()
+    backend.slow_ids = {"wamid.slow"}
+    deduplicator = MessageDeduplicator(backend, ttl=3600)
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault("slow", deduplicator.claim_many(["wamid.slow"])))
+    thread.start()
+    assert backend.entered.wait(5)
+
+    start = time.perf_counter()
+    assert deduplicator.claim_many(["wamid.other"]) == ["wamid.other"]
+    # A retry of the message being claimed is turned away while the backend answers
+    assert deduplicator.claim_many(["wamid.slow"]) == []
+    assert time.perf_counter() - start < 1
+
+    backend.proceed.set()
+    thread.join()
+    assert results["slow"] == ["wamid.slow"]
+
+
+def test_repeats_within_a_batch_and_released_ids(tmp_path):
+    deduplicator = MessageDeduplicator(SQLiteDedupBackend(str(tmp_path / "ids.sqlite3")), ttl=3600)
+
+    assert deduplicator.claim_many(["a", "b", "a"]) == ["a", "b"]
+    assert deduplicator.claim_many(["a", "c"]) == ["c"]
+    deduplicator.release("a")
+    assert deduplicator.claim_many(["a"]) == ["a"]
@@ -0,0 +1,59 @@
+from app.utils.headwords import HeadwordIndex, did_you_mean, fold, get_headword_index
+from app.utils.sqlite_utils import SQLiteDatabase
+from app.utils.vocab_store import get_vocab_store
+from app.utils.whatsapp_utils import lookup_definition
+
+
+def headword_index(tmp_path, language="fr"):
+    db = SQLiteDatabase(str(tmp_path / "headwords.sqlite3"))
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS headwords "
+        "(language TEXT NOT NULL, word TEXT NOT NULL, hits INTEGER NOT NULL, updated_at REAL NOT NULL, "
+        "PRIMARY KEY (language, word))"
+    )
+    return HeadwordIndex(db, language)
+
+
+def test_fold_ignores_case_and_accents():
+    assert fold(" Élève ") == fold("eleve") == fold("élevé") == "eleve"
+    assert fold("Cœur") == "coeur"
+
+
+def test_suggestions_rank_accents_then_lookups(tmp_path):
+    index = headword_index(tmp_path)
+    index.learn(["élevé", "berger", "bergère"])
+    index.learn(["élève", "élève"])
+
+    # Same distance once folded: the right accents first, then the most looked up
+    assert index.suggest("éleve") == ["élève", "élevé"]
+    # Two edits away only when nothing is one edit away
+    assert index.suggest("bergr") == ["berger"]
+    assert index.suggest("bargèrre") == ["bergère"]
+    assert index.suggest("xyz") == []
+    # The word itself is not a suggestion
+    assert index.suggest("berger") == ["bergère"]
+
+
+def test_headwords_are_kept_across_restarts(tmp_path):
+    headword_index(tmp_path).learn(["chien"])
+    headword_index(tmp_path).learn(["cheval"], looked_up=False)
+
+    index = headword_index(tmp_path)
+    assert index.knows("Chien") and index.knows("cheval")
+    assert not headword_index(tmp_path, language="en").knows("chien")
+
+
+def test_saved_words_of_a_learner_are_not_suggested_to_others(app, upstream):
+    with app.app_context():
+        get_vocab_store().add_entries([("fr", "bergerie", "noun", "a sheepfold", None)], "15550000002")
+        assert "bergerie" not in did_you_mean("fr", "bergeri")
+
+        # Only words a dictionary defined become headwords
+        extract = "== Français ==\n=== Nom commun ===\nberger\n\nGardien de moutons.\n"
+        upstream.answer(200, {"query": {"pages": {"1": {"title": "berger", "extract": extract}}}})
+        upstream.answer(200, {"query": {"pages": {"-1": {"missing": ""}}}})
+        lookup_definition("fr", "berger (nom commun)")
+        word, _, _, _, error_message = lookup_definition("fr", "bergr (nom commun)")
+
+        assert get_headword_index("fr").knows("berger")
+        assert error_message == "No definition found for the word bergr\nDid you mean *berger*?"
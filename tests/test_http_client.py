@@ -0,0 +1,65 @@
+import http.server
+import threading
+import time
+
+import pytest
+import requests
+
+from app.utils.http_client import CircuitOpenError, HostClient
+
+
+@pytest.fixture
+def server():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_stats_count_the_connections_opened(server):
+    client = HostClient(server, timeout=(1, 1))
+    assert client.stats()["connections_opened"] == 0
+
+    for _ in range(3):
+        assert client.request("GET", f"http://{server}/").status_code == 200
+
+    stats = client.stats()
+    # Kept alive: one connection for the three requests
+    assert stats["connections_opened"] == 1
+    assert stats["requests"] == 3 and stats["in_flight"] == 0
+
+
+def test_breaker_lets_a_trial_through_after_any_failure(server, monkeypatch):
+    client = HostClient(server, timeout=(1, 1), max_retries=0, breaker_threshold=1, breaker_reset=0.05)
+
+    def broken_body(*args, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("connection broken mid-body")
+
+    monkeypatch.setattr(client.session, "request", broken_body)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.request("GET", f"http://{server}/")
+    with pytest.raises(CircuitOpenError):
+        client.request("GET", f"http://{server}/")
+
+    # Half-open: the trial request fails too, which must not leave the breaker waiting for it forever
+    time.sleep(0.06)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.request("GET", f"http://{server}/")
+    monkeypatch.undo()
+    time.sleep(0.06)
+    assert client.request("GET", f"http://{server}/").status_code == 200
+    assert not client.stats()["breaker_open"]
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app.utils.job_queue import JobQueue, MemoryJobBackend, SQLiteJobBackend
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobBackend(str(tmp_path / "jobs.sqlite3"))
+    return MemoryJobBackend()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_each_senders_jobs_run_one_at_a_time_in_order(backend):
+    processed = {}
+    running = set()
+    overlaps = []
+    failed_once = set()
+    lock = threading.Lock()
+
+    def handler(payload):
+        sender, seq = payload["from"], payload["seq"]
+        with lock:
+            if sender in running:
+                overlaps.append(payload)
+            running.add(sender)
+        try:
+            time.sleep(0.002)
+            # The third message of each sender fails once: the ones behind it wait for its retry
+            if seq == 2 and sender not in failed_once:
+                failed_once.add(sender)
+                raise RuntimeError("transient failure")
+            with lock:
+                processed.setdefault(sender, []).append(seq)
+        finally:
+            with lock:
+                running.discard(sender)
+
+    queue = JobQueue(
+        Flask(__name__), backend, handler, workers=4, retry_backoff=0.02, poll_interval=0.01,
+        partition_key=lambda payload: payload["from"],
+    )
+    senders = ["15550000001", "15550000002", "15550000003"]
+    queue.enqueue_many([{"from": sender, "seq": seq} for seq in range(10) for sender in senders])
+    queue.start()
+    try:
+        wait_for(lambda: backend.depth() == 0)
+    finally:
+        queue.stop(timeout=5)
+
+    assert processed == {sender: list(range(10)) for sender in senders}
+    assert overlaps == []
+
+
+def test_failing_job_is_dead_lettered_and_unblocks_its_sender(backend):
+    processed = []
+
+    def handler(payload):
+        if payload["seq"] == 0:
+            raise ValueError("bad message")
+        processed.append(payload["seq"])
+
+    queue = JobQueue(
+        Flask(__name__), backend, handler, workers=2, max_retries=2, retry_backoff=0.01, poll_interval=0.01,
+        partition_key=lambda payload: payload["from"],
+    )
+    queue.enqueue_many([{"from": "15550000001", "seq": seq} for seq in range(3)])
+    queue.start()
+    try:
+        wait_for(lambda: backend.depth() == 0)
+    finally:
+        queue.stop(timeout=5)
+
+    assert processed == [1, 2]
+    dead, = backend.dead_letters()
+    assert dead["payload"]["seq"] == 0 and dead["attempts"] == 2 and dead["error"] == "ValueError: bad message"
+
+
+class FlakyBackend(MemoryJobBackend):
+    # A database locked by another process the first time each call is made
+    def __init__(self):
+        super().__init__()
+        self.failed = set()
+
+    def _flaky(self, name):
+        if name not in self.failed:
+            self.failed.add(name)
+            raise RuntimeError("database is locked")
+
+    def claim(self):
+        self._flaky("claim")
+        return super().claim()
+
+    def complete(self, job_id):
+        self._flaky("complete")
+        return super().complete(job_id)
+
+
+def test_backend_errors_do_not_kill_the_workers():
+    backend = FlakyBackend()
+    processed = []
+    queue = JobQueue(Flask(__name__), backend, lambda payload: processed.append(payload["seq"]), workers=1,
+                     poll_interval=0.01)
+    queue.enqueue_many([{"seq": seq} for seq in range(3)])
+    queue.start()
+    try:
+        # The job whose completion failed stays claimed, the worker moves on to the others
+        wait_for(lambda: processed == [0, 1, 2])
+        assert all(thread.is_alive() for thread in queue._threads)
+    finally:
+        queue.stop(timeout=5)
@@ -0,0 +1,68 @@
+import requests
+
+from app.utils import whatsapp_utils
+from app.utils.http_client import CircuitOpenError
+from app.utils.whatsapp_utils import lookup_definition
+
+
+def test_unreachable_wiktionary_is_reported_and_not_cached(app, upstream):
+    upstream.answer(503)
+    upstream.answer(200, {"query": {"pages": {"-1": {"missing": ""}}}})
+    with app.app_context():
+        word, _, definition, _, error_message = lookup_definition("fr", "berger (noun)")
+        assert (word, definition) == ("berger", None)
+        assert error_message == "Could not reach Wiktionary, please try again later."
+
+        # The next message asks Wiktionary again
+        assert lookup_definition("fr", "berger (noun)")[4].startswith("No definition found for the word berger")
+    assert len(upstream.urls) == 2
+
+
+def test_malformed_wiktionary_payload_is_reported(app, upstream):
+    upstream.answer(200, {"error": {"code": "internal_api_error"}})
+    with app.app_context():
+        assert lookup_definition("fren", "berger (noun)")[4] == "Could not reach Wiktionary, please try again later."
+
+
+def test_word_answered_by_collegiate_goes_there_first_for_another_category(app, upstream):
+    upstream.answer(200, [{"fl": "verb", "shortdef": ["learners' verb"]}])
+    upstream.answer(200, [{"fl": "noun", "shortdef": ["collegiate noun"]}, {"fl": "verb", "shortdef": ["collegiate verb"]}])
+    with app.app_context():
+        assert lookup_definition("en", "bank (noun)")[2] == "collegiate noun"
+        # Not the cached definition (another category), but the learned route: the collegiate answer comes first
+        assert lookup_definition("en", "bank (verb)")[2] == "collegiate verb"
+        assert whatsapp_utils.get_mw_router().stats()["learned_routes"] == 1
+    assert ["learners" in url for url in upstream.urls] == [True, False]
+
+
+def test_unreachable_merriam_webster_is_reported_and_not_cached(app, upstream, caplog):
+    upstream.answer(503)
+    upstream.fail(requests.Timeout("read timed out"))
+    upstream.answer(200, [{"fl": "noun", "shortdef": ["a shore"]}])
+    with app.app_context():
+        word, cat, definition, _, error_message = lookup_definition("en", "bank")
+        assert (word, definition) == ("bank", None)
+        assert error_message == "Could not reach Merriam-Webster, please try again later."
+        assert "Failed to retrieve Merriam-Webster data for bank: [503, None]" in caplog.text
+
+        assert lookup_definition("en", "bank")[2] == "a shore"
+    assert len(upstream.urls) == 3
+
+
+def test_cached_definition_keeps_no_quote_of_an_earlier_message(app, upstream):
+    upstream.answer(200, [{"fl": "noun", "shortdef": ["a shore"]}])
+    with app.app_context():
+        assert lookup_definition("en", 'bank "the river bank"')[3] == "the river bank"
+        # Another thread serving "bank" from memory right now would get the same object
+        assert whatsapp_utils.get_definition_cache().get("parsed", "en", "bank")[1][3] is None
+        assert lookup_definition("en", "bank")[3] is None
+    assert len(upstream.urls) == 1
+
+
+def test_wiktionary_network_errors_are_answered(app, upstream):
+    upstream.fail(requests.ConnectionError("connection refused"))
+    upstream.fail(CircuitOpenError("Circuit breaker open for fr.wiktionary.org"))
+    upstream.answer(200, ValueError("Expecting value: line 1 column 1 (char 0)"))
+    with app.app_context():
+        for _ in range(3):
+            assert lookup_definition("fr", "berger (nom commun)")[4] == "Could not reach Wiktionary, please try again later."
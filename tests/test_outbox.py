@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app.utils import outbox as outbox_module
+from app.utils.outbox import REPLY_SEPARATOR, Outbox
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def graph_api(monkeypatch):
+    """
+    Records the messages posted to the Graph API, answering with `graph_api.responses`, then with 200s.
+    """
+    class GraphAPI:
+        posted = []
+        responses = []
+
+    def http_post(url, json=None, **kwargs):
+        GraphAPI.posted.append(json)
+        return GraphAPI.responses.pop(0) if GraphAPI.responses else FakeResponse(200, {"messages": [{"id": "wamid.x"}]})
+
+    monkeypatch.setattr(outbox_module, "http_post", http_post)
+    return GraphAPI
+
+
+@pytest.fixture
+def outbox(app, tmp_path):
+    return Outbox(app, str(tmp_path / "test_outbox.sqlite3"), rate=100, burst=100, coalesce_window=0.2,
+                  max_attempts=3, retry_backoff=0.01)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def statuses(outbox):
+    return outbox.db.execute("SELECT status, attempts FROM outbox ORDER BY id").fetchall()
+
+
+def test_texts_to_one_recipient_are_coalesced_after_the_window(app, outbox, graph_api):
+    with app.app_context():
+        outbox.send_text("15550000001", "first")
+        outbox.send_text("15550000002", "other learner")
+        outbox.send_text("15550000001", "second")
+
+        # Still within the window: wait for more replies
+        assert 0 < outbox.dispatch() <= 0.2
+        assert graph_api.posted == []
+
+        time.sleep(0.25)
+        outbox.dispatch()
+        wait_for(lambda: outbox.depth() == 0)
+
+    bodies = {message["to"]: message["text"]["body"] for message in graph_api.posted}
+    assert bodies == {"15550000001": f"first{REPLY_SEPARATOR}second", "15550000002": "other learner"}
+    assert outbox.depth() == 0
+
+
+def test_other_messages_are_sent_alone_and_in_order(app, outbox, graph_api):
+    audio = {"messaging_product": "whatsapp", "to": "15550000001", "type": "audio", "audio": {"id": "media"}}
+    with app.app_context():
+        outbox.send_text("15550000001", "before")
+        outbox.send(audio)
+        outbox.send_text("15550000001", "after")
+        for _ in range(3):
+            outbox.dispatch(final=True)
+
+    assert [message["type"] for message in graph_api.posted] == ["text", "audio", "text"]
+    assert [message["text"]["body"] for message in graph_api.posted if message["type"] == "text"] == ["before", "after"]
+
+
+def test_server_errors_are_retried_then_given_up(app, outbox, graph_api):
+    graph_api.responses = [FakeResponse(503, {"error": {"code": 2}})]
+    with app.app_context():
+        outbox.send_text("15550000001", "hello")
+        outbox.dispatch(final=True)
+        assert statuses(outbox) == [("pending", 1)]
+        # Not due again until its backoff is over
+        outbox.dispatch(final=True)
+        assert len(graph_api.posted) == 1
+
+        time.sleep(0.05)
+        outbox.dispatch(final=True)
+        assert len(graph_api.posted) == 2 and outbox.depth() == 0
+
+        graph_api.responses = [FakeResponse(500)] * 3
+        outbox.send_text("15550000001", "lost")
+        for _ in range(3):
+            outbox.dispatch(final=True)
+            time.sleep(0.1)
+    assert statuses(outbox) == [("dead", 2)]
+    assert outbox.dead_count() == 1
+
+
+def test_throttled_messages_wait_for_retry_after_and_are_never_dropped(app, outbox, graph_api):
+    throttled = FakeResponse(400, {"error": {"code": 131056}}, headers={"Retry-After": "1"})
+    graph_api.responses = [throttled] * 4
+    with app.app_context():
+        outbox.send_text("15550000001", "hello")
+        outbox.dispatch(final=True)
+        available_at, = outbox.db.execute("SELECT available_at FROM outbox").fetchone()
+        assert available_at - time.time() > 0.5
+
+        # Past max_attempts, still pending
+        outbox.db.execute("UPDATE outbox SET available_at = 0")
+        for _ in range(3):
+            outbox.dispatch(final=True)
+            outbox.db.execute("UPDATE outbox SET available_at = 0")
+        assert statuses(outbox) == [("pending", 4)]
+
+        outbox.dispatch(final=True)
+    assert outbox.depth() == 0 and len(graph_api.posted) == 5
+
+
+def test_rejected_messages_are_kept_as_dead(app, outbox, graph_api):
+    graph_api.responses = [FakeResponse(400, {"error": {"code": 131026, "message": "Message undeliverable"}})]
+    with app.app_context():
+        outbox.send_text("15550000001", "hello")
+        outbox.dispatch(final=True)
+        outbox.dispatch(final=True)
+    assert statuses(outbox) == [("dead", 0)]
+    assert len(graph_api.posted) == 1
+
+
+def test_slow_or_throttled_recipients_hold_up_no_one(app, tmp_path, monkeypatch):
+    release = threading.Event()
+    posted = []
+
+    def http_post(url, json=None, **kwargs):
+        if json["to"] == "15550000001":
+            # A send stuck until its read timeout
+            release.wait(5)
+        posted.append((json["to"], json["text"]["body"]))
+        return FakeResponse(200)
+
+    monkeypatch.setattr(outbox_module, "http_post", http_post)
+    outbox = Outbox(app, str(tmp_path / "test_outbox.sqlite3"), rate=1, burst=1, coalesce_window=0)
+    with app.app_context():
+        outbox.send_text("15550000001", "slow")
+        outbox.send_text("15550000002", "first")
+        start = time.perf_counter()
+        outbox.dispatch()
+        wait_for(lambda: ("15550000002", "first") in posted)
+        assert time.perf_counter() - start < 1
+
+        # Its token used, the second recipient's next message waits for the next pass rather than blocking this one
+        outbox.send_text("15550000002", "second")
+        outbox.send_text("15550000003", "third")
+        assert 0 < outbox.dispatch() <= 1
+        wait_for(lambda: ("15550000003", "third") in posted)
+        assert ("15550000002", "second") not in posted
+
+        release.set()
+        time.sleep(1)
+        outbox.dispatch(final=True)
+    assert sorted(posted) == [
+        ("15550000001", "slow"), ("15550000002", "first"), ("15550000002", "second"), ("15550000003", "third"),
+    ]
+
+
+def test_lease_is_kept_while_a_send_is_in_flight(app, tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def http_post(url, json=None, **kwargs):
+        release.wait(5)
+        return FakeResponse(200)
+
+    monkeypatch.setattr(outbox_module, "http_post", http_post)
+    path = str(tmp_path / "test_outbox.sqlite3")
+    outbox = Outbox(app, path, coalesce_window=0, poll_interval=0.05, lease_seconds=0.3)
+    other_worker = Outbox(app, path, lease_seconds=0.3)
+    with app.app_context():
+        outbox.send_text("15550000001", "hello")
+    outbox.start()
+    try:
+        time.sleep(1)
+        # Longer than the lease, yet the dispatcher still holds it: another worker can't send the message again
+        assert not other_worker._acquire_lease()
+        release.set()
+        wait_for(lambda: outbox.depth() == 0)
+    finally:
+        release.set()
+        outbox.stop(timeout=5)
@@ -0,0 +1,20 @@
+from app.utils.tenants import DEFAULT_TENANT, TenantRegistry
+
+
+DEFAULT = {"id": DEFAULT_TENANT, "recipient": "+1 555 000 0001", "spreadsheet_key": "sheet", "language": None}
+
+
+def test_unknown_senders_go_to_the_default_learner_unless_ignored(tmp_path):
+    path = str(tmp_path / "tenants.sqlite3")
+    registry = TenantRegistry(path, DEFAULT)
+    registry.register("15550000002", spreadsheet_key="other-sheet")
+
+    assert registry.resolve("15550000001") is DEFAULT
+    assert registry.resolve("15550000002")["spreadsheet_key"] == "other-sheet"
+    assert registry.resolve("15550000009") is DEFAULT
+
+    assert TenantRegistry(path, DEFAULT, unknown_senders="ignore").resolve("15550000009") is None
+
+
+def test_app_keeps_serving_unregistered_senders_by_default(app):
+    assert app.extensions["tenant_registry"].resolve("15550000009")["id"] == DEFAULT_TENANT
@@ -0,0 +1,49 @@
+import subprocess
+
+import pytest
+
+from app.utils import tts_pipeline
+from app.utils.tts_pipeline import transcode_to_opus
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """
+    A stand-in for ffmpeg copying its input to its output, and the processes started from it.
+    """
+    path = tmp_path / "ffmpeg"
+    path.write_text("#!/bin/sh\ncat\n")
+    path.chmod(0o755)
+    processes = []
+    start_process = subprocess.Popen
+
+    def popen(*args, **kwargs):
+        processes.append(start_process(*args, **kwargs))
+        return processes[-1]
+
+    monkeypatch.setattr(tts_pipeline.subprocess, "Popen", popen)
+    return str(path), processes
+
+
+def test_transcode_collects_the_output(fake_ffmpeg):
+    ffmpeg, _ = fake_ffmpeg
+    opus_buffer, timings = transcode_to_opus(iter([b"ab", b"cd"]), ffmpeg=ffmpeg)
+
+    assert opus_buffer.getvalue() == b"abcd"
+    assert set(timings) == {"spawn", "synthesis", "encode_tail", "total"}
+
+
+def test_failed_speech_stream_stops_ffmpeg(fake_ffmpeg):
+    ffmpeg, processes = fake_ffmpeg
+
+    def mp3_chunks():
+        yield b"ab"
+        raise ConnectionError("text-to-speech request failed")
+
+    with pytest.raises(ConnectionError):
+        transcode_to_opus(mp3_chunks(), ffmpeg=ffmpeg)
+
+    process, = processes
+    # Reaped, with its pipes drained and closed
+    assert process.returncode is not None
+    assert process.stdin.closed
@@ -0,0 +1,39 @@
+from app.utils.vocab_store import VocabStore
+
+
+def test_edits_from_a_stale_read_are_refused(tmp_path):
+    store = VocabStore(str(tmp_path / "vocab.sqlite3"))
+    entry_id = store.add_entry("fr", "berger", "noun", "•\xa0 shepherd\n•\xa0 herdsman", None)
+    read_by_first = store.get_entry(entry_id)
+    read_by_second = store.get_entry(entry_id)
+
+    assert store.update_definition(entry_id, "shepherd", read_by_first["version"])
+    # The second edit picked its definition numbers from the old text
+    assert not store.update_definition(entry_id, "herdsman", read_by_second["version"])
+    assert not store.delete_entry(entry_id, read_by_second["version"])
+    assert store.get_entry(entry_id)["definition"] == "shepherd"
+
+    current = store.get_entry(entry_id)
+    assert current["version"] == read_by_first["version"] + 1
+    assert store.delete_entry(entry_id, current["version"])
+    # Only the accepted changes are sent to the sheet
+    assert [op for _, op, _, _ in store.pending_ops(10)] == ["append", "update", "delete"]
+
+
+def test_two_removes_of_the_last_entry_delete_only_one(tmp_path):
+    store = VocabStore(str(tmp_path / "vocab.sqlite3"))
+    store.add_entries([("fr", "berger", "noun", "shepherd", None), ("fr", "chien", "noun", "dog", None)])
+    first, second = store.last_entry(), store.last_entry()
+
+    assert store.delete_entry(first["id"], first["version"])
+    assert not store.delete_entry(second["id"], second["version"])
+    assert store.last_entry()["word"] == "berger"
+
+
+def test_entries_are_scoped_by_tenant(tmp_path):
+    store = VocabStore(str(tmp_path / "vocab.sqlite3"))
+    store.add_entry("fr", "berger", "noun", "shepherd", None, tenant="15550000002")
+
+    assert store.find_latest_by_word("Berger", tenant="15550000002")["definition"] == "shepherd"
+    assert store.find_latest_by_word("berger") is None
+    assert store.last_entry() is None
@@ -0,0 +1,58 @@
+import pytest
+import requests
+
+from app.utils.metrics import get_metrics, traced
+from app.utils.vocab_store import get_vocab_store
+from app.utils.whatsapp_utils import process_whatsapp_message
+
+
+def text_message(body, sender="15550000001"):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "1",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "contacts": [{"wa_id": sender}],
+                    "messages": [{"id": "wamid.1", "from": sender, "type": "text", "text": {"body": body}}],
+                },
+            }],
+        }],
+    }
+
+
+def queued_replies(app):
+    rows = app.extensions["outbox"].db.execute("SELECT recipient, payload FROM outbox ORDER BY id").fetchall()
+    return [tuple(row) for row in rows]
+
+
+@pytest.mark.parametrize("body", ["hello", "hello there", " "])
+def test_unknown_command_is_answered_with_an_error(app, body):
+    with app.app_context():
+        process_whatsapp_message(text_message(body))
+
+    assert queued_replies(app) == [("15550000001", "Error - no action taken.")]
+
+
+def test_free_text_is_counted_under_one_command_label(app):
+    handler = traced(process_whatsapp_message)
+    with app.app_context():
+        for body in ["hello", "bonjour", "Remove nothing-saved"]:
+            handler(text_message(body))
+        rendered = get_metrics().render()
+
+    assert 'vocab_bot_messages_total{command="other",outcome="ok"} 2' in rendered
+    assert 'vocab_bot_messages_total{command="remove",outcome="ok"} 1' in rendered
+    assert "hello" not in rendered and "bonjour" not in rendered
+
+
+def test_unreachable_dictionary_is_answered_and_nothing_saved(app, upstream):
+    upstream.fail(requests.ConnectionError("connection refused"))
+    upstream.fail(requests.ConnectionError("connection refused"))
+    with app.app_context():
+        process_whatsapp_message(text_message("vocab en bank"))
+        assert get_vocab_store().last_entry() is None
+
+    (_, reply), = queued_replies(app)
+    assert reply == "Could not reach Merriam-Webster, please try again later.\n\nNo action taken."